@@ -1,12 +1,19 @@
+import os
+
 import pandas as pd
 
 from shared.constants import OperatorsWithRT
 import weather.pipeline as wp
 import gtfs_regional.pipeline as gp
-import shared.features as sf
+import shared.incremental_features as sif
 
 OPERATOR = OperatorsWithRT.X_TRAFIK
 LIVE_MIN_TRIP_UPDATES_PER_TIMESLOT = 5
+# The API keeps its own live feature state, it never uploads, so it must not advance the state of the live pipeline
+LIVE_STATE_DIR = os.environ.get("API_LIVE_STATE_DIR", "./dev_data/gtfsr_data/api_live_state")
+# Features the delays model expects, in this order
+FEATURE_COLUMNS = ['stop_count', 'temperature_2m', 'apparent_temperature', 'precipitation', 'rain', 'snowfall',
+                   'snow_depth', 'cloud_cover', 'wind_speed_10m', 'wind_speed_100m', 'wind_gusts_10m', 'hour']
 
 
 def _get_live_weather_data(today: str) -> pd.DataFrame:
@@ -35,7 +42,10 @@ def _get_live_delays_data(today: str) -> pd.DataFrame:
         print(f"No stop location data available for {today}. get_live_delays_data exiting.")
         return pd.DataFrame()
 
-    final_metrics = sf.build_feature_group(rt_df, route_types_map_df, stop_count_df=stop_count_df, min_trip_updates_per_slot=LIVE_MIN_TRIP_UPDATES_PER_TIMESLOT)
+    final_metrics, _, state = sif.update_live_features(OPERATOR, today, rt_df, route_types_map_df, stop_count_df,
+                                                       min_trip_updates_per_slot=LIVE_MIN_TRIP_UPDATES_PER_TIMESLOT,
+                                                       state_dir=LIVE_STATE_DIR)
+    state.write()
 
     return final_metrics
 
@@ -63,9 +73,6 @@ def get_live_features(today: str) -> (pd.DataFrame, pd.Series):
     x['hour'] = x['arrival_time_bin'].dt.hour
     x = x.drop(['arrival_time_bin'], axis=1)
 
-    expected_columns = ['stop_count', 'temperature_2m', 'apparent_temperature', 'precipitation', 'rain',
-                        'snowfall', 'snow_depth', 'cloud_cover', 'wind_speed_10m', 'wind_speed_100m',
-                        'wind_gusts_10m', 'hour']
-    x = x[expected_columns]
+    x = x[FEATURE_COLUMNS]
 
     return x, date_col
\ No newline at end of file
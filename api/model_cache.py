@@ -0,0 +1,208 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import typing
+
+from xgboost import XGBRegressor
+
+# Models downloaded from the Hopsworks model registry are kept on disk, so the service starts from the local copy
+# without logging in, and can start offline.
+#
+#   {MODEL_CACHE_DIR}/{name}/manifest.json        {"current": 9, "versions": {"9": {"file": ..., "sha256": ...}}}
+#
+# "current" is the last version that passed the warm-up probe of the service, versions that failed it are marked
+# "rejected" so that no later start serves them again.
+#   {MODEL_CACHE_DIR}/{name}/{version}/model.ubj  Binary (UBJSON) copy of model.json, loads faster than parsing JSON
+MODEL_CACHE_DIR = os.environ.get("MODEL_CACHE_DIR", "./dev_data/model_cache")
+# Check the registry for newer versions in the background while serving the cached one
+MODEL_CHECK_FOR_UPDATES = os.environ.get("MODEL_CHECK_FOR_UPDATES", "False").lower() == "true"
+MODEL_CHECK_INTERVAL_SECONDS = int(os.environ.get("MODEL_CHECK_INTERVAL_SECONDS", 6 * 3600))
+
+UBJ_FILE = "model.ubj"
+JSON_FILE = "model.json"
+
+
+def get_model_dir_path(name: str, version: int, cache_dir=MODEL_CACHE_DIR) -> str:
+    return f"{cache_dir}/{name}/{version}"
+
+
+def get_manifest_path(name: str, cache_dir=MODEL_CACHE_DIR) -> str:
+    return f"{cache_dir}/{name}/manifest.json"
+
+
+def read_manifest(name: str, cache_dir=MODEL_CACHE_DIR) -> dict:
+    path = get_manifest_path(name, cache_dir)
+    if not os.path.exists(path):
+        return {"current": None, "versions": {}}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _write_manifest(manifest: dict, name: str, cache_dir: str) -> None:
+    path = get_manifest_path(name, cache_dir)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def store_model(name: str, version: int, source_dir: str, cache_dir=MODEL_CACHE_DIR) -> str:
+    """
+    Add a downloaded model to the cache. It only becomes the current version once the service has warmed it up,
+    see set_current_version.
+
+    The model.json of the download is converted to UBJ once here, the manifest is only updated after the file is
+    complete, so an interrupted store leaves the manifest as it was.
+
+    Returns:
+        str: Path of the cached model file.
+    """
+    model_dir = get_model_dir_path(name, version, cache_dir)
+    os.makedirs(model_dir, exist_ok=True)
+    model = XGBRegressor()
+    model.load_model(os.path.join(source_dir, JSON_FILE))
+    model_path = os.path.join(model_dir, UBJ_FILE)
+    model.save_model(model_path)
+
+    manifest = read_manifest(name, cache_dir)
+    manifest["versions"][str(version)] = {"file": UBJ_FILE, "sha256": _sha256(model_path),
+                                          "stored_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    _write_manifest(manifest, name, cache_dir)
+    return model_path
+
+
+def set_current_version(name: str, version: int, cache_dir=MODEL_CACHE_DIR) -> None:
+    """Record a cached version as the last one that passed the probe, loaded when no version is given."""
+    manifest = read_manifest(name, cache_dir)
+    if str(version) in manifest["versions"] and manifest["current"] != version:
+        manifest["current"] = version
+        _write_manifest(manifest, name, cache_dir)
+
+
+def reject_version(name: str, version: int, reason: str, cache_dir=MODEL_CACHE_DIR) -> None:
+    """Record that a cached version failed to load or warm up, it is only served again if it is pinned."""
+    manifest = read_manifest(name, cache_dir)
+    entry = manifest["versions"].get(str(version))
+    if entry is None:
+        return
+    entry["rejected"] = reason
+    if manifest["current"] == version:
+        manifest["current"] = None
+    _write_manifest(manifest, name, cache_dir)
+
+
+def is_rejected(name: str, version: int, cache_dir=MODEL_CACHE_DIR) -> bool:
+    return "rejected" in read_manifest(name, cache_dir)["versions"].get(str(version), {})
+
+
+def newest_version(name: str, cache_dir=MODEL_CACHE_DIR) -> typing.Union[int, None]:
+    """The newest cached version that was not rejected, it may not have been warmed up yet."""
+    versions = read_manifest(name, cache_dir)["versions"]
+    return max((int(version) for version, entry in versions.items() if "rejected" not in entry), default=None)
+
+
+def load_cached_model(name: str, version: int = None,
+                      cache_dir=MODEL_CACHE_DIR) -> typing.Union[tuple[XGBRegressor, int], None]:
+    """
+    A model from the cache, the current version (the last one that passed the probe) if version is None.
+
+    Returns:
+        (XGBRegressor, int) | None: The model and its version, None if it is not cached or fails its checksum.
+    """
+    manifest = read_manifest(name, cache_dir)
+    version = manifest["current"] if version is None else version
+    entry = manifest["versions"].get(str(version))
+    if entry is None:
+        return None
+    model_path = os.path.join(get_model_dir_path(name, version, cache_dir), entry["file"])
+    if not os.path.exists(model_path) or _sha256(model_path) != entry["sha256"]:
+        print(f"Cached {name} version {version} is missing or corrupt, ignoring it")
+        return None
+    model = XGBRegressor()
+    model.load_model(model_path)
+    return model, int(version)
+
+
+def _login():
+    import hopsworks
+    if os.environ.get("HOPSWORKS_API_KEY") is None:
+        os.environ["HOPSWORKS_API_KEY"] = open(".hw_key").read()
+    return hopsworks.login()
+
+
+def download_model(name: str, version: int, cache_dir=MODEL_CACHE_DIR) -> str:
+    """Download a model version from the Hopsworks model registry into the cache, see store_model."""
+    mr = _login().get_model_registry()
+    saved_model_dir = mr.get_model(name=name, version=version).download()
+    try:
+        return store_model(name, version, saved_model_dir, cache_dir)
+    finally:
+        shutil.rmtree(saved_model_dir, ignore_errors=True)
+
+
+def latest_registry_version(name: str) -> typing.Union[int, None]:
+    mr = _login().get_model_registry()
+    models = mr.get_models(name=name)
+    return max((model.version for model in models), default=None)
+
+
+def get_model(name: str, version: int = None, cache_dir=MODEL_CACHE_DIR) -> (XGBRegressor, int):
+    """
+    A model from the cache, downloading it first if it is not cached.
+
+    Args:
+        name (str): Name of the model in the registry.
+        version (int, optional): Version to load, the current cached version if None.
+        cache_dir (str): Cache root.
+    """
+    cached = load_cached_model(name, version, cache_dir)
+    if cached is not None:
+        return cached
+    if version is None:
+        version = latest_registry_version(name)
+        if version is None:
+            raise ValueError(f"No versions of {name} in the model registry")
+    print(f"Downloading {name} version {version}")
+    download_model(name, version, cache_dir)
+    return load_cached_model(name, version, cache_dir)
+
+
+def start_update_check(name: str, current_version: int, on_new_version: typing.Callable[[int], None] = None,
+                       interval_seconds=MODEL_CHECK_INTERVAL_SECONDS, cache_dir=MODEL_CACHE_DIR) -> threading.Event:
+    """
+    Check the registry for versions newer than current_version in a daemon thread, until the returned event is set.
+
+    Newer versions are downloaded into the cache, so the next start tries them, and passed to on_new_version.
+    Versions the service rejected are not downloaded again.
+    """
+    stop = threading.Event()
+
+    def run():
+        latest = current_version
+        # The first check runs right away, startup does not wait for it
+        while not stop.is_set():
+            try:
+                version = latest_registry_version(name)
+                if version is not None and version > latest and not is_rejected(name, version, cache_dir):
+                    print(f"Found {name} version {version}, newer than {latest}")
+                    download_model(name, version, cache_dir)
+                    latest = version
+                    if on_new_version is not None:
+                        on_new_version(version)
+            except Exception as e:
+                print(f"Failed to check for new versions of {name}. {e}")
+            stop.wait(interval_seconds)
+
+    threading.Thread(target=run, daemon=True, name="model-update-check").start()
+    return stop
@@ -0,0 +1,186 @@
+import os
+import threading
+import time
+import typing
+
+import numpy as np
+import pandas as pd
+
+import api.model_cache as mc
+
+# How often the model cache manifest is checked for a newer version
+MODEL_WATCH_SECONDS = int(os.environ.get("MODEL_WATCH_SECONDS", 60))
+
+
+class ServedModel:
+    """A loaded model version and how much it has predicted."""
+
+    __slots__ = ('model', 'version', 'loaded_at', 'predictions', 'rows', '_lock')
+
+    def __init__(self, model, version: int):
+        self.model = model
+        self.version = version
+        self.loaded_at = time.time()
+        self.predictions = 0
+        self.rows = 0
+        self._lock = threading.Lock()
+
+    def predict(self, x: pd.DataFrame) -> np.ndarray:
+        predictions = self.model.predict(x)
+        with self._lock:
+            self.predictions += 1
+            self.rows += len(x)
+        return predictions
+
+
+class ModelManager:
+    """
+    Serves one model and swaps in new versions from the model cache without a restart.
+
+    A new version is loaded and warmed up with a fixed probe on the watcher thread while the current one keeps
+    serving. Only a model whose probe predictions have the expected shape and are finite replaces the reference
+    returned by current, callers that took the previous reference finish their predictions on it. The outcome is
+    recorded in the cache manifest: a version that passed becomes its current version, one that failed is rejected
+    and not loaded again, also after a restart.
+
+    Args:
+        name (str): Name of the model in the model cache.
+        probe (pd.DataFrame): Features the warm-up predicts, the same for every version.
+        output_width (int): Number of predicted targets per row a valid model returns.
+        cache_dir (str): Model cache root.
+        watch_seconds (int): Time between checks of the cache manifest.
+    """
+
+    def __init__(self, name: str, probe: pd.DataFrame, output_width: int, cache_dir=mc.MODEL_CACHE_DIR,
+                 watch_seconds=MODEL_WATCH_SECONDS):
+        self.name = name
+        self.probe = probe
+        self.output_width = output_width
+        self.cache_dir = cache_dir
+        self.watch_seconds = watch_seconds
+        self.swaps = []
+        self._current = None
+        # Every model served since the start, for their prediction counts
+        self._served = {}
+        self._swap_lock = threading.Lock()
+        self._check_lock = threading.Lock()
+        self._listeners = []
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    @property
+    def current(self) -> typing.Union[ServedModel, None]:
+        return self._current
+
+    def on_swap(self, listener: typing.Callable[[ServedModel], None]) -> None:
+        """Call listener with the new model after every swap."""
+        self._listeners.append(listener)
+
+    def _warm_up(self, model) -> None:
+        predictions = np.asarray(model.predict(self.probe))
+        expected_shape = (len(self.probe), self.output_width)
+        if predictions.shape != expected_shape:
+            raise ValueError(f"Probe predictions have shape {predictions.shape}, expected {expected_shape}")
+        if not np.isfinite(predictions).all():
+            raise ValueError("Probe predictions are not finite")
+
+    def install(self, model, version: int, load_seconds: float = None) -> ServedModel:
+        """
+        Warm up model and make it the current model, and the current version of the cache manifest.
+
+        Args:
+            model: The loaded model.
+            version (int): Its version.
+            load_seconds (float, optional): How long loading it took, for the swap statistics.
+
+        Raises:
+            ValueError: If the model fails the probe, the current model stays in place and the version is rejected.
+        """
+        started = time.perf_counter()
+        try:
+            self._warm_up(model)
+        except Exception as e:
+            mc.reject_version(self.name, version, str(e), self.cache_dir)
+            raise
+        warmed_up = time.perf_counter()
+        served = ServedModel(model, version)
+        with self._swap_lock:
+            previous = self._current
+            # Replacing the reference is the swap, predictions already running keep their model
+            self._current = served
+            self._served[(version, served.loaded_at)] = served
+            swapped = time.perf_counter()
+        self.swaps.append({
+            "from_version": None if previous is None else previous.version,
+            "to_version": version,
+            "at": served.loaded_at,
+            "load_seconds": load_seconds,
+            "warm_up_seconds": warmed_up - started,
+            "swap_seconds": swapped - warmed_up,
+        })
+        mc.set_current_version(self.name, version, self.cache_dir)
+        print(f"Serving {self.name} version {version}, warm-up took {warmed_up - started:.3f}s")
+        for listener in self._listeners:
+            listener(served)
+        return served
+
+    def check(self) -> typing.Union[ServedModel, None]:
+        """
+        Load and install the newest cached version that was not rejected if it is newer than the one served.
+
+        Returns:
+            ServedModel | None: The newly installed model, None if nothing changed.
+        """
+        with self._check_lock:
+            version = mc.newest_version(self.name, self.cache_dir)
+            current = self._current
+            if version is None or (current is not None and current.version >= version):
+                return None
+            started = time.perf_counter()
+            try:
+                cached = mc.load_cached_model(self.name, version, self.cache_dir)
+                if cached is None:
+                    raise ValueError(f"Version {version} is missing from the model cache or corrupt")
+            except Exception as e:
+                mc.reject_version(self.name, version, str(e), self.cache_dir)
+                raise
+            model, version = cached
+            return self.install(model, version, time.perf_counter() - started)
+
+    def start(self) -> None:
+        """Watch the cache manifest in a daemon thread, see check."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="model-watch")
+        self._thread.start()
+
+    def stop(self, timeout: float = None) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def notify(self, version: int = None) -> None:
+        """Check the manifest now instead of at the next interval, e.g. after a new version was stored."""
+        self._wake.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.watch_seconds)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Failed to swap in a new version of {self.name}, keeping the current one. {e}")
+
+    def stats(self) -> dict:
+        current = self._current
+        return {
+            "name": self.name,
+            "current_version": None if current is None else current.version,
+            "swaps": list(self.swaps),
+            "models": [{"version": served.version, "loaded_at": served.loaded_at, "predictions": served.predictions,
+                        "rows": served.rows} for served in self._served.values()],
+        }
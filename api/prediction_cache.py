@@ -0,0 +1,143 @@
+import asyncio
+import os
+import threading
+import time
+import types
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+from api.single_flight import SingleFlight
+
+# Predictions are computed in the background and served from the latest snapshot, so requests never wait for
+# the GTFS-Regional download, the feature build or the weather forecast.
+REFRESH_SECONDS = int(os.environ.get("PREDICTION_REFRESH_SECONDS", 15 * 60))
+# Retry delay after a failed refresh, the previous snapshot is served in the meantime
+RETRY_SECONDS = int(os.environ.get("PREDICTION_RETRY_SECONDS", 60))
+# How long a request waits for the first snapshot after startup before giving up
+FIRST_SNAPSHOT_TIMEOUT_SECONDS = float(os.environ.get("PREDICTION_FIRST_SNAPSHOT_TIMEOUT_SECONDS", 120))
+
+
+class Snapshot:
+    """Predictions of one refresh, never modified after it was published."""
+
+    __slots__ = ('version', 'bodies', 'created_at')
+
+    def __init__(self, version: int, bodies: dict, created_at: float):
+        object.__setattr__(self, 'version', version)
+        # Encoded response bodies per media type, see api.responses.encode_predictions
+        object.__setattr__(self, 'bodies', types.MappingProxyType(dict(bodies)))
+        object.__setattr__(self, 'created_at', created_at)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Snapshots are immutable")
+
+    def age_seconds(self, now: float = None) -> float:
+        return (time.time() if now is None else now) - self.created_at
+
+
+class PredictionCache:
+    """
+    Keeps the latest predictions in memory and refreshes them on a background thread.
+
+    Stale-while-revalidate: get always returns the latest snapshot at once. A snapshot older than refresh_seconds
+    wakes the refresher early (e.g. after failed refreshes), but is still served until the new one is published.
+
+    Refreshes go through a single-flight layer keyed by key(), so the refresher and requests arriving before the
+    first snapshot share one computation per key instead of each running the feature pipeline.
+
+    Args:
+        compute (typing.Callable): Returns the encoded predictions, called in the executor of flight.
+        key (typing.Callable): Key of the computation compute would run now, e.g. (operator, hour).
+        flight (SingleFlight, optional): Single-flight layer to refresh through, one with a single worker
+            thread if None.
+        refresh_seconds (int): Time between refreshes.
+        retry_seconds (int): Time before the next attempt after a refresh failed.
+    """
+
+    def __init__(self, compute: typing.Callable[[], dict], key: typing.Callable[[], typing.Hashable],
+                 flight: SingleFlight = None, refresh_seconds=REFRESH_SECONDS, retry_seconds=RETRY_SECONDS):
+        self.compute = compute
+        self.key = key
+        if flight is None:
+            flight = SingleFlight(ThreadPoolExecutor(max_workers=1, thread_name_prefix="prediction"))
+        self.flight = flight
+        self.refresh_seconds = refresh_seconds
+        self.retry_seconds = retry_seconds
+        self.last_error = None
+        self._snapshot = None
+        self._version = 0
+        # No early wake-ups before this time, so stale reads cannot trigger more refreshes than retry_seconds allows
+        self._next_attempt = 0.0
+        self._publish_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        """Start refreshing, the first snapshot is computed right away."""
+        self._stop.clear()
+        self._wake.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="prediction-refresh")
+        self._thread.start()
+
+    def stop(self, timeout: float = None) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def refresh(self) -> Snapshot:
+        """Compute and publish a new snapshot, or wait for the one already being computed for the current key."""
+        return self.flight.submit(self.key(), self._compute_and_publish).result()
+
+    def _compute_and_publish(self) -> Snapshot:
+        bodies = self.compute()
+        with self._publish_lock:
+            self._version += 1
+            # Replacing the reference publishes the snapshot, readers see either the old or the new one
+            self._snapshot = Snapshot(self._version, bodies, time.time())
+            return self._snapshot
+
+    async def get(self, timeout: float = FIRST_SNAPSHOT_TIMEOUT_SECONDS) -> typing.Union[Snapshot, None]:
+        """
+        The latest snapshot, waiting up to timeout seconds if there is none yet.
+
+        Returns:
+            Snapshot | None: None if no snapshot was published in time.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            try:
+                # Shielded, a caller giving up must not cancel the computation the others share
+                task = self.flight.run(self.key(), self._compute_and_publish)
+                return await asyncio.wait_for(asyncio.shield(task), timeout)
+            except Exception as e:
+                print(f"No predictions available yet. {e!r}")
+                return self._snapshot
+        if snapshot.age_seconds() > self.refresh_seconds:
+            # Revalidate in the background, the stale snapshot is served meanwhile
+            self._revalidate()
+        return snapshot
+
+    def invalidate(self) -> None:
+        """Refresh now, e.g. after the model changed. The current snapshot is served until the new one is ready."""
+        self._wake.set()
+
+    def _revalidate(self) -> None:
+        if time.time() >= self._next_attempt:
+            self._wake.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._next_attempt = float('inf')
+            try:
+                self.refresh()
+                self.last_error = None
+                delay = self.refresh_seconds
+            except Exception as e:
+                print(f"Failed to refresh predictions, serving the previous snapshot. {e}")
+                self.last_error = e
+                delay = self.retry_seconds
+            self._next_attempt = time.time() + min(delay, self.retry_seconds)
+            self._wake.wait(delay)
+            self._wake.clear()
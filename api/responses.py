@@ -0,0 +1,130 @@
+import gzip
+import os
+import typing
+
+import pandas as pd
+import pyarrow as pa
+from fastapi import Request, Response
+
+JSON = "application/json"
+ARROW = "application/vnd.apache.arrow.stream"
+CSV = "text/csv"
+# Preference order when a client accepts several formats equally, e.g. */*
+MEDIA_TYPES = [JSON, ARROW, CSV]
+
+# Bodies at least this large are also kept gzip compressed, for clients sending Accept-Encoding: gzip
+GZIP_MIN_BYTES = int(os.environ.get("GZIP_MIN_BYTES", 1024))
+GZIP_LEVEL = 6
+
+
+class Body:
+    """One encoding of a snapshot, with its gzip compressed form if it is worth compressing."""
+
+    __slots__ = ('content', 'gzip_content')
+
+    def __init__(self, content: bytes):
+        self.content = content
+        self.gzip_content = gzip.compress(content, GZIP_LEVEL) if len(content) >= GZIP_MIN_BYTES else None
+
+
+def _arrow_ipc(df: pd.DataFrame) -> bytes:
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def encode_predictions(predictions_df: pd.DataFrame) -> dict[str, Body]:
+    """
+    The predictions in every offered media type, encoded once when a snapshot is published instead of per request.
+
+    JSON is a list of records as before, but encoded once, not as a JSON string holding the JSON. Dates are epoch
+    milliseconds in JSON as before, ISO 8601 in CSV and timestamps in Arrow.
+    """
+    return {
+        JSON: Body(predictions_df.to_json(orient='records').encode()),
+        ARROW: Body(_arrow_ipc(predictions_df)),
+        CSV: Body(predictions_df.to_csv(index=False).encode()),
+    }
+
+
+def _weighted(header: str) -> list[tuple[str, float]]:
+    # Values of an Accept style header with their q weights, e.g. "text/csv;q=0.5, */*;q=0.1"
+    values = []
+    for part in header.split(","):
+        value, *params = [item.strip() for item in part.split(";")]
+        if not value:
+            continue
+        weight = 1.0
+        for param in params:
+            name, _, number = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    weight = float(number)
+                except ValueError:
+                    weight = 0.0
+        values.append((value.lower(), weight))
+    return values
+
+
+def negotiate_media_type(accept: typing.Union[str, None]) -> typing.Union[str, None]:
+    """Offered media type the client prefers most, JSON without an Accept header, None if it accepts none."""
+    if not accept:
+        return JSON
+    best, best_weight = None, 0.0
+    for media_type in MEDIA_TYPES:
+        main_type = media_type.split("/")[0]
+        # The most specific matching range decides the weight of a media type
+        weight, specificity = None, -1
+        for value, q in _weighted(accept):
+            match = 2 if value == media_type else 1 if value == f"{main_type}/*" else 0 if value == "*/*" else -1
+            if match > specificity:
+                weight, specificity = q, match
+        if weight is not None and weight > best_weight:
+            best, best_weight = media_type, weight
+    return best
+
+
+def accepts_gzip(accept_encoding: typing.Union[str, None]) -> bool:
+    return any(value in ("gzip", "*") and q > 0 for value, q in _weighted(accept_encoding or ""))
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    # Weak comparison, as for GET requests
+    return "*" in tags or etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+
+def snapshot_response(request: Request, bodies: dict[str, Body], version: str,
+                      headers: dict[str, str]) -> Response:
+    """
+    Response with the representation of a snapshot the request asks for.
+
+    The ETag is derived from the snapshot version and the representation, so clients polling with If-None-Match
+    get an empty 304 until a new snapshot is published.
+
+    Args:
+        request (Request): The request, for its Accept, Accept-Encoding and If-None-Match headers.
+        bodies (dict[str, Body]): Encoded snapshot, see encode_predictions.
+        version (str): Identifies the snapshot, also across restarts of the service.
+        headers (dict[str, str]): Further response headers.
+    """
+    media_type = negotiate_media_type(request.headers.get("accept"))
+    if media_type is None:
+        return Response(f"Supported media types: {', '.join(MEDIA_TYPES)}", status_code=406,
+                        media_type="text/plain")
+
+    body = bodies[media_type]
+    compressed = body.gzip_content is not None and accepts_gzip(request.headers.get("accept-encoding"))
+    headers = dict(headers)
+    headers["ETag"] = f'"{version}-{MEDIA_TYPES.index(media_type)}{"-gzip" if compressed else ""}"'
+    headers["Vary"] = "Accept, Accept-Encoding"
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    if compressed:
+        headers["Content-Encoding"] = "gzip"
+        return Response(body.gzip_content, media_type=media_type, headers=headers)
+    return Response(body.content, media_type=media_type, headers=headers)
@@ -0,0 +1,47 @@
+import asyncio
+import threading
+import typing
+from concurrent.futures import Executor, Future
+
+
+class SingleFlight:
+    """
+    Runs at most one computation per key at a time, callers asking for a key that is in flight share its result.
+
+    Works for threads (submit) and for coroutines (run) alike, so the background refresher and request handlers
+    coalesce on the same computation.
+
+    Args:
+        executor (Executor): Executor the computations run in, dedicated to them so that they never queue behind
+            (or block) the event loop's default threads.
+    """
+
+    def __init__(self, executor: Executor):
+        self.executor = executor
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key: typing.Hashable, fn: typing.Callable, *args) -> Future:
+        """Future of the computation of key, fn(*args) is only started if none is in flight."""
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                return future
+            future = self.executor.submit(fn, *args)
+            self._in_flight[key] = future
+        # Outside the lock: the callback runs right away in this thread if the future is already done
+        future.add_done_callback(lambda f: self._forget(key, f))
+        return future
+
+    async def run(self, key: typing.Hashable, fn: typing.Callable, *args):
+        """Awaitable submit, the event loop stays free while the computation runs."""
+        return await asyncio.wrap_future(self.submit(key, fn, *args))
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._in_flight)
+
+    def _forget(self, key: typing.Hashable, future: Future) -> None:
+        with self._lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
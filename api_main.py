@@ -1,70 +1,160 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 from datetime import datetime
 
 import pandas as pd
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from xgboost import XGBRegressor
 
 import api.live_features as sl
+import api.model_cache as mc
+import api.model_manager as mm
+import api.prediction_cache as pc
+import api.responses as ar
+from api.single_flight import SingleFlight
 
 pd.options.mode.copy_on_write = True
 
 
-delay_models = {}
+# The model is served from the local model cache, see api.model_cache. Without MODEL_VERSION the newest cached
+# version that was not rejected is loaded, falling back to the last one that passed the probe, and
+# DEFAULT_MODEL_VERSION is downloaded if nothing is cached yet.
+MODEL_NAME = os.environ.get("MODEL_NAME", "delays_xgboost_model")
+MODEL_VERSION = int(os.environ["MODEL_VERSION"]) if os.environ.get("MODEL_VERSION") else None
+DEFAULT_MODEL_VERSION = 9
+# Load the model when this module is imported instead of at startup. With `gunicorn --preload -k
+# uvicorn.workers.UvicornWorker -w N api_main:app` the module is imported once before the workers are forked, so
+# they share the loaded booster's memory copy-on-write and start without loading it. (uvicorn --workers starts its
+# workers as fresh processes, where preloading only moves the load earlier.)
+PRELOAD_MODEL = os.environ.get("PRELOAD_MODEL", "False").lower() == "true"
 
+# Targets the delays model predicts, in this order
+PREDICTION_COLUMNS = ["mean_arrival_delay_seconds", "max_arrival_delay_seconds", "mean_departure_delay_seconds",
+                      "max_departure_delay_seconds", "on_time_mean_percent"]
 
-def load_delays_model_from_hw() -> XGBRegressor:
-    import hopsworks
-    if os.environ.get("HOPSWORKS_API_KEY") is None:
-        os.environ["HOPSWORKS_API_KEY"] = open(".hw_key").read()
 
-    project = hopsworks.login()
-    mr = project.get_model_registry()
-    retrieved_model = mr.get_model(
-        name="delays_xgboost_model",
-        version=9,
-    )
-    saved_model_dir = retrieved_model.download()
-    retrieved_xgboost_model = XGBRegressor()
-    retrieved_xgboost_model.load_model(saved_model_dir + "/model.json")
-    return retrieved_xgboost_model
+def load_delays_model() -> (XGBRegressor, int):
+    if MODEL_VERSION is not None:
+        return mc.get_model(MODEL_NAME, MODEL_VERSION)
+    # The newest cached version first, it can be a download the probe has not checked yet
+    version = mc.newest_version(MODEL_NAME)
+    if version is not None:
+        cached = mc.load_cached_model(MODEL_NAME, version)
+        if cached is not None:
+            return cached
+        mc.reject_version(MODEL_NAME, version, "Missing or corrupt")
+    return load_last_good_model()
 
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # Load the models
-    delay_models['delays'] = load_delays_model_from_hw()
-    yield
-    # Clean up the models and release the resources
-    delay_models.clear()
+def load_last_good_model() -> (XGBRegressor, int):
+    # The last version that passed the probe, DEFAULT_MODEL_VERSION if none has yet
+    return mc.load_cached_model(MODEL_NAME) or mc.get_model(MODEL_NAME, DEFAULT_MODEL_VERSION)
 
-app = FastAPI(lifespan=lifespan)
 
-@app.get("/")
-def read_root():
-    return "Root for weather transit delays API"
+# Nothing is predicted before the fork, XGBoost's OpenMP threads only start with the first prediction in a worker
+preloaded_model = load_delays_model() if PRELOAD_MODEL else None
 
 
-@app.get("/predict")
-def get_current_predictions():
+def probe_features() -> pd.DataFrame:
+    # Fixed features every new model version predicts before it is swapped in, one row per hour of a mild day
+    probe = pd.DataFrame(0.0, index=range(24), columns=sl.FEATURE_COLUMNS)
+    probe['stop_count'] = 10.0
+    probe['temperature_2m'] = probe['apparent_temperature'] = 5.0
+    probe['cloud_cover'] = 50.0
+    probe['hour'] = range(24)
+    return probe
+
+
+# Holds the model /predict uses, new versions in the model cache are swapped in while the service runs
+model_manager = mm.ModelManager(MODEL_NAME, probe_features(), len(PREDICTION_COLUMNS))
+
+
+def compute_predictions() -> dict:
     today = datetime.now().strftime("%Y-%m-%d")
     x_df, date_col = sl.get_live_features(today)
 
-    model = delay_models['delays']
+    # Taken once, a swap while this runs does not change the model the snapshot is predicted with
+    model = model_manager.current
     predictions = model.predict(x_df)
-    # Convert predictions to DataFrame
-    output_schema = [
-        {"name": "mean_arrival_delay_seconds", "type": "float64"},
-        {"name": "max_arrival_delay_seconds", "type": "float64"},
-        {"name": "mean_departure_delay_seconds", "type": "float64"},
-        {"name": "max_departure_delay_seconds", "type": "float64"},
-        {"name": "on_time_mean_percent", "type": "float64"}
-    ]
+    predictions_df = pd.DataFrame(predictions, columns=PREDICTION_COLUMNS)
+    # By position, date_col keeps the index of the filtered feature view
+    predictions_df['date'] = date_col.to_numpy()
+
+    return ar.encode_predictions(predictions_df)
+
 
-    predictions_df = pd.DataFrame(predictions, columns=[col["name"] for col in output_schema])
-    predictions_df['date'] = date_col
+def prediction_key() -> tuple:
+    # Requests of the same hour and operator want the same predictions, until another model is swapped in
+    return sl.OPERATOR.value, datetime.now().strftime("%Y-%m-%d %H"), model_manager.current.version
 
-    predictions_json = predictions_df.to_json(orient='records')
 
-    return predictions_json
+# Feature builds run in their own executor, never in the threads Starlette serves requests with. Builds of an
+# operator share its files in dev_data, so one worker runs them one at a time.
+prediction_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prediction")
+prediction_cache = pc.PredictionCache(compute_predictions, prediction_key, SingleFlight(prediction_executor))
+# Predictions of the previous model are served until the new model's snapshot is published
+model_manager.on_swap(lambda served: prediction_cache.invalidate())
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the model, from the local model cache
+    model, version = preloaded_model or load_delays_model()
+    try:
+        model_manager.install(model, version)
+    except Exception as e:
+        if MODEL_VERSION is not None:
+            raise
+        # The version is rejected in the manifest now, the next start does not try it again either
+        print(f"{MODEL_NAME} version {version} failed the probe, serving the last version that passed it. {e}")
+        model_manager.install(*load_last_good_model())
+    stop_update_check = None
+    if MODEL_VERSION is None:
+        # Swap in newer versions stored in the model cache, e.g. by the update check or another process
+        model_manager.start()
+        if mc.MODEL_CHECK_FOR_UPDATES:
+            # Newer versions are downloaded into the cache and swapped in
+            stop_update_check = mc.start_update_check(MODEL_NAME, model_manager.current.version, model_manager.notify)
+    # Predictions are refreshed in the background from here on, requests are served from the latest snapshot
+    prediction_cache.start()
+    yield
+    if stop_update_check is not None:
+        stop_update_check.set()
+    model_manager.stop(timeout=5)
+    prediction_cache.stop(timeout=5)
+    prediction_executor.shutdown(wait=False, cancel_futures=True)
+
+app = FastAPI(lifespan=lifespan)
+
+@app.get("/")
+async def read_root():
+    return "Root for weather transit delays API"
+
+
+@app.get("/predict")
+async def get_current_predictions(request: Request):
+    snapshot = await prediction_cache.get()
+    if snapshot is None:
+        return JSONResponse({"detail": "Predictions are not available yet"}, status_code=503,
+                            headers={"Retry-After": str(pc.RETRY_SECONDS)})
+
+    age = int(snapshot.age_seconds())
+    headers = {
+        "Age": str(age),
+        "X-Snapshot-Version": str(snapshot.version),
+        "X-Snapshot-Created": datetime.fromtimestamp(snapshot.created_at).isoformat(timespec='seconds'),
+        "Cache-Control": f"max-age={max(prediction_cache.refresh_seconds - age, 0)}, "
+                         f"stale-while-revalidate={pc.RETRY_SECONDS}",
+    }
+    # JSON, Arrow IPC or CSV by the Accept header, encoded when the snapshot was published
+    # Versions restart with the service, the creation time keeps ETags of different runs apart
+    version = f"{snapshot.version}.{int(snapshot.created_at)}"
+    return ar.snapshot_response(request, snapshot.bodies, version, headers)
+
+
+@app.get("/models")
+async def get_model_stats():
+    # Served version, swap latencies and predictions per model version
+    return model_manager.stats()
@@ -0,0 +1,85 @@
+"""
+Time the vectorised and the pandas engine of build_feature_group on a parsed KoDa day and check that both give the
+same features. The lagged stop windows are also timed on their own, groupby().rolling() against the prefix-sum
+kernel, for every window in LAG_WINDOWS.
+
+Usage: OPERATOR=xt DATE=2024-09-07 LAG_WINDOWS=3,5,10 python3 -m benchmarks.feature_engine_benchmark
+Needs the day feather and the cached static feed of the date, e.g. from a backfill run with the date.
+"""
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import koda.koda_static_cache as ksc
+import koda.koda_transform as kt
+import shared.feature_kernels as fk
+import shared.features as sf
+import shared.parse as sp
+import shared.storage as ss
+from shared.constants import OperatorsWithRT
+
+OPERATOR = OperatorsWithRT(os.environ.get("OPERATOR", OperatorsWithRT.X_TRAFIK.value))
+DATE = os.environ.get("DATE", "2024-09-07")
+# Relative tolerance of the comparison, the engines only differ in floating point summation order
+RTOL = float(os.environ.get("RTOL", 1e-9))
+
+
+def run(engine: str, rt_df: pd.DataFrame, route_types_map_df: pd.DataFrame,
+        stop_count_df: pd.DataFrame) -> (pd.DataFrame, float):
+    start = time.perf_counter()
+    final_metrics = sf.build_feature_group(rt_df.copy(), route_types_map_df.copy(), stop_count_df.copy(),
+                                           engine=engine)
+    return final_metrics, time.perf_counter() - start
+
+
+def run_lags(rt_df: pd.DataFrame, route_types_map_df: pd.DataFrame) -> None:
+    rows = sf.latest_trip_updates_with_route_types(rt_df.copy(), route_types_map_df.copy())
+    rows = rows.sort_values(by=['trip_id', 'stop_sequence'])
+    rows['delay_change'] = rows.groupby('trip_id', observed=True)['arrival_delay'].diff()
+    columns = ['arrival_delay', 'departure_delay', 'delay_change']
+
+    start = time.perf_counter()
+    expected = sf.windowed_lagged_features(rows.set_index('arrival_time'), columns)
+    rolling_seconds = time.perf_counter() - start
+
+    # The groups of groupby(['route_type', 'trip_id']) as contiguous segments
+    rows = rows.iloc[np.argsort(rows['route_type'].to_numpy(), kind='stable')]
+    start = time.perf_counter()
+    trip_starts = fk.segment_starts(rows['trip_id'].cat.codes.to_numpy())
+    lags = {column: fk.segment_lag_means(rows[column].to_numpy(np.float64, na_value=np.nan), trip_starts,
+                                         sf.LAG_WINDOWS) for column in columns}
+    kernel_seconds = time.perf_counter() - start
+
+    print(f"Lag windows {sf.LAG_WINDOWS}:")
+    print(f"rolling:    {rolling_seconds:8.3f}s")
+    print(f"kernel:     {kernel_seconds:8.3f}s ({rolling_seconds / kernel_seconds:.1f}x)")
+    for window in sf.LAG_WINDOWS:
+        for column in columns:
+            np.testing.assert_allclose(lags[column][window], expected[f'{column}_lag_{window}stops'], rtol=RTOL)
+
+
+if __name__ == "__main__":
+    pd.options.mode.copy_on_write = True
+    rt_df = sp.compact_trip_updates(ss.read_feather(kt.get_day_feather_path(OPERATOR.value, DATE)))
+    feed_key = ksc.find_feed_key(OPERATOR, DATE)
+    if feed_key is None:
+        raise SystemExit(f"No cached static feed for {OPERATOR.value} on {DATE}")
+    route_types_map_df, stop_count_df, _ = ksc.read_static_feed(OPERATOR, feed_key, DATE)
+    print(f"{OPERATOR.value} {DATE}: {len(rt_df)} trip updates")
+
+    expected, pandas_seconds = run(sf.PANDAS, rt_df, route_types_map_df, stop_count_df)
+    actual, vectorised_seconds = run(sf.VECTORISED, rt_df, route_types_map_df, stop_count_df)
+    print(f"pandas:     {pandas_seconds:8.3f}s")
+    print(f"vectorised: {vectorised_seconds:8.3f}s ({pandas_seconds / vectorised_seconds:.1f}x)")
+
+    for column in expected.keys():
+        if expected[column].dtype.kind == 'f':
+            difference = np.abs(expected[column] - actual[column]).max()
+            print(f"{column:<45} max abs difference {difference:.3g}")
+    pd.testing.assert_frame_equal(expected, actual, check_exact=False, rtol=RTOL)
+    print(f"Features match within rtol={RTOL}")
+
+    run_lags(rt_df, route_types_map_df)
+    print(f"Lagged means match within rtol={RTOL}")
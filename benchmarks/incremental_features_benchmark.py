@@ -0,0 +1,62 @@
+"""
+Replay a parsed KoDa day as a series of live snapshots through the incremental live feature engine, and check
+that the result equals build_feature_group on the whole day.
+
+Usage: OPERATOR=xt DATE=2024-09-07 STEP_MINUTES=15 python3 -m benchmarks.incremental_features_benchmark
+Needs the day feather and the cached static feed of the date, e.g. from a backfill run with the date.
+"""
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import koda.koda_static_cache as ksc
+import koda.koda_transform as kt
+import shared.features as sf
+import shared.incremental_features as sif
+import shared.parse as sp
+import shared.storage as ss
+from shared.constants import OperatorsWithRT
+
+OPERATOR = OperatorsWithRT(os.environ.get("OPERATOR", OperatorsWithRT.X_TRAFIK.value))
+DATE = os.environ.get("DATE", "2024-09-07")
+# Time between two snapshots, and how far back the updates of a snapshot go, like the realtime feed that only
+# holds the current trips
+STEP_MINUTES = int(os.environ.get("STEP_MINUTES", 15))
+SNAPSHOT_MINUTES = int(os.environ.get("SNAPSHOT_MINUTES", 60))
+# Relative tolerance of the comparison, the hours are only summed in a different order
+RTOL = float(os.environ.get("RTOL", 1e-9))
+
+
+if __name__ == "__main__":
+    pd.options.mode.copy_on_write = True
+    rt_df = sp.compact_trip_updates(ss.read_feather(kt.get_day_feather_path(OPERATOR.value, DATE)))
+    feed_key = ksc.find_feed_key(OPERATOR, DATE)
+    if feed_key is None:
+        raise SystemExit(f"No cached static feed for {OPERATOR.value} on {DATE}")
+    route_types_map_df, stop_count_df, _ = ksc.read_static_feed(OPERATOR, feed_key, DATE)
+    print(f"{OPERATOR.value} {DATE}: {len(rt_df)} trip updates")
+
+    timestamps = rt_df['timestamp'].to_numpy(np.int64)
+    seconds = []
+    with tempfile.TemporaryDirectory() as state_dir:
+        for end in range(int(timestamps.min()) + STEP_MINUTES * 60, int(timestamps.max()) + STEP_MINUTES * 60,
+                         STEP_MINUTES * 60):
+            snapshot_df = rt_df[(timestamps > end - SNAPSHOT_MINUTES * 60) & (timestamps <= end)]
+            start = time.perf_counter()
+            actual, _, state = sif.update_live_features(OPERATOR, DATE, snapshot_df, route_types_map_df,
+                                                        stop_count_df, state_dir=state_dir)
+            state.write()
+            seconds.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    expected = sf.build_feature_group(rt_df, route_types_map_df.copy(), stop_count_df.copy())
+    full_seconds = time.perf_counter() - start
+    print(f"{len(seconds)} snapshots every {STEP_MINUTES} minutes: {np.mean(seconds) * 1000:.1f}ms mean, "
+          f"{np.max(seconds) * 1000:.1f}ms max per snapshot")
+    print(f"build_feature_group on the whole day: {full_seconds * 1000:.1f}ms")
+
+    pd.testing.assert_frame_equal(expected, actual, check_exact=False, rtol=RTOL)
+    print(f"Features match build_feature_group within rtol={RTOL}")
@@ -0,0 +1,76 @@
+"""
+Compare the direct protobuf-to-columnar TripUpdates decoder against the JSON round trip path.
+
+Usage: PB_PATH=./dev_data/koda_data/xt_rt_2024_09_07 python3 -m benchmarks.pb_decode_benchmark
+"""
+import os
+import time
+
+import pandas as pd
+
+import koda.koda_parse as kp
+import koda.koda_transform as kt
+import shared.parse as sp
+
+PB_PATH = os.environ.get("PB_PATH", kp.DATA_DIR)
+MAX_FILES = int(os.environ.get("MAX_FILES", 240))
+
+
+def list_pb_files(path: str, max_files: int) -> list[str]:
+    if os.path.isfile(path):
+        return [path]
+    file_list = []
+    for root, _, files in os.walk(path):
+        for file in sorted(files):
+            if file.endswith(".pb"):
+                file_list.append(os.path.join(root, file))
+    return sorted(file_list)[:max_files]
+
+
+def read_json_path(file_path: str) -> pd.DataFrame:
+    df = sp.read_pb_to_dataframe(file_path)
+    df.rename(columns=dict((k, k.replace('.', '_')) for k in df.keys() if '.' in k), inplace=True)
+    kt.normalize_keys(df)
+    return df
+
+
+def to_comparable(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.dropna(axis=1, how='all')
+    for k in df.keys():
+        if k in sp.TRIP_UPDATE_NUMERIC_COLUMNS:
+            df[k] = pd.to_numeric(df[k]).astype('float64')
+        else:
+            df[k] = df[k].where(df[k].notna(), None)
+    return df[sorted(df.keys())].reset_index(drop=True)
+
+
+def time_reader(reader, file_list: list[str]) -> (float, list[pd.DataFrame]):
+    start = time.perf_counter()
+    frames = [reader(file_path) for file_path in file_list]
+    return time.perf_counter() - start, frames
+
+
+if __name__ == "__main__":
+    pd.options.mode.copy_on_write = True
+    pb_files = list_pb_files(PB_PATH, MAX_FILES)
+    if not pb_files:
+        raise SystemExit(f"No .pb files found in {PB_PATH}")
+
+    json_seconds, json_frames = time_reader(read_json_path, pb_files)
+    direct_seconds, direct_frames = time_reader(sp.read_trip_updates_pb_to_dataframe, pb_files)
+
+    mismatches = 0
+    for file_path, json_df, direct_df in zip(pb_files, json_frames, direct_frames):
+        if json_df.empty and direct_df.empty:
+            continue
+        try:
+            pd.testing.assert_frame_equal(to_comparable(json_df), to_comparable(direct_df), check_dtype=False)
+        except AssertionError as e:
+            mismatches += 1
+            print(f"Mismatch in {file_path}: {e}")
+
+    rows = sum(len(df) for df in direct_frames)
+    print(f"Files: {len(pb_files)}, rows: {rows}, mismatches: {mismatches}")
+    print(f"JSON round trip: {json_seconds:.3f}s ({len(pb_files) / json_seconds:.1f} files/s)")
+    print(f"Direct decoder:  {direct_seconds:.3f}s ({len(pb_files) / direct_seconds:.1f} files/s)")
+    print(f"Speedup: {json_seconds / direct_seconds:.1f}x")
@@ -0,0 +1,58 @@
+"""
+Measure snapshot parsing throughput of the process pool in files/sec per core: one pickled DataFrame per file
+versus batches of files returned as Arrow IPC.
+
+Usage: PB_PATH=./dev_data/koda_data/xt_rt_2024_09_07 USE_PROCESSES=4 python3 -m benchmarks.rt_parse_pool_benchmark
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import koda.koda_parse as kp
+import koda.koda_transform as kt
+from benchmarks.pb_decode_benchmark import list_pb_files
+from shared.constants import FeedType
+
+PB_PATH = os.environ.get("PB_PATH", kp.DATA_DIR)
+MAX_FILES = int(os.environ.get("MAX_FILES", 960))
+USE_PROCESSES = int(os.environ.get("USE_PROCESSES", max(os.cpu_count() - 2, 1)))
+BATCH_SIZES = [int(size) for size in os.environ.get("BATCH_SIZES", "4,16,64").split(",")]
+
+
+def parse_per_file(file_list: list[str], executor: ProcessPoolExecutor) -> pd.DataFrame:
+    future_list = [executor.submit(kt._read_pb_file_helper, file_path, FeedType.TRIP_UPDATES)
+                   for file_path in file_list]
+    return kt._reduce_frames([future.result() for future in future_list])
+
+
+def parse_batched(file_list: list[str], executor: ProcessPoolExecutor, files_per_task: int) -> pd.DataFrame:
+    return kt._read_pb_batches(file_list, FeedType.TRIP_UPDATES, executor, files_per_task)
+
+
+def report(name: str, seconds: float, n_files: int, n_rows: int) -> None:
+    files_per_second = n_files / seconds
+    print(f"{name:<24} {seconds:8.3f}s {files_per_second:10.1f} files/s "
+          f"{files_per_second / USE_PROCESSES:8.1f} files/s/core  rows: {n_rows}")
+
+
+if __name__ == "__main__":
+    pd.options.mode.copy_on_write = True
+    pb_files = list_pb_files(PB_PATH, MAX_FILES)
+    if not pb_files:
+        raise SystemExit(f"No .pb files found in {PB_PATH}")
+    print(f"Parsing {len(pb_files)} files with {USE_PROCESSES} processes")
+
+    with ProcessPoolExecutor(max_workers=USE_PROCESSES) as executor:
+        # Warm up the workers so process start-up is not measured
+        parse_batched(pb_files[:USE_PROCESSES], executor, 1)
+
+        start = time.perf_counter()
+        df = parse_per_file(pb_files, executor)
+        report("per file (pickle)", time.perf_counter() - start, len(pb_files), len(df))
+
+        for batch_size in BATCH_SIZES:
+            start = time.perf_counter()
+            df = parse_batched(pb_files, executor, batch_size)
+            report(f"batches of {batch_size} (arrow)", time.perf_counter() - start, len(pb_files), len(df))
@@ -0,0 +1,67 @@
+"""
+Measure write and read throughput of the hot (uncompressed, memory-mapped) and cold (zstd 9) storage tiers, and
+the cost of demoting a file from one to the other.
+
+Usage: FEATHER_PATH=./dev_data/koda_data/xt_rt_2024_09_07/2024-09-07.feather python3 -m benchmarks.storage_tier_benchmark
+"""
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+import koda.koda_transform as kt
+import shared.storage as ss
+from shared.constants import OperatorsWithRT
+
+FEATHER_PATH = os.environ.get("FEATHER_PATH", kt.get_day_feather_path(OperatorsWithRT.X_TRAFIK.value, "2024-09-07"))
+REPEATS = int(os.environ.get("REPEATS", 5))
+
+
+def best_of(func, repeats=REPEATS) -> float:
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+    return min(seconds)
+
+
+def scan(df: pd.DataFrame) -> None:
+    # Touch every value, so lazily paged-in memory maps are measured too
+    for k in df.keys():
+        column = df[k]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            column.cat.codes.sum()
+        elif pd.api.types.is_numeric_dtype(column.dtype):
+            column.sum()
+        else:
+            column.str.len().sum()
+
+
+def report(name: str, seconds: float, n_bytes: int, file_size: int = None) -> None:
+    size = f"  file: {file_size / 2 ** 20:8.2f} MiB" if file_size is not None else ""
+    print(f"{name:<24} {seconds * 1000:9.1f}ms {n_bytes / 2 ** 20 / seconds:9.1f} MiB/s{size}")
+
+
+if __name__ == "__main__":
+    df = pd.read_feather(FEATHER_PATH)
+    n_bytes = int(df.memory_usage(deep=True).sum())
+    print(f"{FEATHER_PATH}: {len(df)} rows, {n_bytes / 2 ** 20:.2f} MiB in memory, best of {REPEATS}")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for tier in [ss.HOT, ss.COLD]:
+            path = os.path.join(tmp_dir, f"{tier}.feather")
+            seconds = best_of(lambda: ss.write_feather(df, path, tier=tier))
+            report(f"{tier} write", seconds, n_bytes, os.path.getsize(path))
+            report(f"{tier} read", best_of(lambda: ss.read_feather(path)), n_bytes)
+            report(f"{tier} read + scan", best_of(lambda: scan(ss.read_feather(path))), n_bytes)
+
+        path = os.path.join(tmp_dir, "demoted.feather")
+
+        def demote():
+            ss.write_feather(df, path, tier=ss.HOT)
+            ss.demote_file(path)
+
+        # Includes the hot write, subtract the hot write time above for the demotion alone
+        report("hot write + demotion", best_of(demote), n_bytes, os.path.getsize(path))
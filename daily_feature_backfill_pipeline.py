@@ -1,11 +1,14 @@
 import os
 import time
+from concurrent.futures import ProcessPoolExecutor
 
 import hopsworks
 import pandas as pd
 
-from koda_backfill_feature_pipeline import backfill_date as backfill_date_koda
+from koda_backfill_feature_pipeline import OPERATORS, backfill_stages, get_delays_feature_groups
 from shared.file_logger import setup_logger
+from shared.stages import FairExecutor, StageFailure, run_stages
+import koda.koda_pipeline as kp
 import shared.features as sf
 import weather.pipeline as wp
 
@@ -47,7 +50,7 @@ if __name__ == "__main__":
 
     start_time = time.time()
 
-    delays_fg = None
+    delays_fgs = {}
     weather_fg = None
     if not DRY_RUN:
         if os.environ.get("HOPSWORKS_API_KEY") is None:
@@ -55,13 +58,7 @@ if __name__ == "__main__":
         try:
             project = hopsworks.login()
             fs = project.get_feature_store()
-            delays_fg = fs.get_or_create_feature_group(
-                name='delays',
-                description='Aggregated delay metrics per hour per day',
-                version=DELAYS_FG_VERSION,
-                primary_key=['arrival_time_bin', 'route_type'],
-                event_time='arrival_time_bin'
-            )
+            delays_fgs = get_delays_feature_groups(fs, OPERATORS, DELAYS_FG_VERSION)
             weather_fg = fs.get_or_create_feature_group(
                 name='weather',
                 description='Hourly weather data for Gävle',
@@ -74,15 +71,28 @@ if __name__ == "__main__":
 
     logger.info("Starting backfill process for yesterday: %s", yesterday_str)
 
-    delays_exit_code, job = backfill_date_koda(yesterday_str, fg=delays_fg, dry_run=DRY_RUN)
-    if delays_exit_code == -1:
-        logger.info("Delay dry run completed for date: %s", yesterday_str)
-    if delays_exit_code == 0 and job is not None:
-        logger.info("Running offline materialization jobs")
-        try:
-            job.run(await_termination=False)
-        except Exception as e:
-            logger.error(f"Failed to run offline materialization job. Skipping. {e}")
+    # All operators run through the backfill stages together, sharing the process pool
+    delays_exit_code = -1 if DRY_RUN else 0
+    with ProcessPoolExecutor(max_workers=kp.USE_PROCESSES) as executor:
+        stages = backfill_stages(delays_fgs, DRY_RUN, FairExecutor(executor, kp.USE_PROCESSES))
+        for result in run_stages([(operator, yesterday_str) for operator in OPERATORS], stages):
+            if isinstance(result, StageFailure):
+                operator, _ = result.item
+                logger.error("Failed %s stage for %s on date: %s. %s", result.stage, operator.value, yesterday_str,
+                             result.error)
+                delays_exit_code = max(delays_exit_code, 3)
+                continue
+            (operator, _), (exit_code, job) = result
+            if exit_code == -1:
+                logger.info("Delay dry run completed for %s on date: %s", operator.value, yesterday_str)
+            if exit_code == 0 and job is not None:
+                logger.info("Running offline materialization jobs for %s", operator.value)
+                try:
+                    job.run(await_termination=False)
+                except Exception as e:
+                    logger.error(f"Failed to run offline materialization job. Skipping. {e}")
+            # Report the worst exit code of all operators
+            delays_exit_code = max(delays_exit_code, exit_code)
 
 
     weather_exit_code = backfill_recent_days(yesterday_str, yesterday_str, fg=weather_fg, dry_run=DRY_RUN)
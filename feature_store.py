@@ -1,20 +1,20 @@
-import os
 import pandas as pd
 
-loc_weather = os.path.join("dev_data", "openmeteo_data", "weather.db.pickle")
+import weather.store as ws
+from shared.constants import GAEVLE_LONGITUDE, GAEVLE_LATITUDE
 
+# The weather of Gävle now lives in the local weather store (weather.store) instead of a pickle that was rewritten
+# on every upsert. Import the former pickle with python3 -m weather.store
 
-def load_weather():
-    return pd.read_pickle(loc_weather)
 
-
-def upsert_weather(other_df):
-    if not os.path.exists(loc_weather):
-        new_df = other_df.copy()
-        new_df.set_index("date")
-    else:
-        current_df = pd.read_pickle(loc_weather)
-        new_df = current_df.combine_first(other_df)
-    new_df.to_pickle(loc_weather)
+def load_weather() -> pd.DataFrame:
+    coverage = ws.read_coverage(ws.ARCHIVE, GAEVLE_LONGITUDE, GAEVLE_LATITUDE)
+    if not coverage:
+        return ws.read_weather(ws.ARCHIVE, GAEVLE_LONGITUDE, GAEVLE_LATITUDE, "1970-01-01", "1970-01-01")
+    start_date = pd.Timestamp(coverage[0][0] * 3600, unit='s').strftime('%Y-%m-%d')
+    end_date = pd.Timestamp((coverage[-1][1] - 1) * 3600, unit='s').strftime('%Y-%m-%d')
+    return ws.read_weather(ws.ARCHIVE, GAEVLE_LONGITUDE, GAEVLE_LATITUDE, start_date, end_date)
 
 
+def upsert_weather(other_df):
+    ws.import_weather(other_df, GAEVLE_LONGITUDE, GAEVLE_LATITUDE)
@@ -3,7 +3,7 @@ import sys
 import warnings
 
 from shared.constants import FeedType, OperatorsWithRT
-from shared.api import fetch_with_exponential_backoff
+from shared.api import download_to_file
 
 try:
     gtfsr_rt_key = os.environ.get("GTRFSR_RT_API_KEY")
@@ -50,18 +50,10 @@ def fetch_gtfs_archive(url, target_path, force=False):
         print("File already exists.")
         return target_path
 
-    response = fetch_with_exponential_backoff(url, API_TIMEOUT, MAX_RETRIES)
-    if response is None:
-        return None
-
-    if response.status_code == 200:
-        with open(target_path, "wb") as file:
-            file.write(response.content)
-        print("File is ready.")
-    else:
-        print(f"Error: {response.status_code}")
-        print(response.text)
+    # A forced download fetches a newer version of the file, so a leftover partial download cannot be resumed
+    if not download_to_file(url, target_path, API_TIMEOUT, MAX_RETRIES, resume=not force):
         return None
+    print("File is ready.")
     return target_path
 
 
@@ -7,6 +7,8 @@ import gtfs_regional.fetch as gf
 import gtfs_regional.parse as gpa
 import gtfs_regional.transform as gt
 import shared.parse as sp
+import shared.storage as ss
+import shared.rt_store as rs
 import shared.transform as st
 from shared.constants import FeedType, OperatorsWithRT, StaticDataTypes
 
@@ -16,7 +18,7 @@ def get_rt_data(operator: OperatorsWithRT, date: str, force=False) -> pd.DataFra
     if pb_path is None:
         raise ValueError(f"Failed to fetch realtime data for {operator.value} on {date}")
 
-    raw_rt_df = sp.read_pb_to_dataframe(pb_path)
+    raw_rt_df = sp.read_trip_updates_pb_to_dataframe(pb_path)
     rt_df = gt.parse_live_pb(operator, raw_rt_df, force=force)
     return rt_df
 
@@ -50,52 +52,57 @@ pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame):
 
     stop_location_map_feather_path = gt.get_stop_location_map_feather_path(operator.value)
 
-    if os.path.exists(rt_feather_path) and last_updated == date and not force_rt:
+    rt_fetched = not (os.path.exists(rt_feather_path) and last_updated == date and not force_rt)
+    if not rt_fetched:
         print(f"Reading existing data for {date} {rt_feather_path}")
-        rt_df = pd.read_feather(rt_feather_path)
+        rt_df = ss.read_feather(rt_feather_path)
     else:
         print(f"Fetching realtime data for {operator.value} on {date}")
         rt_df = get_rt_data(operator, date, force=force_rt)
 
     if os.path.exists(route_types_map_df_feather_path) and last_updated == date:
         print(f"Reading existing data for {date} {route_types_map_df_feather_path}")
-        route_types_map_df = pd.read_feather(route_types_map_df_feather_path)
+        route_types_map_df = ss.read_feather(route_types_map_df_feather_path)
     else:
         # NOTE: We only get 50 API hits per month, so we're keeping the archive for now
         # TODO: Remove archive in production or else it will accumulate every day
         print(f"Fetching static data for {operator.value} on {date} for route types map")
         get_static_data(date, operator, remove_archive_after=False)
-        trips_df = sp.read_static_data_to_dataframe(operator, StaticDataTypes.TRIPS, date, gpa.DATA_DIR)
-        routes_df = sp.read_static_data_to_dataframe(operator, StaticDataTypes.ROUTES, date, gpa.DATA_DIR)
-        trips_df.to_feather(trips_df_feather_path, compression='zstd', compression_level=9)
-        routes_df.to_feather(routes_df_feather_path, compression='zstd', compression_level=9)
+        trips_df = sp.read_typed_static_data_to_dataframe(operator, StaticDataTypes.TRIPS, date, gpa.DATA_DIR)
+        routes_df = sp.read_typed_static_data_to_dataframe(operator, StaticDataTypes.ROUTES, date, gpa.DATA_DIR)
+        ss.write_feather(trips_df, trips_df_feather_path)
+        ss.write_feather(routes_df, routes_df_feather_path)
         route_types_map_df = st.create_route_types_map_df(trips_df, routes_df)
-        route_types_map_df.to_feather(route_types_map_df_feather_path, compression='zstd', compression_level=9)
+        ss.write_feather(route_types_map_df, route_types_map_df_feather_path)
 
     if os.path.exists(stop_count_df_feather_path) and last_updated == date:
         print(f"Reading existing data for {date} {stop_count_df_feather_path}")
-        stop_count_df = pd.read_feather(stop_count_df_feather_path)
+        stop_count_df = ss.read_feather(stop_count_df_feather_path)
     else:
         # NOTE: We only get 50 API hits per month, so we're keeping the archive for now
         # TODO: Remove archive in production or else it will accumulate every day
         print(f"Fetching static data for {operator.value} on {date}  for stop count")
         get_static_data(date, operator, remove_archive_after=False)
-        stop_times_df = sp.read_static_data_to_dataframe(operator, StaticDataTypes.STOP_TIMES, date, gpa.DATA_DIR)
-        stop_times_df.to_feather(stop_times_df_feather_path, compression='zstd', compression_level=9)
+        stop_times_df = sp.read_typed_static_data_to_dataframe(operator, StaticDataTypes.STOP_TIMES, date, gpa.DATA_DIR)
+        ss.write_feather(stop_times_df, stop_times_df_feather_path)
         stop_count_df = st.create_stop_count_df(date, stop_times_df, route_types_map_df)
-        stop_count_df.to_feather(stop_count_df_feather_path, compression='zstd', compression_level=9)
+        ss.write_feather(stop_count_df, stop_count_df_feather_path)
 
     if os.path.exists(stop_location_map_feather_path) and last_updated == date:
         print(f"Reading existing data for {date} {stop_location_map_feather_path}")
-        stop_location_map_df = pd.read_feather(stop_location_map_feather_path)
+        stop_location_map_df = ss.read_feather(stop_location_map_feather_path)
     else:
         # NOTE: We only get 50 API hits per month, so we're keeping the archive for now
         # TODO: Remove archive in production or else it will accumulate every day
         print(f"Fetching static data for {operator.value} on {date} for stops")
         get_static_data(date, operator, remove_archive_after=False)
-        stops_df = sp.read_static_data_to_dataframe(operator, StaticDataTypes.STOPS, date, gpa.DATA_DIR)
+        stops_df = sp.read_typed_static_data_to_dataframe(operator, StaticDataTypes.STOPS, date, gpa.DATA_DIR)
         stop_location_map_df = st.create_stop_location_map_df(stops_df)
-        stop_location_map_df.to_feather(stop_location_map_feather_path, compression='zstd', compression_level=9)
+        ss.write_feather(stop_location_map_df, stop_location_map_feather_path)
+
+    if rs.WRITE_RT_STORE and rt_fetched:
+        # Every fetch is a new snapshot of the day, compact_rt_store merges the resulting small files
+        rs.write_rt_partition(rt_df, operator, date, route_types_map_df, append=True)
 
     gt.write_last_updated(operator, date)
 
@@ -4,6 +4,8 @@ import numpy as np
 import pandas as pd
 
 from shared.constants import OperatorsWithRT
+import shared.parse as sp
+import shared.storage as ss
 from koda.koda_transform import sanitise_array
 
 DATA_DIR = "./dev_data/gtfsr_data"
@@ -58,7 +60,7 @@ def read_last_updated(operator: OperatorsWithRT) -> str:
 def parse_live_pb(operator: OperatorsWithRT, raw_df: pd.DataFrame, force=False) -> pd.DataFrame:
     feather_path = get_rt_feather_path(operator.value)
     if os.path.exists(feather_path) and not force:
-        return pd.read_feather(feather_path)
+        return ss.read_feather(feather_path)
 
     # Force casts:
     castings = {}
@@ -76,10 +78,11 @@ def parse_live_pb(operator: OperatorsWithRT, raw_df: pd.DataFrame, force=False)
 
     # Clean up duplicates, fix keys, etc
     sanitise_array(raw_df)
+    raw_df = sp.compact_trip_updates(raw_df)
 
     if raw_df.empty:  # Feather does not support a DF without columns, so add a dummy one
         raw_df['_'] = np.zeros(len(raw_df), dtype=np.bool_)
 
     raw_df.reset_index(inplace=True)
-    raw_df.to_feather(feather_path, compression='zstd', compression_level=9)
+    ss.write_feather(raw_df, feather_path)
     return raw_df
\ No newline at end of file
@@ -1,12 +1,11 @@
 import os
 import sys
 import time
+import typing
 import warnings
 
-import requests
-
 from shared.constants import FeedType, OperatorsWithRT
-from shared.api import fetch_with_exponential_backoff
+from shared.api import download_to_file, request_download
 
 try:
     koda_api_key = os.environ.get("KODA_KEY")
@@ -39,48 +38,68 @@ def get_rt_download_path(operator: str, date: str, download_dir=DEFAULT_DOWNLOAD
     return f'{download_dir}/{operator}_rt_{date.replace("-", "_")}.7z'
 
 
+def request_gtfs_archive(url: str, target_path: str) -> typing.Union[bool, None]:
+    """
+    Request an archive from KoDa once, downloading it if it is ready.
+
+    Returns:
+        bool | None: True if the archive was written to target_path, False if KoDa is still preparing it
+            (HTTP 202, the request starts the preparation), None on errors.
+    """
+    response = request_download(url, target_path, KODA_API_TIMEOUT, KODA_MAX_RETRIES)
+    if response is None:
+        return None
+    if response.status_code == 202:
+        response.close()
+        return False
+    if not download_to_file(url, target_path, KODA_API_TIMEOUT, KODA_MAX_RETRIES, response=response):
+        return None
+    return True
+
+
 def fetch_gtfs_archive(url, target_path):
     if os.path.exists(target_path):
         print("File already exists.")
         return target_path
 
-    response = fetch_with_exponential_backoff(url, KODA_API_TIMEOUT, KODA_MAX_RETRIES)
-    if response is None:
+    ready = request_gtfs_archive(url, target_path)
+    if ready is None:
         return None
-
-    if response.status_code == 200:
-        with open(target_path, "wb") as file:
-            file.write(response.content)
-        print("File is ready.")
-    elif response.status_code == 202:
+    if not ready:
         print("File is not ready yet.")
         polled = 0
-        while response.status_code == 202 and polled < MAX_POLL_TIMES:
-            response = requests.get(url, timeout=KODA_API_TIMEOUT)
+        while not ready and polled < MAX_POLL_TIMES:
+            time.sleep(POLL_DELAY)
+            ready = request_gtfs_archive(url, target_path)
+            if ready is None:
+                return None
             polled += 1
             print(f"Polling {polled}/{MAX_POLL_TIMES}")
-            time.sleep(POLL_DELAY)
-        if response.status_code == 202:
+        if not ready:
             print("Timeout reached.")
             return None
-        with open(target_path, "wb") as file:
-            file.write(response.content)
-        print("File is ready.")
-    else:
-        print(f"Error: {response.status_code}")
-        print(response.text)
-        return None
+    print("File is ready.")
     return target_path
 
 
-def fetch_gtfs_static_archive(operator: OperatorsWithRT, date: str, download_dir=DEFAULT_DOWNLOAD_DIR):
+def get_gtfs_static_archive_request(operator: OperatorsWithRT, date: str, download_dir=DEFAULT_DOWNLOAD_DIR) -> (
+        str, str):
     url = STATIC_URL.format(operator=operator.value, date=date, api_key=koda_api_key)
-    target_path = get_static_download_path(operator.value, date, download_dir)
+    return url, get_static_download_path(operator.value, date, download_dir)
+
+
+def get_gtfs_realtime_archive_request(operator: OperatorsWithRT, feed: FeedType, date: str,
+                                      download_dir=DEFAULT_DOWNLOAD_DIR) -> (str, str):
+    url = REALTIME_URL.format(operator=operator.value, feed=feed.value, date=date, api_key=koda_api_key)
+    return url, get_rt_download_path(operator.value, date, download_dir)
+
+
+def fetch_gtfs_static_archive(operator: OperatorsWithRT, date: str, download_dir=DEFAULT_DOWNLOAD_DIR):
+    url, target_path = get_gtfs_static_archive_request(operator, date, download_dir)
     return fetch_gtfs_archive(url, target_path)
 
 
 def fetch_gtfs_realtime_archive(operator: OperatorsWithRT, feed: FeedType, date: str,
                                 download_dir=DEFAULT_DOWNLOAD_DIR):
-    url = REALTIME_URL.format(operator=operator.value, feed=feed.value, date=date, api_key=koda_api_key)
-    target_path = get_rt_download_path(operator.value, date, download_dir)
+    url, target_path = get_gtfs_realtime_archive_request(operator, feed, date, download_dir)
     return fetch_gtfs_archive(url, target_path)
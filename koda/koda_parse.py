@@ -14,12 +14,17 @@ def get_rt_dir_info(rt_dir_path: str):
     return operator, date
 
 
-def get_rt_hour_dir_path(operator: str, feed_type: str, date: str, hour: int, data_dir=DATA_DIR) -> str:
+def get_rt_day_dir_path(operator: str, feed_type: str, date: str, data_dir=DATA_DIR) -> str:
     year, month, day = date.split("-")
-    hour_filled = str(hour).zfill(2)
     rt_dir_path = get_rt_dir_path(operator, date, data_dir)
-    subfolder_path = os.path.join(operator, feed_type, year, month, day, hour_filled)
-    hour_dir_path = os.path.join(rt_dir_path, subfolder_path)
+    subfolder_path = os.path.join(operator, feed_type, year, month, day)
+    day_dir_path = os.path.join(rt_dir_path, subfolder_path)
+    return day_dir_path
+
+
+def get_rt_hour_dir_path(operator: str, feed_type: str, date: str, hour: int, data_dir=DATA_DIR) -> str:
+    hour_filled = str(hour).zfill(2)
+    hour_dir_path = os.path.join(get_rt_day_dir_path(operator, feed_type, date, data_dir), hour_filled)
     return hour_dir_path
 
 
@@ -39,5 +44,12 @@ def get_pb_file_info(file_path: str):
     operator = parts[-7]
     feed_type = parts[-6]
     date = "-".join(parts[-5:-2])
-    hour, minute, second = parts[-2].split("-")
-    return operator, feed_type, date, int(hour), int(minute), int(second)
\ No newline at end of file
+    # File names end in {date}T{hour}-{minute}-{second}Z.pb, see get_pb_file_path
+    hour, minute, second = parts[-1].rsplit("T", 1)[1].removesuffix("Z.pb").split("-")
+    return operator, feed_type, date, int(hour), int(minute), int(second)
+
+
+def get_archive_member_hour(member_name: str) -> int:
+    # Archive members are laid out as {operator}/{feed_type}/{year}/{month}/{day}/{hour}/{file_name}
+    parts = member_name.split("/")
+    return int(parts[-2])
@@ -1,5 +1,6 @@
 import os
 import shutil
+import typing
 from concurrent.futures import ProcessPoolExecutor
 
 import pandas as pd
@@ -7,9 +8,12 @@ import pandas as pd
 import koda.koda_transform as kt
 import koda.koda_fetch as kf
 import koda.koda_parse as kp
+import koda.koda_scheduler as ksch
+import koda.koda_static_cache as ksc
 import shared.parse as sp
-import shared.transform as st
-from shared.constants import FeedType, OperatorsWithRT, StaticDataTypes
+import shared.rt_store as rs
+import shared.storage as ss
+from shared.constants import FeedType, OperatorsWithRT
 
 FEATHER_DF_VERSION = 3
 
@@ -19,6 +23,13 @@ if USE_PROCESSES is None:
 else:
     USE_PROCESSES = int(USE_PROCESSES)
 
+# Parse realtime snapshots straight from the downloaded archive instead of extracting it to disk first
+STREAM_RT_ARCHIVE = os.environ.get("STREAM_RT_ARCHIVE", "False").lower() == "true"
+
+# Reuse a cached static feed from a date at most this many days away if its feed_info validity covers the date,
+# instead of requesting the static archive again (0 always requests it)
+STATIC_FEED_REUSE_DAYS = int(os.environ.get("STATIC_FEED_REUSE_DAYS", 0))
+
 
 def get_feather_version(operator: OperatorsWithRT, date: str) -> int:
     version_path = kt.get_feather_version_path(operator.value, date)
@@ -48,30 +59,40 @@ def get_rt_data(operator: OperatorsWithRT, date: str) -> str:
     print(f"Unzipped realtime data to {rt_unzipped_path}")
     return rt_unzipped_path
 
+def get_rt_archive(operator: OperatorsWithRT, date: str) -> str:
+    rt_archive_path = kf.fetch_gtfs_realtime_archive(operator, FeedType.TRIP_UPDATES, date)
+    if rt_archive_path is None:
+        raise ValueError(f"Failed to fetch realtime data for {operator.value} on {date}")
+    return rt_archive_path
+
+
 def get_static_data(date: str, operator: OperatorsWithRT) -> str:
-    static_archive_path = kf.fetch_gtfs_static_archive(operator, date)
-    if static_archive_path is None:
-        raise ValueError(f"Failed to fetch static data for {operator.value} on {date}")
+    static_archive_path = get_static_archive(operator, date)
     static_unzipped_path = sp.unzip_gtfs_archive(static_archive_path, kp.DATA_DIR, remove_archive_after=True)
     print(f"Unzipped static data to {static_unzipped_path}")
     return static_unzipped_path
 
 
-def get_koda_data_for_day(date: str, operator: OperatorsWithRT) -> (pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame):
-    rt_folder_path = kp.get_rt_dir_path(operator.value, date)
-    day_feather_path = kt.get_day_feather_path(operator.value, date)
-    route_types_map_df_feather_path = kt.get_route_types_map_df_feather_path(operator.value, date)
-    stop_count_df_feather_path = kt.get_stop_count_df_feather_path(operator.value, date)
+def get_static_archive(operator: OperatorsWithRT, date: str) -> str:
+    static_archive_path = kf.fetch_gtfs_static_archive(operator, date)
+    if static_archive_path is None:
+        raise ValueError(f"Failed to fetch static data for {operator.value} on {date}")
+    return static_archive_path
 
-    static_folder_path = sp.get_static_dir_path(operator.value, date, kp.DATA_DIR)
 
-    # NOTE: Trips, routes and stop times do not need to be kept around as they are only the basis for the features,
-    # but we keep them to speed up future new feature calculations
-    trips_df_feather_path = kt.get_trips_df_feather_path(operator.value, date)
-    routes_df_feather_path = kt.get_routes_df_feather_path(operator.value,date)
-    stop_times_df_feather_path = kt.get_stop_times_df_feather_path(operator.value, date)
+def fetch_koda_archives_for_day(date: str, operator: OperatorsWithRT) -> (
+        typing.Union[str, None], typing.Union[str, None]):
+    """
+    Download step of get_koda_data_for_day.
 
-    stop_location_map_feather_path = kt.get_stop_location_map_feather_path(operator.value, date)
+    Cleans up data written by older versions and downloads the archives whose data is not available locally.
+
+    Returns:
+        (str | None, str | None): Realtime and static archive paths, None if the data is already available.
+    """
+    rt_folder_path = kp.get_rt_dir_path(operator.value, date)
+    day_feather_path = kt.get_day_feather_path(operator.value, date)
+    static_folder_path = sp.get_static_dir_path(operator.value, date, kp.DATA_DIR)
 
     feather_version = get_feather_version(operator, date)
     if feather_version < 2:
@@ -84,55 +105,125 @@ def get_koda_data_for_day(date: str, operator: OperatorsWithRT) -> (pd.DataFrame
             print(f"Cleaning {static_folder_path}")
             shutil.rmtree(static_folder_path)
 
-    if os.path.exists(day_feather_path):
+    rt_archive_path = None
+    if not os.path.exists(day_feather_path):
+        print(f"Fetching realtime data for {operator.value} on {date}")
+        rt_archive_path = get_rt_archive(operator, date)
+
+    static_archive_path = None
+    if ksc.find_feed_key(operator, date, max_reuse_days=STATIC_FEED_REUSE_DAYS) is None:
+        print(f"Fetching static data for {operator.value} on {date}")
+        static_archive_path = get_static_archive(operator, date)
+    return rt_archive_path, static_archive_path
+
+
+def get_koda_archive_requests_for_day(date: str, operator: OperatorsWithRT) -> list[tuple[str, str]]:
+    """(url, target_path) of the archives fetch_koda_archives_for_day would download for a date."""
+    archives = []
+    day_feather_path = kt.get_day_feather_path(operator.value, date)
+    if get_feather_version(operator, date) < 2 or not os.path.exists(day_feather_path):
+        archives.append(kf.get_gtfs_realtime_archive_request(operator, FeedType.TRIP_UPDATES, date))
+    if ksc.find_feed_key(operator, date, max_reuse_days=STATIC_FEED_REUSE_DAYS) is None:
+        archives.append(kf.get_gtfs_static_archive_request(operator, date))
+    return archives
+
+
+def iter_prepared_koda_days(dates: typing.Iterable[str], operator: OperatorsWithRT,
+                            window=ksch.REQUEST_AHEAD_WINDOW) -> typing.Iterator[str]:
+    """
+    Request the archives of a window of dates ahead and yield each date once its archives are downloaded.
+
+    fetch_koda_archives_for_day then finds the archives on disk, dates whose archives failed are still yielded
+    so that it reports the failure.
+    """
+    for _, date in iter_prepared_koda_operator_days(((operator, date) for date in dates), window=window):
+        yield date
+
+
+def iter_prepared_koda_operator_days(operator_days: typing.Iterable[tuple[OperatorsWithRT, str]],
+                                     window=ksch.REQUEST_AHEAD_WINDOW) -> typing.Iterator[tuple[OperatorsWithRT, str]]:
+    """
+    iter_prepared_koda_days for (operator, date) pairs of several operators, which share the request window and
+    the concurrent requests of one scheduler.
+    """
+    jobs = (((operator, date), get_koda_archive_requests_for_day(date, operator)) for operator, date in operator_days)
+    for (operator, date), paths in ksch.prepare_archives(jobs, window=window):
+        if None in paths:
+            print(f"Failed to prepare archives for {operator.value} on {date}")
+        yield operator, date
+
+
+def extract_koda_archives_for_day(date: str, operator: OperatorsWithRT, rt_archive_path: typing.Union[str, None],
+                                  static_archive_path: typing.Union[str, None]) -> typing.Union[str, None]:
+    """
+    Extract step of get_koda_data_for_day, unzips the downloaded archives and removes them.
+
+    Returns:
+        str | None: The realtime archive path if it is left to be streamed by read_koda_data_for_day
+            (STREAM_RT_ARCHIVE), None otherwise.
+    """
+    if rt_archive_path is not None and not STREAM_RT_ARCHIVE:
+        rt_unzipped_path = sp.unzip_gtfs_archive(rt_archive_path, kp.DATA_DIR, remove_archive_after=True)
+        print(f"Unzipped realtime data to {rt_unzipped_path}")
+        rt_archive_path = None
+    if static_archive_path is not None:
+        static_unzipped_path = sp.unzip_gtfs_archive(static_archive_path, kp.DATA_DIR, remove_archive_after=True)
+        print(f"Unzipped static data to {static_unzipped_path}")
+    return rt_archive_path
+
+
+def read_koda_data_for_day(date: str, operator: OperatorsWithRT, rt_archive_path: typing.Union[str, None] = None,
+                           executor: ProcessPoolExecutor = None) -> (
+        pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame):
+    """
+    Parse step of get_koda_data_for_day, reads the realtime and static data of a downloaded and extracted day.
+
+    Args:
+        date (str): Date to read (YYYY-MM-DD).
+        operator (OperatorsWithRT): Operator to read.
+        rt_archive_path (str, optional): Realtime archive to stream, see extract_koda_archives_for_day.
+        executor (ProcessPoolExecutor, optional): Pool to parse snapshots in, a new one is created if None.
+    """
+    day_feather_path = kt.get_day_feather_path(operator.value, date)
+    static_folder_path = sp.get_static_dir_path(operator.value, date, kp.DATA_DIR)
+
+    rt_parsed = not os.path.exists(day_feather_path)
+    if not rt_parsed:
         print(f"Reading existing data for {date} {day_feather_path}")
-        rt_df = pd.read_feather(day_feather_path)
+        # Day feathers written before the compact schema are converted on read
+        rt_df = sp.compact_trip_updates(ss.read_feather(day_feather_path))
     else:
-        print(f"Fetching realtime data for {operator.value} on {date}")
-        _ = get_rt_data(operator, date)
-        with ProcessPoolExecutor(max_workers=USE_PROCESSES) as executor:
-            rt_df, read_feather_paths = kt.read_rt_day_to_df(operator, FeedType.TRIP_UPDATES, date,
-                                                          remove_folder_after=True, executor=executor)
-        rt_df.to_feather(day_feather_path, compression='zstd', compression_level=9)
+        own_executor = executor is None
+        if own_executor:
+            executor = ProcessPoolExecutor(max_workers=USE_PROCESSES)
+        try:
+            if rt_archive_path is not None:
+                rt_df, read_feather_paths = kt.read_rt_archive_to_df(operator, FeedType.TRIP_UPDATES, date,
+                                                                     rt_archive_path, executor=executor)
+                print(f"Removing {rt_archive_path}")
+                os.remove(rt_archive_path)
+            else:
+                rt_df, read_feather_paths = kt.read_rt_day_to_df(operator, FeedType.TRIP_UPDATES, date,
+                                                                 remove_folder_after=True, executor=executor)
+        finally:
+            if own_executor:
+                executor.shutdown()
+        ss.write_feather(rt_df, day_feather_path)
         # Remove individual hour feather files
         for path in read_feather_paths:
             if os.path.exists(path):
                 os.remove(path)
 
-    if os.path.exists(route_types_map_df_feather_path):
-        print(f"Reading existing data for {date} {route_types_map_df_feather_path}")
-        route_types_map_df = pd.read_feather(route_types_map_df_feather_path)
+    feed_key = ksc.find_feed_key(operator, date, max_reuse_days=STATIC_FEED_REUSE_DAYS)
+    if feed_key is None:
+        feed_key = ksc.register_static_feed(operator, date)
     else:
-        print(f"Fetching static data for {operator.value} on {date}")
-        get_static_data(date, operator)
-        trips_df = sp.read_static_data_to_dataframe(operator, StaticDataTypes.TRIPS, date, kp.DATA_DIR)
-        routes_df = sp.read_static_data_to_dataframe(operator, StaticDataTypes.ROUTES, date, kp.DATA_DIR)
-        trips_df.to_feather(trips_df_feather_path, compression='zstd', compression_level=9)
-        routes_df.to_feather(routes_df_feather_path, compression='zstd', compression_level=9)
-        route_types_map_df = st.create_route_types_map_df(trips_df, routes_df)
-        route_types_map_df.to_feather(route_types_map_df_feather_path, compression='zstd', compression_level=9)
-
-    if os.path.exists(stop_count_df_feather_path):
-        print(f"Reading existing data for {date} {stop_count_df_feather_path}")
-        stop_count_df = pd.read_feather(stop_count_df_feather_path)
-    else:
-        print(f"Fetching static data for {operator.value} on {date}")
-        get_static_data(date, operator)
-        stop_times_df = sp.read_static_data_to_dataframe(operator, StaticDataTypes.STOP_TIMES, date, kp.DATA_DIR)
-        stop_times_df.to_feather(stop_times_df_feather_path, compression='zstd', compression_level=9)
-        stop_count_df = st.create_stop_count_df(date, stop_times_df, route_types_map_df)
-        stop_count_df.to_feather(stop_count_df_feather_path, compression='zstd', compression_level=9)
-
-    if os.path.exists(stop_location_map_feather_path):
-        print(f"Reading existing data for {date} {stop_location_map_feather_path}")
-        stop_location_map_df = pd.read_feather(stop_location_map_feather_path)
-    else:
-        print(f"Fetching static data for {operator.value} on {date} for stops")
-        get_static_data(date, operator)
-        stops_df = sp.read_static_data_to_dataframe(operator, StaticDataTypes.STOPS, date, kp.DATA_DIR)
-        stop_location_map_df = st.create_stop_location_map_df(stops_df)
-        stop_location_map_df.to_feather(stop_location_map_feather_path, compression='zstd', compression_level=9)
+        print(f"Reading cached static feed {feed_key} for {date}")
+    route_types_map_df, stop_count_df, stop_location_map_df = ksc.read_static_feed(operator, feed_key, date)
 
+    if rs.WRITE_RT_STORE and (rt_parsed or not os.path.exists(rs.get_partition_dir_path(operator.value, date))):
+        n_rows = rs.write_rt_partition(rt_df, operator, date, route_types_map_df)
+        print(f"Wrote {n_rows} trip updates for {date} to {rs.RT_STORE_DIR}")
 
     set_feather_version(operator, date, FEATHER_DF_VERSION)
 
@@ -141,3 +232,9 @@ def get_koda_data_for_day(date: str, operator: OperatorsWithRT) -> (pd.DataFrame
         shutil.rmtree(static_folder_path)
 
     return rt_df, route_types_map_df, stop_count_df, stop_location_map_df
+
+
+def get_koda_data_for_day(date: str, operator: OperatorsWithRT) -> (pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame):
+    rt_archive_path, static_archive_path = fetch_koda_archives_for_day(date, operator)
+    rt_archive_path = extract_koda_archives_for_day(date, operator, rt_archive_path, static_archive_path)
+    return read_koda_data_for_day(date, operator, rt_archive_path)
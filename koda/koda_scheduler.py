@@ -0,0 +1,118 @@
+import asyncio
+import contextlib
+import os
+import queue
+import random
+import threading
+import typing
+
+import requests
+
+import koda.koda_fetch as kf
+
+# KoDa prepares archives server side, which takes between 1 and 60 minutes each but runs in parallel for
+# different requests. Instead of waiting for every archive in turn, request a window of them up front and poll
+# them all concurrently.
+REQUEST_AHEAD_WINDOW = 8
+MAX_CONCURRENT_REQUESTS = 4
+POLL_DELAY_MIN = 10
+POLL_DELAY_MAX = 120
+MAX_POLL_SECONDS = kf.MAX_POLL_TIMES * kf.POLL_DELAY
+
+_DONE = object()
+
+
+async def _prepare_archive(url: str, target_path: str, request_slots: asyncio.Semaphore) -> typing.Union[str, None]:
+    if os.path.exists(target_path):
+        return target_path
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + MAX_POLL_SECONDS
+    delay = POLL_DELAY_MIN
+    while True:
+        try:
+            # Requests are blocking, the slots bound how many run in threads at once
+            async with request_slots:
+                ready = await asyncio.to_thread(kf.request_gtfs_archive, url, target_path)
+        except requests.exceptions.RequestException as e:
+            print(f"Request for {os.path.basename(target_path)} failed, retrying. {e}")
+            ready = False
+        if ready is None:
+            return None
+        if ready:
+            print(f"{os.path.basename(target_path)} is ready.")
+            return target_path
+        if loop.time() > deadline:
+            print(f"Timeout reached for {os.path.basename(target_path)}.")
+            return None
+        # Jitter so archives requested together do not keep polling in lockstep
+        await asyncio.sleep(random.uniform(delay / 2, delay))
+        delay = min(delay * 2, POLL_DELAY_MAX)
+
+
+async def _prepare_job(key, archives: list[tuple[str, str]], request_slots: asyncio.Semaphore) -> tuple:
+    coroutines = [_prepare_archive(url, target_path, request_slots) for url, target_path in archives]
+    paths = await asyncio.gather(*coroutines, return_exceptions=True)
+    for path in paths:
+        if isinstance(path, Exception):
+            print(f"Failed to prepare archive for {key}. {path}")
+    return key, [None if isinstance(path, Exception) else path for path in paths]
+
+
+async def _schedule(jobs: typing.Iterable, window_slots: asyncio.Semaphore, request_slots: asyncio.Semaphore,
+                    results: queue.Queue) -> None:
+    tasks = set()
+    for key, archives in jobs:
+        await window_slots.acquire()
+        task = asyncio.create_task(_prepare_job(key, archives, request_slots))
+        tasks.add(task)
+        task.add_done_callback(lambda t: results.put(t.result()))
+    if tasks:
+        await asyncio.wait(tasks)
+    results.put(_DONE)
+
+
+def prepare_archives(jobs: typing.Iterable, window=REQUEST_AHEAD_WINDOW,
+                     max_concurrent_requests=MAX_CONCURRENT_REQUESTS) -> typing.Iterator[tuple]:
+    """
+    Request KoDa archives ahead of time and yield them as soon as they are downloaded.
+
+    At most window jobs are requested but not yet handed over, so archives never pile up on disk faster than
+    they are consumed. Pending archives are polled concurrently with a jittered, growing delay.
+
+    Args:
+        jobs (typing.Iterable): (key, [(url, target_path), ...]) per job, e.g. one job per date with its
+            realtime and static archives, see koda_fetch.get_gtfs_realtime_archive_request.
+        window (int): Number of jobs requested ahead.
+        max_concurrent_requests (int): Number of HTTP requests in flight at once.
+
+    Yields:
+        (key, list[str | None]): Key of a job and its archive paths (None if an archive failed), in the order
+            the jobs complete.
+    """
+    results = queue.Queue()
+    loop = asyncio.new_event_loop()
+    window_slots = asyncio.Semaphore(max(window, 1))
+    request_slots = asyncio.Semaphore(max(max_concurrent_requests, 1))
+
+    def run():
+        try:
+            loop.run_until_complete(_schedule(jobs, window_slots, request_slots, results))
+        except Exception as e:
+            results.put(e)
+            results.put(_DONE)
+        finally:
+            loop.close()
+
+    # Daemon thread, so an abandoned iteration does not keep the interpreter alive
+    threading.Thread(target=run, daemon=True, name="koda-scheduler").start()
+    while True:
+        result = results.get()
+        if result is _DONE:
+            return
+        if isinstance(result, Exception):
+            raise result
+        # Handing a job over frees its slot for the next one
+        with contextlib.suppress(RuntimeError):  # The loop is closed once the last job was handed over
+            loop.call_soon_threadsafe(window_slots.release)
+        yield result
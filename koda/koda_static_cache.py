@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import threading
+import typing
+
+import pandas as pd
+
+import koda.koda_parse as kp
+import shared.parse as sp
+import shared.storage as ss
+import shared.transform as st
+from shared.constants import OperatorsWithRT, StaticDataTypes
+
+# Static feeds only change every few weeks, so the derived tables are stored once per feed (keyed by a hash of
+# its content) and dates point at the feed they were served with through a per-operator index.
+STATIC_CACHE_DIR = f"{kp.DATA_DIR}/static_feeds"
+
+HASHED_STATIC_DATA_TYPES = [StaticDataTypes.FEED_INFO, StaticDataTypes.ROUTES, StaticDataTypes.STOP_TIMES,
+                            StaticDataTypes.STOPS, StaticDataTypes.TRIPS]
+
+# The staged backfill looks up and registers feeds of different dates from different threads
+_INDEX_LOCK = threading.Lock()
+_BUILD_LOCK = threading.Lock()
+
+
+def get_operator_cache_dir(operator: str, cache_dir=STATIC_CACHE_DIR) -> str:
+    return f"{cache_dir}/{operator}"
+
+
+def get_feed_index_path(operator: str, cache_dir=STATIC_CACHE_DIR) -> str:
+    return f"{get_operator_cache_dir(operator, cache_dir)}/index.json"
+
+
+def get_feed_dir_path(operator: str, feed_key: str, cache_dir=STATIC_CACHE_DIR) -> str:
+    return f"{get_operator_cache_dir(operator, cache_dir)}/{feed_key}"
+
+
+def get_route_types_map_df_feather_path(operator: str, feed_key: str):
+    return f"{get_feed_dir_path(operator, feed_key)}/route_types_map.feather"
+
+
+def get_service_stop_count_df_feather_path(operator: str, feed_key: str):
+    return f"{get_feed_dir_path(operator, feed_key)}/service_stop_count.feather"
+
+
+def get_stop_location_map_feather_path(operator: str, feed_key: str):
+    return f"{get_feed_dir_path(operator, feed_key)}/stop_location_map.feather"
+
+
+def get_trips_df_feather_path(operator: str, feed_key: str):
+    return f"{get_feed_dir_path(operator, feed_key)}/trips.feather"
+
+
+def get_routes_df_feather_path(operator: str, feed_key: str):
+    return f"{get_feed_dir_path(operator, feed_key)}/routes.feather"
+
+
+def get_stop_times_df_feather_path(operator: str, feed_key: str):
+    return f"{get_feed_dir_path(operator, feed_key)}/stop_times.feather"
+
+
+def read_feed_index(operator: OperatorsWithRT) -> dict:
+    path = get_feed_index_path(operator.value)
+    if not os.path.exists(path):
+        return {"dates": {}, "feeds": {}}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def write_feed_index(operator: OperatorsWithRT, index: dict) -> None:
+    path = get_feed_index_path(operator.value)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temporary file first so an interrupted run never leaves a truncated index behind
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def hash_static_feed(operator: OperatorsWithRT, date: str, data_dir=kp.DATA_DIR) -> str:
+    digest = hashlib.sha256()
+    for static_data_type in HASHED_STATIC_DATA_TYPES:
+        file_path = sp.get_static_file_path(operator.value, date, static_data_type.value, data_dir=data_dir)
+        if not os.path.exists(file_path):
+            continue
+        digest.update(static_data_type.value.encode())
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def read_feed_info(operator: OperatorsWithRT, date: str, data_dir=kp.DATA_DIR) -> dict:
+    file_path = sp.get_static_file_path(operator.value, date, StaticDataTypes.FEED_INFO.value, data_dir=data_dir)
+    if not os.path.exists(file_path):
+        return {}
+    feed_info_df = sp.read_typed_static_data_to_dataframe(operator, StaticDataTypes.FEED_INFO, date, data_dir)
+    if feed_info_df.empty:
+        return {}
+    return {k: v for k, v in feed_info_df.iloc[0].items() if isinstance(v, str)}
+
+
+def find_feed_key(operator: OperatorsWithRT, date: str, max_reuse_days=0) -> typing.Union[str, None]:
+    """
+    Look up the static feed for a date without downloading it.
+
+    Dates that were registered or reused before always map to their feed. With max_reuse_days > 0, the feed of
+    the newest date registered at most that many days before the date is also reused, if its feed_info validity
+    period covers the date and no registered date after it (within max_reuse_days) has another feed. Older
+    feeds often stay valid long after a newer one replaced them, so only the newest one is considered. This saves
+    the KoDa static request for most dates of a backfill.
+    """
+    with _INDEX_LOCK:
+        index = read_feed_index(operator)
+        feed_key = index["dates"].get(date) or index.get("reused", {}).get(date)
+        if feed_key is not None and os.path.exists(get_route_types_map_df_feather_path(operator.value, feed_key)):
+            return feed_key
+        if max_reuse_days <= 0:
+            return None
+
+        target = pd.Timestamp(date)
+        window = pd.Timedelta(days=max_reuse_days)
+        before = [(pd.Timestamp(d), k) for d, k in index["dates"].items() if target - window <= pd.Timestamp(d) < target]
+        if not before:
+            return None
+        _, feed_key = max(before)
+        after = {k for d, k in index["dates"].items() if target < pd.Timestamp(d) <= target + window}
+        if after - {feed_key}:
+            # The feed changed somewhere between the two registered dates
+            return None
+        feed_info = index["feeds"].get(feed_key, {})
+        start, end = feed_info.get("feed_start_date"), feed_info.get("feed_end_date")
+        if not os.path.exists(get_route_types_map_df_feather_path(operator.value, feed_key)):
+            return None
+        if not (start and end and pd.Timestamp(start) <= target <= pd.Timestamp(end)):
+            return None
+        # Kept apart from the registered dates, so reused dates never serve as the basis of another reuse
+        index.setdefault("reused", {})[date] = feed_key
+        write_feed_index(operator, index)
+        return feed_key
+
+
+def _build_static_feed(operator: OperatorsWithRT, date: str, feed_key: str, data_dir=kp.DATA_DIR) -> None:
+    os.makedirs(get_feed_dir_path(operator.value, feed_key), exist_ok=True)
+
+    # NOTE: Trips, routes and stop times do not need to be kept around as they are only the basis for the features,
+    # but we keep them (once per feed) to speed up future new feature calculations
+    trips_df = sp.read_typed_static_data_to_dataframe(operator, StaticDataTypes.TRIPS, date, data_dir)
+    routes_df = sp.read_typed_static_data_to_dataframe(operator, StaticDataTypes.ROUTES, date, data_dir)
+    ss.write_feather(trips_df, get_trips_df_feather_path(operator.value, feed_key))
+    ss.write_feather(routes_df, get_routes_df_feather_path(operator.value, feed_key))
+    route_types_map_df = st.create_route_types_map_df(trips_df, routes_df)
+
+    stop_times_df = sp.read_typed_static_data_to_dataframe(operator, StaticDataTypes.STOP_TIMES, date, data_dir)
+    ss.write_feather(stop_times_df, get_stop_times_df_feather_path(operator.value, feed_key))
+    service_stop_count_df = st.create_service_stop_count_df(stop_times_df, trips_df, route_types_map_df)
+
+    stops_df = sp.read_typed_static_data_to_dataframe(operator, StaticDataTypes.STOPS, date, data_dir)
+    stop_location_map_df = st.create_stop_location_map_df(stops_df)
+
+    ss.write_feather(service_stop_count_df, get_service_stop_count_df_feather_path(operator.value, feed_key))
+    ss.write_feather(stop_location_map_df, get_stop_location_map_feather_path(operator.value, feed_key))
+    # Written last, its presence marks the feed as complete
+    ss.write_feather(route_types_map_df, get_route_types_map_df_feather_path(operator.value, feed_key))
+
+
+def register_static_feed(operator: OperatorsWithRT, date: str, data_dir=kp.DATA_DIR) -> str:
+    """
+    Register the unzipped static feed of a date in the cache and return its feed key.
+
+    The derived tables are only built if no earlier date was served with identical feed content.
+    """
+    feed_key = hash_static_feed(operator, date, data_dir)
+    with _BUILD_LOCK:
+        if os.path.exists(get_route_types_map_df_feather_path(operator.value, feed_key)):
+            print(f"Static feed for {operator.value} on {date} unchanged ({feed_key}), reusing cached tables")
+        else:
+            print(f"New static feed for {operator.value} on {date} ({feed_key}), building tables")
+            _build_static_feed(operator, date, feed_key, data_dir)
+
+    feed_info = read_feed_info(operator, date, data_dir)
+    with _INDEX_LOCK:
+        index = read_feed_index(operator)
+        index["dates"][date] = feed_key
+        index["feeds"].setdefault(feed_key, feed_info)
+        write_feed_index(operator, index)
+    return feed_key
+
+
+def read_static_feed(operator: OperatorsWithRT, feed_key: str, date: str) -> (
+        pd.DataFrame, pd.DataFrame, pd.DataFrame):
+    route_types_map_df = ss.read_feather(get_route_types_map_df_feather_path(operator.value, feed_key))
+    service_stop_count_df = ss.read_feather(get_service_stop_count_df_feather_path(operator.value, feed_key))
+    stop_location_map_df = ss.read_feather(get_stop_location_map_feather_path(operator.value, feed_key))
+    stop_count_df = st.stop_count_df_for_date(date, service_stop_count_df)
+    return route_types_map_df, stop_count_df, stop_location_map_df
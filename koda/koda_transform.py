@@ -1,16 +1,26 @@
 import shutil
 import contextlib
 import os
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
 import tqdm
 
 import koda.koda_parse as kp
 import shared.parse as sp
+import shared.storage as ss
 from shared.constants import FeedType, OperatorsWithRT
 
+# Snapshots parsed per pool task, batching amortises the IPC and pickling cost of returning results
+PB_FILES_PER_TASK = int(os.environ.get("PB_FILES_PER_TASK", 16))
+# Only decode trips whose content changed since the previous snapshot of the same batch, most of a feed is
+# re-sent unchanged every few seconds. Larger batches skip more, see decode_trip_updates
+DIFF_SNAPSHOTS = os.environ.get("DIFF_SNAPSHOTS", "False").lower() == "true"
+# Uncompressed bytes of snapshots a streamed archive read holds in memory at once, see read_rt_archive_to_df
+RT_ARCHIVE_READ_MB = int(os.environ.get("RT_ARCHIVE_READ_MB", 256))
+
 
 def get_rt_feather_path(operator: str, feed_type: str, date: str, hour: str):
     rt_folder_path = kp.get_rt_dir_path(operator, date)
@@ -116,45 +126,27 @@ def sanitise_array(df: pd.DataFrame) -> None:
     df.drop_duplicates(subset=keys, inplace=True, keep='last')
 
 
-def _read_pb_file_helper(file_path):
+def _read_pb_file_helper(file_path, feed_type: FeedType = None, fingerprints: dict = None):
     try:
+        if feed_type == FeedType.TRIP_UPDATES:
+            return sp.read_trip_updates_pb_to_dataframe(file_path, fingerprints)
         return sp.read_pb_to_dataframe(file_path)
     except FileNotFoundError:
         print(f"File {file_path} not found")
         return pd.DataFrame()
 
 
-def read_rt_hour_to_df(operator: OperatorsWithRT, feed_type: FeedType, date: str, hour: int,
-                       executor: ProcessPoolExecutor = None) -> (pd.DataFrame, str):
-    hour_filled = str(hour).zfill(2)
-    feather_path = get_rt_feather_path(operator.value, feed_type.value, date, hour_filled)
-    if os.path.exists(feather_path):
-        # print(f"Reading from {feather_path}")
-        return pd.read_feather(feather_path), feather_path
+def _read_pb_bytes_helper(content: bytes, feed_type: FeedType = None, fingerprints: dict = None):
+    if feed_type == FeedType.TRIP_UPDATES:
+        return sp.trip_updates_pb_bytes_to_dataframe(content, fingerprints)
+    return sp.pb_bytes_to_dataframe(content)
 
-    search_path = kp.get_rt_hour_dir_path(operator.value, feed_type.value, date, hour)
-    file_list = []
-    for root, _, files in os.walk(search_path):
-        for file in files:
-            if file.endswith(".pb"):
-                file_list.append(os.path.join(root, file))
-
-    # print(f"Reading {len(file_list)} files with {os.cpu_count() - 2} processes")
-
-    if executor is None:
-        with ProcessPoolExecutor(max_workers=os.cpu_count() - 2) as executor:
-            future_list = [executor.submit(_read_pb_file_helper, file_path) for file_path in file_list]
-            df_list = [future.result() for future in as_completed(future_list)]
-    else:
-        future_list = [executor.submit(_read_pb_file_helper, file_path) for file_path in file_list]
-        df_list = [future.result() for future in as_completed(future_list)]
 
+def _reduce_frames(df_list: list[pd.DataFrame]) -> pd.DataFrame:
     df_list = [df for df in df_list if not df.empty]
-    if df_list:
-        merged_df = pd.concat(df_list, axis=0)
-    else:
-        print(f"No data found in {search_path}")
-        merged_df = pd.DataFrame()
+    if not df_list:
+        return pd.DataFrame()
+    merged_df = pd.concat(df_list, axis=0)
     # Force casts:
     castings = {}
     for k in merged_df.keys():
@@ -171,25 +163,178 @@ def read_rt_hour_to_df(operator: OperatorsWithRT, feed_type: FeedType, date: str
 
     # Clean up duplicates, fix keys, etc
     sanitise_array(merged_df)
+    return sp.compact_trip_updates(merged_df)
+
+
+def _read_pb_batch_helper(sources: list, feed_type: FeedType = None, diff_snapshots=False) -> bytes:
+    """
+    Parse a batch of snapshot files (paths or contents), reduce them and return them as Arrow IPC bytes.
+
+    With diff_snapshots, sources must be in time order and unchanged trips are only decoded once per batch.
+    """
+    fingerprints = {} if diff_snapshots else None
+    df_list = [_read_pb_bytes_helper(source, feed_type, fingerprints) if isinstance(source, bytes)
+               else _read_pb_file_helper(source, feed_type, fingerprints) for source in sources]
+    return sp.dataframe_to_arrow_ipc(_reduce_frames(df_list))
+
+
+def _submit_pb_batches(sources: list, feed_type: FeedType, executor: ProcessPoolExecutor,
+                       files_per_task=PB_FILES_PER_TASK, diff_snapshots=DIFF_SNAPSHOTS) -> list[Future]:
+    batches = [sources[i:i + files_per_task] for i in range(0, len(sources), files_per_task)]
+    return [executor.submit(_read_pb_batch_helper, batch, feed_type, diff_snapshots) for batch in batches]
 
+
+def _merge_pb_batch_results(results: list[bytes]) -> pd.DataFrame:
+    tables = [sp.arrow_ipc_to_table(result) for result in results]
+    tables = [table for table in tables if table.num_rows > 0]
+    if not tables:
+        return pd.DataFrame()
+    # Batches may disagree on types (e.g. int vs float when one has missing delays), promote like pd.concat
+    merged_table = pa.concat_tables(tables, promote_options='permissive')
+    # Dictionaries of the batches are unified into one set of categories per column
+    merged_df = merged_table.to_pandas(types_mapper=sp.COMPACT_TYPES_MAPPER)
+    # Duplicates across batches are only removed here
+    return _reduce_frames([merged_df])
+
+
+def _read_pb_batches(sources: list, feed_type: FeedType, executor: ProcessPoolExecutor,
+                     files_per_task=PB_FILES_PER_TASK, diff_snapshots=DIFF_SNAPSHOTS) -> pd.DataFrame:
+    future_list = _submit_pb_batches(sources, feed_type, executor, files_per_task, diff_snapshots)
+    # Collected in submission order, so sanitise_array keeps the latest snapshot of duplicates deterministically
+    return _merge_pb_batch_results([future.result() for future in future_list])
+
+
+def _drain_hour_batches(hour_futures: dict[int, list[Future]]):
+    """Yield (hour, merged_df) as soon as all batches of an hour are done, in completion order."""
+    # Hours without snapshots have nothing to wait for
+    for hour in [hour for hour, future_list in hour_futures.items() if not future_list]:
+        del hour_futures[hour]
+        yield hour, pd.DataFrame()
+
+    future_hours = {future: hour for hour, future_list in hour_futures.items() for future in future_list}
+    remaining = {hour: len(future_list) for hour, future_list in hour_futures.items()}
+    not_done = set(future_hours)
+    while not_done:
+        # wait() instead of as_completed() so results are released as soon as their hour is merged
+        done, not_done = wait(not_done, return_when=FIRST_COMPLETED)
+        for future in done:
+            hour = future_hours.pop(future)
+            remaining[hour] -= 1
+            if remaining[hour] == 0:
+                # Merge in submission order, like _read_pb_batches
+                yield hour, _merge_pb_batch_results([f.result() for f in hour_futures.pop(hour)])
+
+
+def _write_hour_feather(merged_df: pd.DataFrame, feather_path: str, source: str) -> pd.DataFrame:
     if merged_df.empty:  # Feather does not support a DF without columns, so add a dummy one
+        print(f"No data found in {source}")
         merged_df['_'] = np.zeros(len(merged_df), dtype=np.bool_)
 
     merged_df.reset_index(inplace=True)
-    merged_df.to_feather(feather_path, compression='zstd', compression_level=9)
-    return merged_df, feather_path
+    ss.write_feather(merged_df, feather_path)
+    return merged_df
+
+
+def read_rt_hour_to_df(operator: OperatorsWithRT, feed_type: FeedType, date: str, hour: int,
+                       executor: ProcessPoolExecutor = None, files_per_task=PB_FILES_PER_TASK) -> (pd.DataFrame, str):
+    hour_filled = str(hour).zfill(2)
+    feather_path = get_rt_feather_path(operator.value, feed_type.value, date, hour_filled)
+    if os.path.exists(feather_path):
+        # print(f"Reading from {feather_path}")
+        return ss.read_feather(feather_path), feather_path
+
+    search_path = kp.get_rt_hour_dir_path(operator.value, feed_type.value, date, hour)
+    file_list = []
+    for root, _, files in os.walk(search_path):
+        for file in files:
+            if file.endswith(".pb"):
+                file_list.append(os.path.join(root, file))
+    # Snapshot file names sort by time
+    file_list.sort()
+
+    # print(f"Reading {len(file_list)} files with {os.cpu_count() - 2} processes")
+
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=os.cpu_count() - 2) as executor:
+            merged_df = _read_pb_batches(file_list, feed_type, executor, files_per_task)
+    else:
+        merged_df = _read_pb_batches(file_list, feed_type, executor, files_per_task)
+
+    return _write_hour_feather(merged_df, feather_path, search_path), feather_path
+
+
+def list_rt_day_pb_files(operator: OperatorsWithRT, feed_type: FeedType, date: str) -> dict[int, list[str]]:
+    files_by_hour = {hour: [] for hour in range(24)}
+    search_path = kp.get_rt_day_dir_path(operator.value, feed_type.value, date)
+    for root, _, files in os.walk(search_path):
+        for file in files:
+            if file.endswith(".pb"):
+                file_path = os.path.join(root, file)
+                _, _, _, hour, _, _ = kp.get_pb_file_info(file_path)
+                files_by_hour[hour].append(file_path)
+    # Snapshot file names sort by time
+    for file_list in files_by_hour.values():
+        file_list.sort()
+    return files_by_hour
+
+
+def iter_rt_day_hours(operator: OperatorsWithRT, feed_type: FeedType, date: str, executor: ProcessPoolExecutor,
+                      files_per_task=PB_FILES_PER_TASK):
+    """
+    Parse the extracted realtime snapshots of a day through a single work queue.
+
+    The batches of all hours are submitted up front, so the pool stays saturated across hour boundaries and
+    sparse night hours instead of draining after every hour. Hours that already have a feather are yielded
+    first, the others as soon as their last batch completes.
+
+    Args:
+        operator (OperatorsWithRT): Operator to read.
+        feed_type (FeedType): Feed type to read.
+        date (str): Date to read (YYYY-MM-DD).
+        executor (ProcessPoolExecutor): Pool to parse snapshots in.
+        files_per_task (int): Snapshots parsed per pool task.
+
+    Yields:
+        (int, pd.DataFrame, str): Hour, its DataFrame and its feather path.
+    """
+    feather_paths = {hour: get_rt_feather_path(operator.value, feed_type.value, date, str(hour).zfill(2))
+                     for hour in range(24)}
+    hours_to_read = []
+    for hour in range(24):
+        if os.path.exists(feather_paths[hour]):
+            yield hour, ss.read_feather(feather_paths[hour]), feather_paths[hour]
+        else:
+            hours_to_read.append(hour)
+    if not hours_to_read:
+        return
+
+    files_by_hour = list_rt_day_pb_files(operator, feed_type, date)
+    hour_futures = {hour: _submit_pb_batches(files_by_hour[hour], feed_type, executor, files_per_task)
+                    for hour in hours_to_read}
+    for hour, merged_df in _drain_hour_batches(hour_futures):
+        search_path = kp.get_rt_hour_dir_path(operator.value, feed_type.value, date, hour)
+        yield hour, _write_hour_feather(merged_df, feather_paths[hour], search_path), feather_paths[hour]
 
 
 def read_rt_day_to_df(operator: OperatorsWithRT, feed_type: FeedType, date: str, remove_folder_after=False,
                       executor: ProcessPoolExecutor = None) -> (pd.DataFrame, list[str]):
-    frames = []
-    feather_paths = []
-    for hour in tqdm.tqdm(range(24), desc=f"Reading {operator.value} {feed_type.value} {date}"):
-        df, path = read_rt_hour_to_df(operator, feed_type, date, hour, executor=executor)
-        feather_paths.append(path)
-        df.drop(columns='index', errors='ignore', inplace=True)
-        if not df.empty:
-            frames.append(df)
+    hour_frames = {}
+    feather_paths = {}
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=os.cpu_count() - 2)
+    try:
+        for hour, df, path in tqdm.tqdm(iter_rt_day_hours(operator, feed_type, date, executor), total=24,
+                                        desc=f"Reading {operator.value} {feed_type.value} {date}"):
+            feather_paths[hour] = path
+            df.drop(columns='index', errors='ignore', inplace=True)
+            hour_frames[hour] = df
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    feather_paths = [feather_paths[hour] for hour in range(24)]
+    frames = [hour_frames[hour] for hour in range(24) if not hour_frames[hour].empty]
     if not frames:
         return pd.DataFrame(), feather_paths
     if remove_folder_after:
@@ -198,7 +343,89 @@ def read_rt_day_to_df(operator: OperatorsWithRT, feed_type: FeedType, date: str,
         if os.path.exists(operator_folder):
             print(f"Removing {operator_folder}")
             shutil.rmtree(operator_folder)
-    return pd.concat(frames, axis=0), feather_paths
+    return sp.concat_trip_updates(frames), feather_paths
+
+
+def _group_hours(hours: list[int], bytes_by_hour: dict[int, int], budget_bytes: int) -> list[list[int]]:
+    # Consecutive hours per archive read, an hour larger than the budget is read on its own
+    groups, group_bytes = [], 0
+    for hour in hours:
+        if not groups or group_bytes + bytes_by_hour[hour] > budget_bytes:
+            groups.append([])
+            group_bytes = 0
+        groups[-1].append(hour)
+        group_bytes += bytes_by_hour[hour]
+    return groups
+
+
+def read_rt_archive_to_df(operator: OperatorsWithRT, feed_type: FeedType, date: str, archive_path: str,
+                          executor: ProcessPoolExecutor = None,
+                          read_mb=RT_ARCHIVE_READ_MB) -> (pd.DataFrame, list[str]):
+    """
+    Streaming alternative to read_rt_day_to_df that parses snapshots straight from the KoDa archive.
+
+    Archive members are grouped into runs of whole hours of at most read_mb uncompressed megabytes (at least
+    one hour) and read into memory one run at a time, so the extracted tree is never written to disk. Hour
+    feathers are still written as checkpoints, and hours that already have one are not read from the archive
+    again.
+
+    Args:
+        operator (OperatorsWithRT): Operator of the archive.
+        feed_type (FeedType): Feed type of the archive.
+        date (str): Date of the archive (YYYY-MM-DD).
+        archive_path (str): Path to the downloaded realtime archive.
+        executor (ProcessPoolExecutor): Pool to parse snapshots in, a new one is created if None.
+        read_mb (int): Uncompressed megabytes to decompress per archive read. Lower values reduce peak memory
+            but decompress solid 7z archives more often, each read decompresses the stream from its start.
+
+    Returns:
+        (pd.DataFrame, list[str]): Day DataFrame and the hour feather paths written.
+    """
+    os.makedirs(kp.get_rt_dir_path(operator.value, date), exist_ok=True)
+
+    members_by_hour = {hour: [] for hour in range(24)}
+    bytes_by_hour = {hour: 0 for hour in range(24)}
+    for name, size in sp.list_archive_member_sizes(archive_path).items():
+        if name.endswith(".pb"):
+            hour = kp.get_archive_member_hour(name)
+            members_by_hour[hour].append(name)
+            bytes_by_hour[hour] += size
+
+    feather_paths = {hour: get_rt_feather_path(operator.value, feed_type.value, date, str(hour).zfill(2))
+                     for hour in range(24)}
+    hours_to_read = [hour for hour in range(24) if not os.path.exists(feather_paths[hour])]
+    hour_groups = _group_hours(hours_to_read, bytes_by_hour, read_mb * 1024 * 1024)
+    target_groups = [[name for hour in hours for name in members_by_hour[hour]] for hours in hour_groups]
+
+    hour_frames = {hour: ss.read_feather(feather_paths[hour]) for hour in range(24) if hour not in hours_to_read}
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=os.cpu_count() - 2)
+    try:
+        progress = tqdm.tqdm(total=24, desc=f"Streaming {operator.value} {feed_type.value} {date}")
+        progress.update(24 - len(hours_to_read))
+        for hours, contents in zip(hour_groups, sp.iter_archive_members(archive_path, target_groups)):
+            # All hours of a read share the pool queue, like iter_rt_day_hours
+            hour_futures = {hour: _submit_pb_batches([contents[name] for name in sorted(members_by_hour[hour])],
+                                                     feed_type, executor)
+                            for hour in hours}
+            for hour, merged_df in _drain_hour_batches(hour_futures):
+                hour_frames[hour] = _write_hour_feather(merged_df, feather_paths[hour], f"{archive_path} hour {hour}")
+                progress.update(1)
+        progress.close()
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    frames = []
+    for hour in range(24):
+        df = hour_frames[hour]
+        df.drop(columns='index', errors='ignore', inplace=True)
+        if not df.empty:
+            frames.append(df)
+    if not frames:
+        return pd.DataFrame(), list(feather_paths.values())
+    return sp.concat_trip_updates(frames), list(feather_paths.values())
 
 
 # From pykoda datautils
@@ -215,8 +442,8 @@ def drop_tripupdates_duplicates(df: pd.DataFrame) -> pd.DataFrame:
 def keep_only_latest_stop_updates(df: pd.DataFrame) -> pd.DataFrame:
     if df.empty:
         return df
-    # Ensure the DataFrame is sorted by 'timestamp'
-    df.sort_values(by='timestamp', ascending=True, inplace=True)
+    # Ensure the DataFrame is sorted by 'timestamp', stable so updates with equal timestamps stay in snapshot order
+    df.sort_values(by='timestamp', ascending=True, inplace=True, kind='stable')
 
     # Drop duplicates, keeping the last occurrence (latest timestamp)
     df = df.drop_duplicates(subset=['trip_id', 'stop_id'], keep='last')
@@ -3,15 +3,34 @@ import sys
 import time
 import typing
 
+from concurrent.futures import ProcessPoolExecutor
+
 import hopsworks
 import pandas as pd
 
-from shared.constants import OperatorsWithRT
+from shared.constants import OperatorsWithRT, parse_operators
+import koda.koda_parse as kpa
 import koda.koda_pipeline as kp
 import shared.features as sf
+import shared.storage as ss
 from shared.file_logger import setup_logger
-
-OPERATOR = OperatorsWithRT.X_TRAFIK
+from shared.stages import FairExecutor, Stage, StageFailure, interleave, run_stages
+
+# Operators backfilled together, their dates are interleaved through the stages and share the process pool
+OPERATORS = parse_operators(os.environ.get("OPERATORS", OperatorsWithRT.X_TRAFIK.value))
+
+# Concurrency per backfill stage, see backfill_stages
+DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", 2))
+EXTRACT_WORKERS = int(os.environ.get("EXTRACT_WORKERS", 1))
+# One parse worker per operator, so a large operator's day does not hold back the others from the shared pool
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", len(OPERATORS)))
+FEATURE_WORKERS = int(os.environ.get("FEATURE_WORKERS", 1))
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", 1))
+# Dates that may wait in front of each stage, bounds how far downloads run ahead (and the disk they use)
+STAGE_QUEUE_SIZE = int(os.environ.get("STAGE_QUEUE_SIZE", 1))
+# Number of dates whose KoDa archives are requested ahead and prepared concurrently, 0 requests them one by one in
+# the download stage
+REQUEST_AHEAD_DAYS = int(os.environ.get("REQUEST_AHEAD_DAYS", 0))
 
 log_file_path = os.path.join(os.path.dirname(__file__), 'koda_backfill.log')
 logger = setup_logger('koda_backfill', log_file_path)
@@ -20,29 +39,33 @@ logger = setup_logger('koda_backfill', log_file_path)
 pd.options.mode.copy_on_write = True
 
 
-def backfill_date(date: str, fg=None, dry_run=True) -> (int, typing.Union[None, object]):
-    rt_df, route_types_map_df, stop_count_df, stop_location_map_df = kp.get_koda_data_for_day(date, OPERATOR)
+def build_features_for_date(date: str, operator: OperatorsWithRT,
+                            koda_data: tuple) -> (int, typing.Union[None, pd.DataFrame]):
+    rt_df, route_types_map_df, stop_count_df, stop_location_map_df = koda_data
 
     if rt_df.empty:
-        logger.warning(f"No data available for {date}. backfill_date exiting.")
+        logger.warning(f"No data available for {operator.value} on {date}. backfill_date exiting.")
         return 1, None
 
     if route_types_map_df.empty:
-        logger.warning(f"No route type data available for {date}. backfill_date exiting.")
+        logger.warning(f"No route type data available for {operator.value} on {date}. backfill_date exiting.")
         return 1, None
 
     if stop_count_df.empty:
-        logger.warning(f"No stop count data available for {date}. backfill_date exiting.")
+        logger.warning(f"No stop count data available for {operator.value} on {date}. backfill_date exiting.")
         return 1, None
 
     if stop_location_map_df.empty:
-        logger.warning(f"No stop location data available for {date}. backfill_date exiting.")
+        logger.warning(f"No stop location data available for {operator.value} on {date}. backfill_date exiting.")
         return 1, None
 
-    final_metrics = sf.build_feature_group(rt_df, route_types_map_df, stop_count_df=stop_count_df)
+    return 0, sf.build_feature_group(rt_df, route_types_map_df, stop_count_df=stop_count_df)
 
+
+def upload_features(final_metrics: pd.DataFrame, operator: OperatorsWithRT, fg=None,
+                    dry_run=True) -> (int, typing.Union[None, object]):
     if dry_run:
-        final_metrics.to_csv("koda_backfill.csv", index=False)
+        final_metrics.to_csv(f"koda_backfill_{operator.value}.csv", index=False)
         return -1, None
 
     if fg is None:
@@ -58,6 +81,72 @@ def backfill_date(date: str, fg=None, dry_run=True) -> (int, typing.Union[None,
     return 0, j
 
 
+def backfill_date(date: str, operator: OperatorsWithRT, fg=None, dry_run=True) -> (int, typing.Union[None, object]):
+    exit_code, final_metrics = build_features_for_date(date, operator, kp.get_koda_data_for_day(date, operator))
+    if exit_code != 0:
+        return exit_code, None
+    return upload_features(final_metrics, operator, fg=fg, dry_run=dry_run)
+
+
+def get_delays_feature_groups(fs, operators: list[OperatorsWithRT], version: int) -> dict:
+    """The delay feature group of every operator, see shared.features.delays_feature_group_name."""
+    # TODO: Data expectations?
+    return {operator: fs.get_or_create_feature_group(
+        name=sf.delays_feature_group_name(operator),
+        description=f'Aggregated delay metrics per hour per day for operator {operator.value}',
+        version=version,
+        primary_key=['arrival_time_bin', 'route_type'],
+        event_time='arrival_time_bin'
+    ) for operator in operators}
+
+
+def backfill_stages(fgs: dict, dry_run: bool, executor: FairExecutor) -> list[Stage]:
+    """
+    The steps of backfill_date as stages of shared.stages.run_stages, for (operator, date) items, each passing
+    ((operator, date), result) on.
+
+    Downloading the next dates overlaps parsing and uploading earlier ones. Parsing runs in the shared
+    process pool, one parse worker per operator keeps it busy. The pool hands its workers out fairly between
+    the operators being parsed, so the snapshots of a large feed like SL do not queue ahead of the small ones.
+
+    Args:
+        fgs (dict): Delay feature group per operator, operators without one are not uploaded.
+        dry_run (bool): Write the features to a csv per operator instead of uploading them.
+        executor (FairExecutor): Process pool shared by all operators.
+    """
+    def download(job):
+        operator, date = job
+        return job, kp.fetch_koda_archives_for_day(date, operator)
+
+    def extract(job):
+        (operator, date), (rt_archive_path, static_archive_path) = job
+        return (operator, date), kp.extract_koda_archives_for_day(date, operator, rt_archive_path,
+                                                                  static_archive_path)
+
+    def parse(job):
+        (operator, date), rt_archive_path = job
+        return (operator, date), kp.read_koda_data_for_day(date, operator, rt_archive_path,
+                                                           executor=executor.for_key(operator))
+
+    def features(job):
+        (operator, date), koda_data = job
+        return (operator, date), build_features_for_date(date, operator, koda_data)
+
+    def upload(job):
+        (operator, date), (exit_code, final_metrics) = job
+        if exit_code != 0:
+            return (operator, date), (exit_code, None)
+        return (operator, date), upload_features(final_metrics, operator, fg=fgs.get(operator), dry_run=dry_run)
+
+    return [
+        Stage("download", download, workers=DOWNLOAD_WORKERS, queue_size=STAGE_QUEUE_SIZE),
+        Stage("extract", extract, workers=EXTRACT_WORKERS, queue_size=STAGE_QUEUE_SIZE),
+        Stage("parse", parse, workers=PARSE_WORKERS, queue_size=STAGE_QUEUE_SIZE),
+        Stage("features", features, workers=FEATURE_WORKERS, queue_size=STAGE_QUEUE_SIZE),
+        Stage("upload", upload, workers=UPLOAD_WORKERS, queue_size=STAGE_QUEUE_SIZE),
+    ]
+
+
 if __name__ == "__main__":
     START_DATE = os.environ.get("START_DATE", "2024-09-07")
     END_DATE = os.environ.get("END_DATE", "2024-09-07")
@@ -71,56 +160,73 @@ if __name__ == "__main__":
     except (ValueError, TypeError):
         logger.error("Invalid date range. Exiting.")
         sys.exit(1)
-    total_dates = len(dates)
+    total_dates = len(dates) * len(OPERATORS)
     start_time = time.time()
 
-    delays_fg = None
+    delays_fgs = {}
     if not DRY_RUN:
         if os.environ.get("HOPSWORKS_API_KEY") is None:
             os.environ["HOPSWORKS_API_KEY"] = open(".hw_key").read()
         try:
             project = hopsworks.login()
             fs = project.get_feature_store()
-            # TODO: Data expectations?
-            delays_fg = fs.get_or_create_feature_group(
-                name='delays',
-                description='Aggregated delay metrics per hour per day',
-                version=FG_VERSION,
-                primary_key=['arrival_time_bin', 'route_type'],
-                event_time='arrival_time_bin'
-            )
+            delays_fgs = get_delays_feature_groups(fs, OPERATORS, FG_VERSION)
         except Exception as e:
             logger.warning(f"Failed to connect to Hopsworks. Continuing without uploads {e}")
 
-    logger.info("Starting backfill process for dates: %s - %s and stride: %s (%s days)", START_DATE, END_DATE, STRIDE,
-                total_dates)
+    logger.info("Starting backfill process for operators: %s, dates: %s - %s and stride: %s (%s days)",
+                ", ".join(operator.value for operator in OPERATORS), START_DATE, END_DATE, STRIDE, len(dates))
 
     exit_codes = []
-
-    for i, datetime in enumerate(dates):
-        logger.info("Starting processing for date: %s", datetime)
-        date = datetime.strftime("%Y-%m-%d")
-        exit_code, job = backfill_date(date, fg=delays_fg, dry_run=DRY_RUN)
-        if exit_code == -1:
-            logger.info("Dry run completed for date: %s", date)
-            sys.exit(0)
-        if exit_code == 0 and job is not None and i % RUN_HW_MATERIALIZATION_EVERY == 0:
-            logger.info("Running offline materialization jobs")
-            try:
-                job.run(await_termination=False)
-            except Exception as e:
-                logger.error(f"Failed to run offline materialization job. Skipping. {e}")
-        exit_codes.append(exit_code)
-        elapsed_time = time.time() - start_time
-        avg_time_per_date = elapsed_time / (i + 1)
-        remaining_time = avg_time_per_date * (total_dates - (i + 1))
-        logger.info("Completed processing for date: %s with exit code: %d", date, exit_code)
-        logger.info("Progress: %d/%d (%.2f%%) - Estimated time remaining: %.2f seconds",
-                    i + 1, total_dates, (i + 1) / total_dates * 100, remaining_time)
-
+    # A dry run only writes the features of the first date of every operator
+    date_strings = [datetime.strftime("%Y-%m-%d") for datetime in dates]
+    if DRY_RUN:
+        date_strings = date_strings[:1]
+        total_dates = len(OPERATORS)
+
+    # Round-robin over the operators, so every stage alternates between them instead of doing one after another
+    operator_days = interleave([(operator, date) for date in date_strings] for operator in OPERATORS)
+    if REQUEST_AHEAD_DAYS > 0:
+        # Dates enter the pipeline in the order KoDa finishes their archives
+        operator_days = kp.iter_prepared_koda_operator_days(operator_days, window=REQUEST_AHEAD_DAYS)
+
+    # Intermediates are written uncompressed, recompress the ones the remaining dates no longer use
+    stop_demotion = ss.start_background_demotion(kpa.DATA_DIR)
+    with ProcessPoolExecutor(max_workers=kp.USE_PROCESSES) as executor:
+        stages = backfill_stages(delays_fgs, DRY_RUN, FairExecutor(executor, kp.USE_PROCESSES))
+        for i, result in enumerate(run_stages(operator_days, stages)):
+            if isinstance(result, StageFailure):
+                operator, date = result.item
+                logger.error("Failed %s stage for %s on date: %s. %s", result.stage, operator.value, date,
+                             result.error)
+                exit_codes.append(3)
+                continue
+            (operator, date), (exit_code, job) = result
+            if exit_code == -1:
+                logger.info("Dry run completed for %s on date: %s", operator.value, date)
+                continue
+            if exit_code == 0 and job is not None and i % RUN_HW_MATERIALIZATION_EVERY == 0:
+                logger.info("Running offline materialization jobs")
+                try:
+                    job.run(await_termination=False)
+                except Exception as e:
+                    logger.error(f"Failed to run offline materialization job. Skipping. {e}")
+            exit_codes.append(exit_code)
+            elapsed_time = time.time() - start_time
+            avg_time_per_date = elapsed_time / (i + 1)
+            remaining_time = avg_time_per_date * (total_dates - (i + 1))
+            logger.info("Completed processing for %s on date: %s with exit code: %d", operator.value, date, exit_code)
+            logger.info("Progress: %d/%d (%.2f%%) - Estimated time remaining: %.2f seconds",
+                        i + 1, total_dates, (i + 1) / total_dates * 100, remaining_time)
+
+    stop_demotion.set()
     logger.info("Backfill process completed for dates: %s - %s", START_DATE, END_DATE)
+    elapsed_time = time.time() - start_time
+    for stage in stages:
+        logger.info("Stage %s", stage.summary(elapsed_time))
     successfully_uploaded = exit_codes.count(0)
     not_uploaded = exit_codes.count(2)
     missing_data = exit_codes.count(1)
-    logger.info("Summary: Successfully uploaded: %d, Not uploaded: %d, Missing data: %d", successfully_uploaded,
-                not_uploaded, missing_data)
+    failed = exit_codes.count(3)
+    logger.info("Summary: Successfully uploaded: %d, Not uploaded: %d, Missing data: %d, Failed: %d",
+                successfully_uploaded, not_uploaded, missing_data, failed)
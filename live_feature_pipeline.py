@@ -1,17 +1,21 @@
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import hopsworks
 import pandas as pd
 
-from shared.constants import OperatorsWithRT
+from shared.constants import OperatorsWithRT, parse_operators
 from shared.file_logger import setup_logger
 import weather.pipeline as wp
 import gtfs_regional.pipeline as gp
 import shared.features as sf
+import shared.incremental_features as sif
 
-OPERATOR = OperatorsWithRT.X_TRAFIK
+# Operators updated together, each in its own thread, their downloads share the connection pools of shared.api
+OPERATORS = parse_operators(os.environ.get("OPERATORS", OperatorsWithRT.X_TRAFIK.value))
+LIVE_WORKERS = int(os.environ.get("LIVE_WORKERS", min(len(OPERATORS), 4)))
 LIVE_MIN_TRIP_UPDATES_PER_TIMESLOT = 5
 
 log_file_path = os.path.join(os.path.dirname(__file__), 'live_feature.log')
@@ -42,54 +46,80 @@ def get_live_weather_data(today: str, fg = None, dry_run=False) -> int:
     return 0
 
 
-def get_live_delays_data(today: str, fg=None, dry_run=False) -> int:
-    rt_df, route_types_map_df, stop_count_df, stop_location_map_df = gp.get_gtfr_data_for_day(today, OPERATOR, force_rt=True)
+def get_live_delays_data(today: str, operator: OperatorsWithRT, fg=None, dry_run=False) -> int:
+    rt_df, route_types_map_df, stop_count_df, stop_location_map_df = gp.get_gtfr_data_for_day(today, operator, force_rt=True)
 
     if rt_df.empty:
-        logger.warning(f"No data available for {today}. get_live_delays_data exiting.")
+        logger.warning(f"No data available for {operator.value} on {today}. get_live_delays_data exiting.")
         return 1
 
     if route_types_map_df.empty:
-        logger.warning(f"No routy type data available for {today}. get_live_delays_data exiting.")
+        logger.warning(f"No routy type data available for {operator.value} on {today}. get_live_delays_data exiting.")
         return 1
 
     if stop_count_df.empty:
-        logger.warning(f"No stop count data available for {today}. get_live_delays_data exiting.")
+        logger.warning(f"No stop count data available for {operator.value} on {today}. get_live_delays_data exiting.")
         return 1
 
     if stop_location_map_df.empty:
-        logger.warning(f"No stop location data available for {today}. get_live_delays_data exiting.")
+        logger.warning(f"No stop location data available for {operator.value} on {today}. get_live_delays_data exiting.")
         return 1
 
     # Write rt_df to csv for debugging
-    stop_location_map_df.to_csv("stop_location_map_df.csv", index=False)
+    stop_location_map_df.to_csv(f"stop_location_map_df_{operator.value}.csv", index=False)
 
-    final_metrics = sf.build_feature_group(rt_df, route_types_map_df, stop_count_df=stop_count_df, min_trip_updates_per_slot=LIVE_MIN_TRIP_UPDATES_PER_TIMESLOT)
+    # Only the hours changed since the last uploaded run are recomputed and uploaded
+    final_metrics, updated_metrics, state = sif.update_live_features(
+        operator, today, rt_df, route_types_map_df, stop_count_df,
+        min_trip_updates_per_slot=LIVE_MIN_TRIP_UPDATES_PER_TIMESLOT)
 
+    # The state is only written once the changed hours are in the feature group, so runs that do not upload them
+    # (dry runs, failed inserts) leave them to the next run
     if dry_run:
-        final_metrics.to_csv("live_feature_delays.csv", index=False)
+        final_metrics.to_csv(f"live_feature_delays_{operator.value}.csv", index=False)
         return -1
 
+    if updated_metrics.empty:
+        logger.info(f"No delay features changed since the last run for {operator.value} on {today}. Skipping upload.")
+        state.write()
+        return 0
+
     if fg is None:
         logger.warning("No Hopsworks connection. Skipping upload.")
         return 2
     try:
-        j, _ = fg.insert(final_metrics, write_options={"start_offline_materialization": False})
+        j, _ = fg.insert(updated_metrics, write_options={"start_offline_materialization": False})
         j.run()
     except Exception as e:
         logger.warning(f"Failed to connect to Hopsworks and skipping upload. {e}")
         return 2
 
+    state.write()
     return 0
 
 
+def get_live_delays_data_for_operators(today: str, operators: list[OperatorsWithRT], fgs: dict,
+                                       dry_run=False) -> dict:
+    """get_live_delays_data of several operators concurrently, returns the exit code per operator."""
+    def run(operator):
+        try:
+            return get_live_delays_data(today, operator, fgs.get(operator), dry_run)
+        except Exception as e:
+            # One failing feed must not take the other operators down with it
+            logger.error(f"Failed to update live delays for {operator.value}. {e}")
+            return 3
+
+    with ThreadPoolExecutor(max_workers=max(LIVE_WORKERS, 1)) as executor:
+        return dict(zip(operators, executor.map(run, operators)))
+
+
 if __name__ == "__main__":
     DRY_RUN = os.environ.get("DRY_RUN", "True").lower() == "true"
     WEATHER_FG_VERSION = int(os.environ.get("WEATHER_FG_VERSION", 3))
     DELAYS_FG_VERSION = int(os.environ.get("DELAYS_FG_VERSION", 10))
     today = datetime.now().strftime("%Y-%m-%d")
 
-    delays_fg = None
+    delays_fgs = {}
     weather_fg = None
     if not DRY_RUN:
         if os.environ.get("HOPSWORKS_API_KEY") is None:
@@ -97,10 +127,10 @@ if __name__ == "__main__":
         try:
             project = hopsworks.login()
             fs = project.get_feature_store()
-            delays_fg = fs.get_feature_group(
-                name='delays',
+            delays_fgs = {operator: fs.get_feature_group(
+                name=sf.delays_feature_group_name(operator),
                 version=DELAYS_FG_VERSION
-            )
+            ) for operator in OPERATORS}
             weather_fg = fs.get_feature_group(
                 name='weather',
                 version=WEATHER_FG_VERSION
@@ -111,6 +141,7 @@ if __name__ == "__main__":
 
     logger.info(f"Starting live feature pipeline for {today}")
     weather_exit_code = get_live_weather_data(today, weather_fg, DRY_RUN)
-    delays_exit_code = get_live_delays_data(today, delays_fg, DRY_RUN)
+    delays_exit_codes = get_live_delays_data_for_operators(today, OPERATORS, delays_fgs, DRY_RUN)
+    delays_exit_code = ", ".join(f"{operator.value}: {code}" for operator, code in delays_exit_codes.items())
 
-    logger.info(f"Completed live feature pipeline for {today} with weather exit code {weather_exit_code} and delays exit code {delays_exit_code}")
+    logger.info(f"Completed live feature pipeline for {today} with weather exit code {weather_exit_code} and delays exit codes {delays_exit_code}")
@@ -1,23 +1,200 @@
+import os
+import threading
 import time
 
 import requests
 from requests import Response
+from requests.adapters import HTTPAdapter
 import typing
 
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+POOL_SIZE = 8
 
-def fetch_with_exponential_backoff(url: str, timeout: int, max_retries: int) -> typing.Union[Response, None]:
+_local = threading.local()
+
+
+def get_session() -> requests.Session:
+    """Session of the calling thread, reusing connections across requests instead of opening one per request."""
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _local.session = session
+    return session
+
+
+def _retry_after(response: Response, default: float) -> float:
+    retry_after = response.headers.get("Retry-After", "")
+    return float(retry_after) if retry_after.isdigit() else default
+
+
+def fetch_with_exponential_backoff(url: str, timeout: int, max_retries: int, stream=False,
+                                   headers: dict = None) -> typing.Union[Response, None]:
+    """
+    GET url, retrying timeouts, connection errors and retryable status codes (429, 5xx) with a doubling delay.
+
+    Returns the last response if the status code is still retryable after max_retries, None if no response was
+    received at all. With stream=True the body is not read, callers should close the response.
+    """
     retries = 0
     wait_time = timeout
+    response = None
 
     while retries < max_retries:
         try:
-            response = requests.get(url, timeout=timeout)
-            return response
-        except (requests.exceptions.Timeout, requests.exceptions.ConnectTimeout):
+            response = get_session().get(url, timeout=timeout, stream=stream, headers=headers)
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
             retries += 1
             print(f"Timeout reached. Retrying in {wait_time} seconds...")
             time.sleep(wait_time)
             wait_time *= 2
+            continue
+        if response.status_code not in RETRY_STATUS_CODES:
+            return response
+        retries += 1
+        if retries < max_retries:
+            delay = _retry_after(response, wait_time)
+            response.close()
+            print(f"Status {response.status_code}. Retrying in {delay} seconds...")
+            time.sleep(delay)
+            wait_time *= 2
 
     print("Max retries reached. Exiting.")
-    return None
+    return response
+
+
+def get_part_path(target_path: str) -> str:
+    return f"{target_path}.part"
+
+
+def get_validator_path(target_path: str) -> str:
+    # ETag or Last-Modified of the response the .part file was started from
+    return f"{target_path}.part.validator"
+
+
+def _validator(response: Response) -> typing.Union[str, None]:
+    # If-Range only accepts strong ETags
+    etag = response.headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return response.headers.get("Last-Modified")
+
+
+def _read_validator(target_path: str) -> typing.Union[str, None]:
+    validator_path = get_validator_path(target_path)
+    if not os.path.exists(validator_path):
+        return None
+    with open(validator_path, "r") as f:
+        return f.read() or None
+
+
+def _remove_partial(target_path: str) -> None:
+    for path in (get_part_path(target_path), get_validator_path(target_path)):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def request_download(url: str, target_path: str, timeout: int, max_retries: int,
+                     resume=True) -> typing.Union[Response, None]:
+    """
+    Start a streamed download of url, asking for the remainder of a partial download of target_path if any.
+
+    The remainder is requested with If-Range and the validator of the response the partial download started
+    from, so the server sends the whole file instead if it changed since. Partial downloads without a validator
+    are not resumed.
+    """
+    part_path = get_part_path(target_path)
+    headers = None
+    validator = _read_validator(target_path)
+    if resume and validator is not None and os.path.exists(part_path) and os.path.getsize(part_path) > 0:
+        headers = {"Range": f"bytes={os.path.getsize(part_path)}-", "If-Range": validator}
+    return fetch_with_exponential_backoff(url, timeout, max_retries, stream=True, headers=headers)
+
+
+def _resumes_at(response: Response, offset: int) -> bool:
+    # Content-Range: bytes {start}-{end}/{total}
+    content_range = response.headers.get("Content-Range", "")
+    return content_range.startswith(f"bytes {offset}-")
+
+
+def download_to_file(url: str, target_path: str, timeout: int, max_retries: int, response: Response = None,
+                     resume=True) -> bool:
+    """
+    Stream url to target_path in chunks, without holding the body in memory.
+
+    The body is written to a .part file that is only renamed to target_path once complete, so an existing
+    target_path is always a complete download. With resume, interrupted transfers are continued with an HTTP
+    Range request, also across runs, as long as the ETag or Last-Modified of the file did not change. Without
+    resume they start over.
+
+    Args:
+        url (str): URL to download.
+        target_path (str): Path to write the download to.
+        timeout (int): Request timeout in seconds, also the first retry delay.
+        max_retries (int): Retries per request and for interrupted transfers.
+        response (Response, optional): Already started streamed response for url, see request_download.
+        resume (bool): Continue partial downloads. Disable for URLs whose content changes.
+
+    Returns:
+        bool: True if target_path was written.
+    """
+    part_path = get_part_path(target_path)
+    if not resume:
+        _remove_partial(target_path)
+    interruptions = 0
+    wait_time = timeout
+
+    while True:
+        if response is None:
+            response = request_download(url, target_path, timeout, max_retries, resume=resume)
+            if response is None:
+                return False
+
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if response.status_code == 206 and offset > 0 and _resumes_at(response, offset):
+            mode = "ab"
+        elif response.status_code == 200:
+            mode = "wb"  # The server sent the whole file, e.g. because it changed since the partial download
+            validator = _validator(response)
+            if validator is None:
+                # Without a validator a later resume could join two different versions of the file
+                _remove_partial(target_path)
+            else:
+                with open(get_validator_path(target_path), "w") as f:
+                    f.write(validator)
+        elif response.status_code in (206, 416):
+            # The partial file does not match the remote file anymore, start over
+            response.close()
+            response = None
+            _remove_partial(target_path)
+            continue
+        else:
+            print(f"Error: {response.status_code}")
+            print(response.text)
+            response.close()
+            return False
+
+        try:
+            with response, open(part_path, mode) as file:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    file.write(chunk)
+        except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                requests.exceptions.Timeout) as e:
+            interruptions += 1
+            if interruptions >= max_retries:
+                print(f"Download of {os.path.basename(target_path)} failed. {e}")
+                return False
+            print(f"Download of {os.path.basename(target_path)} interrupted, resuming in {wait_time} seconds...")
+            time.sleep(wait_time)
+            wait_time *= 2
+            response = None
+            if not resume:
+                _remove_partial(target_path)
+            continue
+
+        os.replace(part_path, target_path)
+        _remove_partial(target_path)
+        return True
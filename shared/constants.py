@@ -26,6 +26,15 @@ class OperatorsWithRT(Enum):
     OSTGOTATRAFIKEN = "otraf"
 
 
+def parse_operators(value: str) -> list[OperatorsWithRT]:
+    """Operators of a comma-separated list of operator values, e.g. "xt,ul", or all operators for "all"."""
+    if value.strip().lower() == "all":
+        return list(OperatorsWithRT)
+    operators = [OperatorsWithRT(v.strip()) for v in value.split(",") if v.strip()]
+    # Keep the first occurrence of duplicates, the order is the order operators are scheduled in
+    return list(dict.fromkeys(operators))
+
+
 class StaticDataTypes(Enum):
     AGENCY = "agency"
     ATTRIBUTIONS = "attributions"
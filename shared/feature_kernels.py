@@ -0,0 +1,121 @@
+import numpy as np
+
+# NumPy kernels for the vectorised feature engine in shared.features. They work on one sorted layout where
+# groups (trips, route types) are contiguous segments, described by their start offsets: starts[k] is the first
+# row of segment k and starts[-1] == len(values).
+
+
+def segment_starts(keys: np.ndarray) -> np.ndarray:
+    """Start offsets of the runs of equal keys in a grouped (e.g. sorted) array, followed by len(keys)."""
+    if len(keys) == 0:
+        return np.zeros(1, dtype=np.int64)
+    changes = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+    return np.concatenate(([0], changes, [len(keys)])).astype(np.int64)
+
+
+def segment_ids(starts: np.ndarray) -> np.ndarray:
+    """Segment number of every row."""
+    return np.repeat(np.arange(len(starts) - 1), np.diff(starts))
+
+
+def segment_positions(starts: np.ndarray) -> np.ndarray:
+    """Position of every row within its segment, 0 for the first row."""
+    return np.arange(starts[-1]) - np.repeat(starts[:-1], np.diff(starts))
+
+
+def prefix_sums(values: np.ndarray) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    Counts of non-NaN values, their sums and sums of squares up to (excluding) every row, with a final total.
+
+    The sum over rows [a, b) is then sums[b] - sums[a]. Delays are whole seconds, so the sums are exact as long as
+    the sum of squares of a day stays below 2**53.
+    """
+    present = ~np.isnan(values)
+    filled = np.where(present, values, 0.0)
+    counts = np.concatenate(([0], np.cumsum(present, dtype=np.int64)))
+    sums = np.concatenate(([0.0], np.cumsum(filled)))
+    squares = np.concatenate(([0.0], np.cumsum(filled * filled)))
+    return counts, sums, squares
+
+
+def segment_diff(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """Difference to the previous row of the same segment, NaN for the first row, like groupby().diff()."""
+    diff = np.empty(len(values), dtype=np.float64)
+    diff[1:] = values[1:] - values[:-1]
+    diff[starts[:-1][starts[:-1] < len(values)]] = np.nan
+    return diff
+
+
+def segment_lag_means(values: np.ndarray, starts: np.ndarray, windows: list[int]) -> dict[int, np.ndarray]:
+    """
+    Mean of the window rows before every row within its segment, like groupby().rolling(window, closed='left'),
+    for several windows from one pass of prefix sums.
+
+    As with the pandas default min_periods, a mean is NaN unless all window rows exist and are not NaN.
+
+    Returns:
+        dict[int, np.ndarray]: Lagged means per window.
+    """
+    counts, sums, _ = prefix_sums(values)
+    rows = np.arange(len(values))
+    positions = segment_positions(starts)
+    lags = {}
+    for window in windows:
+        full = positions >= window
+        lo = np.where(full, rows - window, 0)
+        complete = full & (counts[rows] - counts[lo] == window)
+        lags[window] = np.where(complete, (sums[rows] - sums[lo]) / window, np.nan)
+    return lags
+
+
+def time_window_starts(times: np.ndarray, starts: np.ndarray, width: int) -> np.ndarray:
+    """
+    First row of the (t - width, t] window of every row, for times sorted within segments.
+
+    Like rolling(f'{width}s') the window ends at the row itself, so rows with the same time after it are not part
+    of it. Segments are shifted apart so that one searchsorted covers all of them.
+    """
+    if len(times) == 0:
+        return np.zeros(0, dtype=np.int64)
+    span = int(times.max() - times.min()) + width + 1
+    keys = (times - times.min()) + segment_ids(starts) * span
+    return np.searchsorted(keys, keys - width, side='right')
+
+
+def window_mean_var(values: np.ndarray, lo: np.ndarray) -> (np.ndarray, np.ndarray):
+    """
+    Mean and sample variance of the non-NaN values in rows [lo, row] of every row.
+
+    NaN when the window has no values (mean) or fewer than two (variance), like rolling().mean() and .var()
+    with a time window.
+    """
+    counts, sums, squares = prefix_sums(values)
+    hi = np.arange(1, len(values) + 1)
+    n = (counts[hi] - counts[lo]).astype(np.float64)
+    s1 = sums[hi] - sums[lo]
+    s2 = squares[hi] - squares[lo]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(n > 0, s1 / n, np.nan)
+        var = np.where(n > 1, np.maximum(n * s2 - s1 * s1, 0.0) / (n * (n - 1)), np.nan)
+    return mean, var
+
+
+def bin_mean(values: np.ndarray, bins: np.ndarray, n_bins: int) -> np.ndarray:
+    """Mean of the non-NaN values per bin, NaN for bins without values."""
+    present = ~np.isnan(values)
+    sums = np.bincount(bins[present], weights=values[present], minlength=n_bins)
+    counts = np.bincount(bins[present], minlength=n_bins)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def range_extrema(values: np.ndarray, ranges: list[tuple[int, int]]) -> (np.ndarray, np.ndarray):
+    """Max and min of the non-NaN values per row range [a, b), NaN for empty or all-NaN ranges."""
+    maxima = np.full(len(ranges), np.nan)
+    minima = np.full(len(ranges), np.nan)
+    for k, (a, b) in enumerate(ranges):
+        if b > a:
+            # fmax/fmin skip NaNs, the result is only NaN if all values are
+            maxima[k] = np.fmax.reduce(values[a:b])
+            minima[k] = np.fmin.reduce(values[a:b])
+    return maxima, minima
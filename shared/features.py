@@ -1,14 +1,32 @@
+import os
+
+import numpy as np
 import pandas as pd
 from hsfs.feature_group import FeatureGroup
 
 import koda.koda_transform as kt
+import shared.feature_kernels as fk
 import shared.transform as st
+from shared.constants import OperatorsWithRT
 
 ON_TIME_MIN_SECONDS = -180
 ON_TIME_MAX_SECONDS = 300
 
 MIN_TRIP_UPDATES_PER_TIMESLOT = 1
 
+# Width of the trend windows
+ROLLING_WINDOW_SECONDS = 20 * 60
+# Numbers of stops in the lag windows, e.g. "3,5,10". The delays feature group has the 5 stop windows, other
+# windows add columns and need a new feature group version
+LAG_WINDOWS = [int(window) for window in os.environ.get("LAG_WINDOWS", "5").split(",")]
+
+# build_feature_group computes the same metrics with NumPy kernels on one sorted layout ("vectorised") or with
+# pandas groupby/rolling/resample ("pandas"), kept as the reference the vectorised engine is validated against,
+# see benchmarks/feature_engine_benchmark.py
+VECTORISED = "vectorised"
+PANDAS = "pandas"
+FEATURE_ENGINE = os.environ.get("FEATURE_ENGINE", VECTORISED)
+
 
 def on_time(df: pd.DataFrame) -> pd.Series:
     """
@@ -20,7 +38,8 @@ def on_time(df: pd.DataFrame) -> pd.Series:
     Returns:
         pd.Series: Series with the 'on_time' feature.
     """
-    return df["arrival_delay"].between(ON_TIME_MIN_SECONDS, ON_TIME_MAX_SECONDS)
+    # Nullable delays give NA for missing values, which count as not on time like NaN does
+    return df["arrival_delay"].between(ON_TIME_MIN_SECONDS, ON_TIME_MAX_SECONDS).fillna(False).astype(bool)
 
 
 def final_stop_delay(df: pd.DataFrame) -> pd.Series:
@@ -34,19 +53,34 @@ def final_stop_delay(df: pd.DataFrame) -> pd.Series:
         pd.Series: Series with the 'final_stop_delay' feature.
     """
     # Ensure the DataFrame is sorted by 'trip_id' and 'stop_sequence'
-    df = df.sort_values(by=['arrival_time'])
+    # Stable, so the last of several updates with the same arrival time is the last in the caller's row order
+    df = df.sort_values(by=['arrival_time'], kind='stable')
 
     # Identify the final stop for each trip
-    final_stops = df.groupby('trip_id').tail(1)
+    final_stops = df.groupby('trip_id', observed=True).tail(1)
 
-    # Create a dictionary of final stop delays
-    final_stop_delays_dict = final_stops.set_index('trip_id')['arrival_delay'].to_dict()
+    # Create a dictionary of final stop delays, as floats so that missing delays are NaN rather than NA
+    final_stop_delays_dict = final_stops.set_index('trip_id')['arrival_delay'].astype('float64').to_dict()
 
     # Map the final stop delays to the main DataFrame
     return final_stop_delays_dict
 
 
-def windowed_lagged_features(df: pd.DataFrame, columns: list) -> pd.DataFrame:
+def lag_column_names(columns: list, windows=LAG_WINDOWS) -> list:
+    """Names of the lagged columns, by window and then column."""
+    return [f'{column}_lag_{window}stops' for window in windows for column in columns]
+
+
+def windowed_lagged_features(df: pd.DataFrame, columns: list, windows=LAG_WINDOWS) -> pd.DataFrame:
+    """
+    Mean of each column over the previous stops of the same trip, for every window in windows (numbers of stops).
+
+    This is the groupby/rolling reference of the pandas engine, the vectorised engine computes the same means with
+    fk.segment_lag_means.
+
+    Returns:
+        pd.DataFrame: route_type, trip_id, arrival_time and the columns of lag_column_names(columns, windows).
+    """
     if 'arrival_time' not in df.index.names:
         raise ValueError("arrival_time must be the index of the DataFrame")
 
@@ -54,23 +88,39 @@ def windowed_lagged_features(df: pd.DataFrame, columns: list) -> pd.DataFrame:
         raise ValueError("Columns to lag are not present in the DataFrame")
 
     df = df.sort_values(by=['trip_id', 'stop_sequence'])
-    window_size = 5 # Number of stops to consider for lagging
-
-    # Create lagged features using windowing within each trip
-    lagged_features = df.groupby(['route_type', 'trip_id']).rolling(window=window_size, closed='left').agg({
-        'arrival_delay': 'mean',
-        'departure_delay': 'mean',
-        'delay_change': 'mean'
-    }).reset_index()
 
-    lagged_features.columns = ['route_type', 'trip_id', 'arrival_time', 'arrival_delay_lag_5stops',
-                               'departure_delay_lag_5stops', 'delay_change_lag_5stops']
+    # Create lagged features using windowing within each trip, the groups come out in the same order for every window
+    grouped = df.groupby(['route_type', 'trip_id'], observed=True)
+    lagged_features = None
+    for window in windows:
+        window_features = grouped.rolling(window=window, closed='left').agg(
+            {column: 'mean' for column in columns}).reset_index()
+        window_features.columns = ['route_type', 'trip_id', 'arrival_time'] + lag_column_names(columns, [window])
+        if lagged_features is None:
+            lagged_features = window_features
+        else:
+            for name in lag_column_names(columns, [window]):
+                lagged_features[name] = window_features[name]
 
     return lagged_features
 
 
-def build_feature_group(rt_df: pd.DataFrame, route_types_map_df: pd.DataFrame,
-                        stop_count_df=pd.DataFrame(), min_trip_updates_per_slot=MIN_TRIP_UPDATES_PER_TIMESLOT) -> pd.DataFrame:
+def stop_update_keys(rt_df: pd.DataFrame) -> np.ndarray:
+    """
+    64 bit hash of the trip_id and stop_id of every row.
+
+    Rows with equal arrival times are ordered by it in both engines and in the live feature state, so their 20
+    minute windows, delay changes and final stops are the same in all of them.
+    """
+    return pd.util.hash_pandas_object(pd.DataFrame({'trip_id': rt_df['trip_id'].astype(str),
+                                                    'stop_id': rt_df['stop_id'].astype(str)}), index=False).to_numpy()
+
+
+def latest_trip_updates_with_route_types(rt_df: pd.DataFrame, route_types_map_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Latest update per trip and stop with its route_type, arrival_time as epoch seconds and the stop_update_keys
+    as 'key'. Shared by both engines.
+    """
     columns_to_keep = [
         "trip_id", "start_date", "timestamp",
         "vehicle_id", "stop_sequence", "stop_id", "arrival_delay",
@@ -80,21 +130,83 @@ def build_feature_group(rt_df: pd.DataFrame, route_types_map_df: pd.DataFrame,
     rt_df = kt.keep_only_latest_stop_updates(rt_df)
 
     # Merge with map_df to get route_type
-    rt_df['trip_id'] = rt_df['trip_id'].astype(str)
     route_types_map_df['trip_id'] = route_types_map_df['trip_id'].astype(str)
+    if isinstance(rt_df['trip_id'].dtype, pd.CategoricalDtype):
+        # Compact trip updates: give the map the same categories so the merge runs on the integer codes,
+        # trips that never had an update become NaN and are dropped so they cannot match missing trip_ids
+        route_types_map_df = route_types_map_df.astype({'trip_id': rt_df['trip_id'].dtype})
+        route_types_map_df = route_types_map_df.dropna(subset=['trip_id'])
+    else:
+        rt_df['trip_id'] = rt_df['trip_id'].astype(str)
     rt_df = rt_df.merge(route_types_map_df, on='trip_id', how='inner')
 
-    # Set up arrival_time as our index and main datetime column
     rt_df = rt_df.dropna(subset=['arrival_time'])  # Drop rows with missing arrival_time
     rt_df['arrival_time'] = rt_df['arrival_time'].astype(int)
-    rt_df['arrival_time'] = pd.to_datetime(rt_df['arrival_time'], unit='s')
+    rt_df['key'] = stop_update_keys(rt_df)
+    return rt_df
 
-    rt_df.sort_values(by='arrival_time', inplace=True)
-    rt_df.set_index('arrival_time', inplace=True)
 
+def finish_feature_group(final_metrics: pd.DataFrame, trip_update_count_df: pd.DataFrame,
+                          stop_count_df: pd.DataFrame, min_trip_updates_per_slot: int) -> pd.DataFrame:
+    """Add the stop counts to the hourly metrics of either engine and drop the hours without enough updates."""
     # Hopsworks expects the stop count to be a double for some reason.
     stop_count_df['stop_count'] = stop_count_df['stop_count'].astype('float64')
 
+    # Merge the stop count information into the final metrics DataFrame
+    final_metrics = final_metrics.merge(stop_count_df, left_on=['route_type', 'arrival_time'],
+                                        right_on=['route_type', 'arrival_time'], how='left')
+
+    # Rename columns
+    final_metrics.columns = ['route_type', 'arrival_time_bin',
+                             'mean_delay_change_seconds', 'max_delay_change_seconds', 'min_delay_change_seconds',
+                             'var_delay_change_seconds',
+                             'mean_arrival_delay_seconds', 'max_arrival_delay_seconds', 'min_arrival_delay_seconds',
+                             'var_arrival_delay',
+                             'mean_departure_delay_seconds', 'max_departure_delay_seconds',
+                             'min_departure_delay_seconds', 'var_departure_delay',
+                             'mean_on_time_percent', 'mean_final_stop_delay_seconds'] + \
+                            lag_column_names(['mean_arrival_delay_seconds', 'mean_departure_delay_seconds',
+                                              'mean_delay_change_seconds']) + \
+                            ['stop_count']
+
+    final_metrics = st.drop_rows_with_not_enough_updates(final_metrics, trip_update_count_df, min_trip_updates_per_slot)
+
+    final_metrics.fillna(0,
+                         inplace=True)  # Fill NaNs with 0 - During night time (00:00-02:00), no data is generally available
+    return final_metrics
+
+
+def build_feature_group(rt_df: pd.DataFrame, route_types_map_df: pd.DataFrame,
+                        stop_count_df=pd.DataFrame(), min_trip_updates_per_slot=MIN_TRIP_UPDATES_PER_TIMESLOT,
+                        engine=FEATURE_ENGINE) -> pd.DataFrame:
+    """
+    Hourly delay metrics per route type from a day of trip updates.
+
+    Args:
+        rt_df (pd.DataFrame): Trip updates, see koda_transform.read_rt_day_to_df.
+        route_types_map_df (pd.DataFrame): trip_id to route_type map.
+        stop_count_df (pd.DataFrame): Scheduled stops per route type and hour.
+        min_trip_updates_per_slot (int): Hours with fewer trip updates are dropped.
+        engine (str): "vectorised" or "pandas", see FEATURE_ENGINE.
+
+    Returns:
+        pd.DataFrame: One row per route type and hour, the delays feature group schema.
+    """
+    rt_df = latest_trip_updates_with_route_types(rt_df, route_types_map_df)
+    if engine == VECTORISED:
+        final_metrics, trip_update_count_df = _hourly_metrics_vectorised(rt_df)
+    else:
+        final_metrics, trip_update_count_df = _hourly_metrics_pandas(rt_df)
+    return finish_feature_group(final_metrics, trip_update_count_df, stop_count_df, min_trip_updates_per_slot)
+
+
+def _hourly_metrics_pandas(rt_df: pd.DataFrame) -> (pd.DataFrame, pd.DataFrame):
+    # Set up arrival_time as our index and main datetime column
+    rt_df['arrival_time'] = pd.to_datetime(rt_df['arrival_time'], unit='s')
+
+    rt_df.sort_values(by=['arrival_time', 'key'], inplace=True)
+    rt_df.set_index('arrival_time', inplace=True)
+
     # Group by route_type and resample to get trip update counts per hour
     trip_update_count_df = rt_df.groupby('route_type').resample('h').size().reset_index()
     trip_update_count_df.sort_values(by=['route_type', 'arrival_time'], inplace=True)
@@ -102,18 +214,19 @@ def build_feature_group(rt_df: pd.DataFrame, route_types_map_df: pd.DataFrame,
 
     rt_df['on_time'] = on_time(rt_df)
     final_stop_delays_dict = final_stop_delay(rt_df)
-    rt_df['final_stop_delay'] = rt_df['trip_id'].map(final_stop_delays_dict)
+    # Mapping a categorical maps its categories, the result may itself be categorical
+    rt_df['final_stop_delay'] = rt_df['trip_id'].map(final_stop_delays_dict).astype('float64')
 
-    # Sort the DataFrame by trip_id and stop_sequence
+    # Sort the DataFrame by trip_id and stop_sequence, equal stop sequences stay in arrival time and key order
     rt_df = rt_df.sort_values(by=['trip_id', 'stop_sequence'])
     # Calculate the difference in delays between consecutive stops
-    rt_df['delay_change'] = rt_df.groupby('trip_id')['arrival_delay'].diff()
+    rt_df['delay_change'] = rt_df.groupby('trip_id', observed=True)['arrival_delay'].diff()
 
     lagged_columns = ['arrival_delay', 'departure_delay', 'delay_change']
     lagged_rt_df = windowed_lagged_features(rt_df, lagged_columns)
 
     # Re-sort the DataFrame by arrival_time
-    rt_df.sort_values(by='arrival_time', inplace=True)
+    rt_df.sort_values(by=['arrival_time', 'key'], inplace=True)
 
     # Perform rolling metrics to capture trends
     WINDOW_SIZE = '20min'
@@ -154,35 +267,153 @@ def build_feature_group(rt_df: pd.DataFrame, route_types_map_df: pd.DataFrame,
         'mean_final_stop_delay': 'mean'
     }).reset_index()
 
-    lagged_resampled_df = lagged_rt_df.groupby('route_type').resample('h', on='arrival_time').agg({
-        'arrival_delay_lag_5stops': 'mean',
-        'departure_delay_lag_5stops': 'mean',
-        'delay_change_lag_5stops': 'mean'
-    }).reset_index()
+    lagged_resampled_df = lagged_rt_df.groupby('route_type').resample('h', on='arrival_time').agg(
+        {column: 'mean' for column in lag_column_names(lagged_columns)}
+    ).reset_index()
 
     final_metrics = rolling_resampled_df.merge(lagged_resampled_df, on=['route_type', 'arrival_time'], how='inner')
+    return final_metrics, trip_update_count_df
 
-    # Merge the stop count information into the final metrics DataFrame
-    final_metrics = final_metrics.merge(stop_count_df, left_on=['route_type', 'arrival_time'],
-                                        right_on=['route_type', 'arrival_time'], how='left')
 
-    # Rename columns
-    final_metrics.columns = ['route_type', 'arrival_time_bin',
-                             'mean_delay_change_seconds', 'max_delay_change_seconds', 'min_delay_change_seconds',
-                             'var_delay_change_seconds',
-                             'mean_arrival_delay_seconds', 'max_arrival_delay_seconds', 'min_arrival_delay_seconds',
-                             'var_arrival_delay',
-                             'mean_departure_delay_seconds', 'max_departure_delay_seconds',
-                             'min_departure_delay_seconds', 'var_departure_delay',
-                             'mean_on_time_percent', 'mean_final_stop_delay_seconds',
-                             'mean_arrival_delay_seconds_lag_5stops', 'mean_departure_delay_seconds_lag_5stops', 'mean_delay_change_seconds_lag_5stops',
-                             'stop_count']
+def trip_row_values(trip_codes: np.ndarray, stop_sequences: np.ndarray, arrival_delays: np.ndarray,
+                    departure_delays: np.ndarray, time_rows: np.ndarray, lag_windows=LAG_WINDOWS) -> dict[str, np.ndarray]:
+    """
+    Per-row values that depend on the other stops of the same trip, so every trip needs all of its rows.
 
-    final_metrics = st.drop_rows_with_not_enough_updates(final_metrics, trip_update_count_df, min_trip_updates_per_slot)
+    Args:
+        trip_codes (np.ndarray): Integer code of the trip of every row.
+        stop_sequences (np.ndarray): Stop sequence of every row.
+        arrival_delays (np.ndarray): Arrival delay of every row, NaN if missing.
+        departure_delays (np.ndarray): Departure delay of every row, NaN if missing.
+        time_rows (np.ndarray): Rows ordered by arrival time and key, which orders equal stop sequences within a
+            trip and makes the last row of a trip its final stop.
+        lag_windows (list[int]): Numbers of stops of the lag windows.
 
-    final_metrics.fillna(0,
-                         inplace=True)  # Fill NaNs with 0 - During night time (00:00-02:00), no data is generally available
-    return final_metrics
+    Returns:
+        dict[str, np.ndarray]: delay_change, final_stop_delay and the lag_column_names of the delays, in row order.
+    """
+    n_rows = len(trip_codes)
+    trip_rows = time_rows[np.lexsort((stop_sequences[time_rows], trip_codes[time_rows]))]
+    trip_starts = fk.segment_starts(trip_codes[trip_rows])
+    delay_changes = np.empty(n_rows)
+    delay_changes[trip_rows] = fk.segment_diff(arrival_delays[trip_rows], trip_starts)
+
+    # Delay of the last update of each trip by arrival time
+    last_positions = np.full(trip_codes.max() + 1 if n_rows else 0, -1)
+    np.maximum.at(last_positions, trip_codes[time_rows], np.arange(n_rows))
+    values = {'delay_change': delay_changes,
+              'final_stop_delay': arrival_delays[time_rows[last_positions[trip_codes]]]}
+
+    lagged_columns = {'arrival_delay': arrival_delays, 'departure_delay': departure_delays,
+                      'delay_change': delay_changes}
+    lags = {name: fk.segment_lag_means(column[trip_rows], trip_starts, lag_windows)
+            for name, column in lagged_columns.items()}
+    for name in lag_column_names(list(lagged_columns), lag_windows):
+        values[name] = np.empty(n_rows)
+    for window in lag_windows:
+        for name in lagged_columns:
+            values[f'{name}_lag_{window}stops'][trip_rows] = lags[name][window]
+    return values
+
+
+def hourly_window_metrics(route_types: np.ndarray, times: np.ndarray, layout: np.ndarray,
+                          values: dict[str, np.ndarray], lag_windows=LAG_WINDOWS) -> (pd.DataFrame, pd.DataFrame):
+    """
+    Hourly rollups of the 20 minute trend windows per route type, with prefix sums and bincount.
+
+    Args:
+        route_types (np.ndarray): Route type of every row.
+        times (np.ndarray): Arrival time of every row in epoch seconds.
+        layout (np.ndarray): Rows ordered by route type and arrival time, rows with equal times are only part of
+            the windows of the rows after them.
+        values (dict[str, np.ndarray]): arrival_delay, departure_delay and the trip_row_values of every row.
+        lag_windows (list[int]): Numbers of stops of the lag windows.
+
+    Returns:
+        (pd.DataFrame, pd.DataFrame): The metrics of every hour from the first to the last one of each route type,
+            and their trip update counts.
+    """
+    # Hourly bins per route type, from its first to its last hour like resample('h')
+    route_starts = fk.segment_starts(route_types[layout])
+    route_ids = fk.segment_ids(route_starts)
+    hours = times[layout] // 3600
+    first_hours = hours[route_starts[:-1]]
+    n_route_bins = hours[route_starts[1:] - 1] - first_hours + 1
+    bin_offsets = np.concatenate(([0], np.cumsum(n_route_bins))).astype(np.int64)
+    n_bins = int(bin_offsets[-1])
+    bins = bin_offsets[route_ids] + hours - first_hours[route_ids]
+    bin_route_types = np.repeat(route_types[layout][route_starts[:-1]], n_route_bins)
+    bin_hours = np.concatenate([np.zeros(0, dtype=np.int64)] +
+                               [np.arange(first, first + n) for first, n in zip(first_hours, n_route_bins)])
+    bin_times = pd.to_datetime(bin_hours * 3600, unit='s')
+
+    arrival_delays = values['arrival_delay']
+    on_time_values = ((arrival_delays >= ON_TIME_MIN_SECONDS) & (arrival_delays <= ON_TIME_MAX_SECONDS)).astype(float)
+
+    metrics = {'route_type': bin_route_types, 'arrival_time': bin_times}
+    window_starts = fk.time_window_starts(times[layout], route_starts, ROLLING_WINDOW_SECONDS)
+    # The windows ending in an hour together cover the rows from the start of the first one to the end of the hour
+    bin_rows = np.searchsorted(bins, np.arange(n_bins + 1))
+    bin_ranges = [(window_starts[a] if b > a else a, b) for a, b in zip(bin_rows[:-1], bin_rows[1:])]
+    for name in ['delay_change', 'arrival_delay', 'departure_delay']:
+        means, variances = fk.window_mean_var(values[name][layout], window_starts)
+        maxima, minima = fk.range_extrema(values[name][layout], bin_ranges)
+        metrics[f'mean_{name}'] = fk.bin_mean(means, bins, n_bins)
+        metrics[f'max_{name}'] = maxima
+        metrics[f'min_{name}'] = minima
+        metrics[f'var_{name}'] = fk.bin_mean(variances, bins, n_bins)
+    on_time_means, _ = fk.window_mean_var(on_time_values[layout], window_starts)
+    metrics['mean_on_time'] = fk.bin_mean(on_time_means * 100, bins, n_bins)
+    final_stop_delay_means, _ = fk.window_mean_var(values['final_stop_delay'][layout], window_starts)
+    metrics['mean_final_stop_delay'] = fk.bin_mean(final_stop_delay_means, bins, n_bins)
+
+    for name in lag_column_names(['arrival_delay', 'departure_delay', 'delay_change'], lag_windows):
+        metrics[name] = fk.bin_mean(values[name][layout], bins, n_bins)
+
+    trip_update_count_df = pd.DataFrame({'route_type': bin_route_types, 'arrival_time_bin': bin_times,
+                                         'trip_update_count': np.bincount(bins, minlength=n_bins)})
+    return pd.DataFrame(metrics), trip_update_count_df
+
+
+def _hourly_metrics_vectorised(rt_df: pd.DataFrame) -> (pd.DataFrame, pd.DataFrame):
+    """
+    The metrics of _hourly_metrics_pandas with NumPy kernels instead of groupby/rolling/resample.
+
+    Columns are read once into arrays and gathered into one layout sorted by route type and arrival time, where
+    the 20 minute windows come from prefix sums and window start offsets and the hourly rollups from bincount.
+    Per-trip values (delay changes, lag windows) are computed on trip segments reached through an index
+    permutation. Like in the pandas engine, rows with equal arrival times are ordered by their key.
+    """
+    if isinstance(rt_df['trip_id'].dtype, pd.CategoricalDtype):
+        trip_codes = rt_df['trip_id'].cat.codes.to_numpy(np.int64)
+    else:
+        trip_codes = pd.factorize(rt_df['trip_id'], sort=True)[0].astype(np.int64)
+    route_types = rt_df['route_type'].to_numpy(np.int64)
+    times = rt_df['arrival_time'].to_numpy(np.int64)
+    stop_sequences = rt_df['stop_sequence'].to_numpy(np.float64, na_value=np.nan)
+    arrival_delays = rt_df['arrival_delay'].to_numpy(np.float64, na_value=np.nan)
+    departure_delays = rt_df['departure_delay'].to_numpy(np.float64, na_value=np.nan)
+    keys = rt_df['key'].to_numpy()
+
+    time_rows = np.lexsort((keys, times))
+    values = trip_row_values(trip_codes, stop_sequences, arrival_delays, departure_delays, time_rows)
+    values['arrival_delay'] = arrival_delays
+    values['departure_delay'] = departure_delays
+
+    layout = np.lexsort((keys, times, route_types))
+    return hourly_window_metrics(route_types, times, layout, values)
+
+
+def delays_feature_group_name(operator: OperatorsWithRT) -> str:
+    """
+    Name of the delay feature group of an operator.
+
+    Delay features are partitioned by operator into feature groups with the same schema, so existing feature views
+    stay per operator. X-Trafik keeps the original 'delays' group the models are trained on.
+    """
+    if operator == OperatorsWithRT.X_TRAFIK:
+        return 'delays'
+    return f'delays_{operator.value}'
 
 
 def delays_update_feature_descriptions(delays_fg: FeatureGroup) -> None:
@@ -208,9 +439,13 @@ def delays_update_feature_descriptions(delays_fg: FeatureGroup) -> None:
     delays_fg.update_feature_description("mean_on_time_percent", "Percentage of stops on time (-3 to 5 minutes)")
     delays_fg.update_feature_description("mean_final_stop_delay_seconds",
                                          "Average delay at the final stop of each trip")
-    delays_fg.update_feature_description("mean_arrival_delay_seconds_lag_5stops", "Mean arrival delay lagged (windowed) 5 stops")
-    delays_fg.update_feature_description("mean_departure_delay_seconds_lag_5stops", "Mean departure delay lagged 5 (windowed) stops")
-    delays_fg.update_feature_description("mean_delay_change_seconds_lag_5stops", "Mean delay change lagged 5 (windowed) stops")
+    for window in LAG_WINDOWS:
+        delays_fg.update_feature_description(f"mean_arrival_delay_seconds_lag_{window}stops",
+                                             f"Mean arrival delay lagged (windowed) {window} stops")
+        delays_fg.update_feature_description(f"mean_departure_delay_seconds_lag_{window}stops",
+                                             f"Mean departure delay lagged {window} (windowed) stops")
+        delays_fg.update_feature_description(f"mean_delay_change_seconds_lag_{window}stops",
+                                             f"Mean delay change lagged {window} (windowed) stops")
     delays_fg.update_feature_description("stop_count", "Number of scheduled stops in the hour")
     delays_fg.update_feature_description("trip_update_count", "Number of received trip updates in the hour")
 
@@ -0,0 +1,261 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+import shared.features as sf
+import shared.storage as ss
+from shared.constants import OperatorsWithRT
+
+# The live pipelines keep the delay features of the current day up to date incrementally. Between runs they
+# persist, per operator and date:
+# - rows.feather: the latest update of every trip and stop seen so far, with the values it gets from the rest of
+#   its trip (delay change, final stop delay, lag windows)
+# - bins.feather: the hourly metrics and trip update counts per route type
+# A run only recomputes the trips with new or changed stop updates and the hours whose 20 minute windows contain
+# one of their rows, instead of running build_feature_group over everything.
+LIVE_STATE_DIR = os.environ.get("LIVE_STATE_DIR", "./dev_data/gtfsr_data/live_state")
+
+# An update that changes none of these leaves every feature as it was
+_FEATURE_COLUMNS = ['route_type', 'stop_sequence', 'arrival_time', 'arrival_delay', 'departure_delay']
+# The state only holds numbers: 'key' is the sf.stop_update_keys hash of trip_id and stop_id and 'trip_key' one of
+# trip_id, so updates are matched and trips found without comparing strings. The key also orders rows with equal
+# arrival times, like it does in build_feature_group.
+_ROW_DTYPES = {'key': np.uint64, 'trip_key': np.uint64, 'timestamp': np.int64, 'route_type': np.int64,
+               'stop_sequence': np.float64, 'arrival_time': np.int64, 'arrival_delay': np.float64,
+               'departure_delay': np.float64}
+
+
+def get_state_dir_path(operator: str, date: str, state_dir=LIVE_STATE_DIR) -> str:
+    return f"{state_dir}/{operator}_{date}"
+
+
+def _trip_value_columns() -> list:
+    return ['delay_change', 'final_stop_delay'] + \
+        sf.lag_column_names(['arrival_delay', 'departure_delay', 'delay_change'])
+
+
+def _row_columns() -> list:
+    return list(_ROW_DTYPES) + _trip_value_columns()
+
+
+def _empty_rows() -> pd.DataFrame:
+    return pd.DataFrame({k: pd.Series(dtype=_ROW_DTYPES.get(k, np.float64)) for k in _row_columns()})
+
+
+def _to_rows(rt_df: pd.DataFrame, route_types_map_df: pd.DataFrame) -> pd.DataFrame:
+    """Latest update per trip and stop of a snapshot, in the row schema of the state."""
+    rt_df = sf.latest_trip_updates_with_route_types(rt_df, route_types_map_df)
+    rows = pd.DataFrame({
+        'key': rt_df['key'].to_numpy(np.uint64),
+        'trip_key': pd.util.hash_pandas_object(rt_df['trip_id'].astype(str), index=False).to_numpy(),
+        'timestamp': rt_df['timestamp'].to_numpy(np.int64),
+        'route_type': rt_df['route_type'].to_numpy(np.int64),
+        'stop_sequence': rt_df['stop_sequence'].to_numpy(np.float64, na_value=np.nan),
+        'arrival_time': rt_df['arrival_time'].to_numpy(np.int64),
+        'arrival_delay': rt_df['arrival_delay'].to_numpy(np.float64, na_value=np.nan),
+        'departure_delay': rt_df['departure_delay'].to_numpy(np.float64, na_value=np.nan),
+    })
+    # A trip_id can map to several route types, keep one row per stop update like the state does
+    return rows.drop_duplicates(subset='key', keep='last')
+
+
+def _read_state(operator: str, date: str, state_dir: str) -> (pd.DataFrame, pd.DataFrame):
+    state_dir_path = get_state_dir_path(operator, date, state_dir)
+    rows_path = f"{state_dir_path}/rows.feather"
+    bins_path = f"{state_dir_path}/bins.feather"
+    if os.path.exists(rows_path) and os.path.exists(bins_path):
+        rows = ss.read_feather(rows_path)
+        bins = ss.read_feather(bins_path)
+        if list(rows.columns) == _row_columns():
+            return rows, bins
+        # Written with other LAG_WINDOWS, the trip values have to be computed again
+        print(f"Live feature state in {state_dir_path} has other columns, starting over")
+    return _empty_rows(), None
+
+
+def _write_state(operator: str, date: str, rows: pd.DataFrame, bins: pd.DataFrame, state_dir: str) -> None:
+    state_dir_path = get_state_dir_path(operator, date, state_dir)
+    if not os.path.exists(state_dir_path):
+        os.makedirs(state_dir_path)
+        # The state of previous days is not needed anymore
+        for name in os.listdir(state_dir):
+            if name.startswith(f"{operator}_") and name != os.path.basename(state_dir_path):
+                shutil.rmtree(os.path.join(state_dir, name))
+    # Bins first: if the run stops in between, the next one sees the old rows and recomputes the same hours again
+    ss.write_feather(bins.reset_index(drop=True), f"{state_dir_path}/bins.feather")
+    ss.write_feather(rows.reset_index(drop=True), f"{state_dir_path}/rows.feather")
+
+
+class LiveState:
+    """
+    Rows and hourly bins of an operator and date after update_live_features, not persisted until written.
+
+    Callers that upload the updated features write the state only once the upload succeeded, so a failed or
+    skipped upload leaves the hours to be recomputed and uploaded by the next run.
+    """
+
+    def __init__(self, operator: str, date: str, rows: pd.DataFrame, bins: pd.DataFrame, state_dir: str):
+        self.operator = operator
+        self.date = date
+        self.rows = rows
+        self.bins = bins
+        self.state_dir = state_dir
+
+    def write(self) -> None:
+        if self.bins is not None:
+            _write_state(self.operator, self.date, self.rows, self.bins, self.state_dir)
+
+
+def _differs(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return ~((a == b) | (pd.isna(a) & pd.isna(b)))
+
+
+def _apply_updates(rows: pd.DataFrame, updates: pd.DataFrame) -> (pd.DataFrame, np.ndarray):
+    """
+    Add the newer stop updates of a snapshot to the state rows. Updates that only have a newer timestamp are
+    skipped, the row and the trip values it has are still current.
+
+    Returns:
+        (pd.DataFrame, np.ndarray): The new state rows and the trip keys of updates that changed a feature column.
+    """
+    positions = pd.Index(rows['key']).get_indexer(updates['key'])
+    added = positions < 0
+    current = rows.iloc[np.where(added, 0, positions)] if len(rows) else updates
+    # Older snapshots (e.g. from a lagging feed mirror) never overwrite newer updates
+    newer = added | (updates['timestamp'].to_numpy() > current['timestamp'].to_numpy())
+    changed = added.copy()
+    for k in _FEATURE_COLUMNS:
+        changed |= newer & _differs(updates[k].to_numpy(), current[k].to_numpy())
+
+    if not changed.any():
+        return rows, np.array([], dtype=np.uint64)
+    # Also copies the rows, read-only if they were memory-mapped from the state file
+    rows = pd.concat([rows, updates[added]], ignore_index=True)
+    replaced = changed & ~added
+    # The trip values of replaced rows are stale until their trips are computed again
+    for k in _ROW_DTYPES:
+        rows.loc[positions[replaced], k] = updates[k].to_numpy()[replaced]
+    return rows, np.unique(updates['trip_key'].to_numpy()[changed])
+
+
+def _update_trip_values(rows: pd.DataFrame, trip_mask: np.ndarray) -> None:
+    """Compute the trip values of the rows in trip_mask, which must hold all rows of their trips."""
+    trip_rows = rows[trip_mask]
+    trip_codes = pd.factorize(trip_rows['trip_key'])[0].astype(np.int64)
+    stop_sequences = trip_rows['stop_sequence'].to_numpy()
+    time_rows = np.lexsort((trip_rows['key'].to_numpy(), trip_rows['arrival_time'].to_numpy()))
+    values = sf.trip_row_values(trip_codes, stop_sequences, trip_rows['arrival_delay'].to_numpy(),
+                                trip_rows['departure_delay'].to_numpy(), time_rows)
+    for k in _trip_value_columns():
+        rows.loc[trip_mask, k] = values[k]
+
+
+def _bin_ids(route_types: np.ndarray, times: np.ndarray) -> np.ndarray:
+    """One integer per route type and hour of the epoch second times."""
+    return route_types.astype(np.int64) * 2 ** 32 + times // 3600
+
+
+def _metric_bin_ids(bins: pd.DataFrame) -> np.ndarray:
+    return _bin_ids(bins['route_type'].to_numpy(), bins['arrival_time'].to_numpy('datetime64[s]').astype(np.int64))
+
+
+def _affected_bins(rows: pd.DataFrame) -> np.ndarray:
+    """Hours whose metrics depend on the given rows: their own, and the next one for the rows in its windows."""
+    route_types = rows['route_type'].to_numpy()
+    times = rows['arrival_time'].to_numpy()
+    spills = times % 3600 > 3600 - sf.ROLLING_WINDOW_SECONDS
+    return np.union1d(_bin_ids(route_types, times), _bin_ids(route_types[spills], times[spills] + 3600))
+
+
+def _recompute_bins(rows: pd.DataFrame, bins: np.ndarray) -> pd.DataFrame:
+    """Metrics and trip update counts of the given hours, from their rows and the windows reaching into them."""
+    route_types = rows['route_type'].to_numpy()
+    times = rows['arrival_time'].to_numpy()
+    needed = np.isin(_bin_ids(route_types, times), bins) | \
+        np.isin(_bin_ids(route_types, times + sf.ROLLING_WINDOW_SECONDS), bins)
+    window_rows = rows[needed]
+
+    route_types = window_rows['route_type'].to_numpy()
+    times = window_rows['arrival_time'].to_numpy()
+    layout = np.lexsort((window_rows['key'].to_numpy(), times, route_types))
+    values = {k: window_rows[k].to_numpy() for k in ['arrival_delay', 'departure_delay'] + _trip_value_columns()}
+    metrics, trip_update_count_df = sf.hourly_window_metrics(route_types, times, layout, values)
+
+    metrics['trip_update_count'] = trip_update_count_df['trip_update_count'].to_numpy()
+    # Only the requested hours are complete, the others were just part of the windows
+    return metrics[np.isin(_metric_bin_ids(metrics), bins) & (metrics['trip_update_count'] > 0).to_numpy()]
+
+
+def _finish(bins: pd.DataFrame, stop_count_df: pd.DataFrame, min_trip_updates_per_slot: int) -> pd.DataFrame:
+    if bins.empty:
+        return pd.DataFrame()
+    trip_update_count_df = bins[['route_type', 'arrival_time', 'trip_update_count']].rename(
+        columns={'arrival_time': 'arrival_time_bin'})
+    return sf.finish_feature_group(bins.drop(columns=['trip_update_count']), trip_update_count_df,
+                                   stop_count_df.copy(), min_trip_updates_per_slot)
+
+
+def update_live_features(operator: OperatorsWithRT, date: str, rt_df: pd.DataFrame,
+                         route_types_map_df: pd.DataFrame, stop_count_df: pd.DataFrame,
+                         min_trip_updates_per_slot=sf.MIN_TRIP_UPDATES_PER_TIMESLOT,
+                         state_dir=LIVE_STATE_DIR) -> (pd.DataFrame, pd.DataFrame, LiveState):
+    """
+    Add a realtime snapshot to the persisted live feature state of the date and return the updated features.
+
+    The new state is returned, not written: the next call only sees this snapshot once the returned state was
+    written, see LiveState.
+
+    Only the trips with new or changed stop updates get their trip values computed again, and only the hours
+    containing their rows (before or after the update) or windows reaching them are recomputed. Trips that left
+    the feed keep counting for the day. Rows with equal arrival times are ordered by their key like in
+    build_feature_group, so the features are those of a full run over the same updates.
+
+    Args:
+        operator (OperatorsWithRT): Operator of the snapshot.
+        date (str): Date of the snapshot (YYYY-MM-DD), a new date starts from an empty state.
+        rt_df (pd.DataFrame): Trip updates of the snapshot, see gtfs_regional.pipeline.get_gtfr_data_for_day.
+        route_types_map_df (pd.DataFrame): trip_id to route_type map.
+        stop_count_df (pd.DataFrame): Scheduled stops per route type and hour.
+        min_trip_updates_per_slot (int): Hours with fewer trip updates are dropped.
+        state_dir (str): Root of the persisted states.
+
+    Returns:
+        (pd.DataFrame, pd.DataFrame, LiveState): The features of all hours of the date like build_feature_group,
+            only those of the hours this snapshot changed, e.g. to upsert into the feature group, and the new state.
+    """
+    rows, bins = _read_state(operator.value, date, state_dir)
+    old_rows = rows
+    rows, changed_trips = _apply_updates(rows, _to_rows(rt_df, route_types_map_df.copy()))
+    if rows.empty:
+        print(f"No trip updates with route types for {operator.value} on {date}")
+        return pd.DataFrame(), pd.DataFrame(), LiveState(operator.value, date, rows, bins, state_dir)
+
+    if bins is None or len(changed_trips) > 0:
+        if bins is None:
+            trip_mask = np.ones(len(rows), dtype=bool)
+            affected_bins = _affected_bins(rows)
+        else:
+            trip_mask = np.isin(rows['trip_key'].to_numpy(), changed_trips)
+            # A moved arrival time also changes the hour the row was in before
+            affected_bins = np.union1d(_affected_bins(rows[trip_mask]), _affected_bins(
+                old_rows[np.isin(old_rows['trip_key'].to_numpy(), changed_trips)]))
+        _update_trip_values(rows, trip_mask)
+        updated_bins = _recompute_bins(rows, affected_bins)
+
+        if bins is None:
+            bins = updated_bins
+        else:
+            kept = ~np.isin(_metric_bin_ids(bins), affected_bins)
+            bins = pd.concat([bins[kept], updated_bins], ignore_index=True)
+        bins = bins.sort_values(by=['route_type', 'arrival_time']).reset_index(drop=True)
+        print(f"Live features of {operator.value} on {date}: {len(changed_trips)} changed trips, "
+              f"{len(updated_bins)} of {len(bins)} hours recomputed")
+    else:
+        updated_bins = bins.iloc[:0]
+        print(f"Live features of {operator.value} on {date}: no changed trip updates")
+
+    return (_finish(bins, stop_count_df, min_trip_updates_per_slot),
+            _finish(updated_bins, stop_count_df, min_trip_updates_per_slot),
+            LiveState(operator.value, date, rows, bins, state_dir))
@@ -1,3 +1,5 @@
+import hashlib
+import itertools
 import json
 import os
 import warnings
@@ -6,11 +8,77 @@ import zipfile
 import numpy as np
 import pandas as pd
 import py7zr
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import csv as pa_csv
 from google.protobuf import json_format
 
-from protobuf_defs.gtfs_realtime_pb2 import FeedMessage
+from protobuf_defs.gtfs_realtime_pb2 import FeedMessage, TripDescriptor, TripUpdate
 from shared.constants import OperatorsWithRT, StaticDataTypes
 
+# Columns emitted by decode_trip_updates, named as koda_transform.normalize_keys would name them
+TRIP_UPDATE_STRING_COLUMNS = [
+    'id', 'trip_id', 'route_id', 'start_time', 'start_date', 'schedule_relationship', 'vehicle_id',
+    'tripUpdate_vehicle_label', 'tripUpdate_vehicle_licensePlate', 'stop_id',
+    'tripUpdate_stopTimeUpdate_scheduleRelationship'
+]
+# Integer fields become float64 (NaN for missing) only when some values are unset, as with json_normalize
+TRIP_UPDATE_NUMERIC_COLUMNS = [
+    'direction_id', 'timestamp', 'tripUpdate_delay', 'stop_sequence', 'arrival_delay', 'arrival_time',
+    'arrival_uncertainty', 'departure_delay', 'departure_time', 'departure_uncertainty'
+]
+
+# Compact schema every stage from parsing to the features keeps: ids repeat across snapshots, so they are
+# categoricals (dictionary encoded in Arrow/Feather) with one set of categories per day, delays and sequence
+# numbers fit int32 and epoch times int64. Integers are nullable as updates leave fields unset.
+TRIP_UPDATE_CATEGORY_COLUMNS = [k for k in TRIP_UPDATE_STRING_COLUMNS if k != 'id']
+TRIP_UPDATE_INT32_COLUMNS = [
+    'direction_id', 'tripUpdate_delay', 'stop_sequence', 'arrival_delay', 'arrival_uncertainty', 'departure_delay',
+    'departure_uncertainty'
+]
+TRIP_UPDATE_INT64_COLUMNS = ['timestamp', 'arrival_time', 'departure_time']
+# Keeps nullable integers as such when converting Arrow tables, instead of falling back to float64
+COMPACT_TYPES_MAPPER = {pa.int32(): pd.Int32Dtype(), pa.int64(): pd.Int64Dtype()}.get
+
+
+_CATEGORY = pa.dictionary(pa.int32(), pa.string())
+# GTFS times (HH:MM:SS, hours may exceed 23) are read as strings and converted to seconds after midnight
+GTFS_TIME = "gtfs_time"
+
+# Projected columns and types per static table, ids with many repeats are read as categoricals
+STATIC_DATA_SCHEMAS = {
+    StaticDataTypes.CALENDAR_DATES: {
+        'service_id': _CATEGORY, 'date': pa.string(), 'exception_type': pa.int8()
+    },
+    StaticDataTypes.FEED_INFO: {
+        'feed_publisher_name': pa.string(), 'feed_version': pa.string(), 'feed_start_date': pa.string(),
+        'feed_end_date': pa.string()
+    },
+    StaticDataTypes.ROUTES: {
+        # Kept as int64, route_type ends up in the delays feature group schema
+        'route_id': pa.string(), 'route_type': pa.int64()
+    },
+    StaticDataTypes.STOP_TIMES: {
+        'trip_id': _CATEGORY, 'arrival_time': GTFS_TIME, 'departure_time': GTFS_TIME, 'stop_id': _CATEGORY,
+        'stop_sequence': pa.int32()
+    },
+    StaticDataTypes.STOPS: {
+        'stop_id': pa.string(), 'stop_name': pa.string(), 'stop_lat': pa.float64(), 'stop_lon': pa.float64()
+    },
+    StaticDataTypes.TRIPS: {
+        'route_id': _CATEGORY, 'service_id': _CATEGORY, 'trip_id': pa.string()
+    },
+}
+
+
+def _enum_names(enum_descriptor) -> dict:
+    return {value.number: value.name for value in enum_descriptor.values}
+
+
+_TRIP_SCHEDULE_RELATIONSHIPS = _enum_names(TripDescriptor.DESCRIPTOR.enum_types_by_name['ScheduleRelationship'])
+_STOP_SCHEDULE_RELATIONSHIPS = _enum_names(
+    TripUpdate.StopTimeUpdate.DESCRIPTOR.enum_types_by_name['ScheduleRelationship'])
+
 
 def get_static_file_path(operator: str, date: str, static_data_type: str, data_dir: str):
     dir_path = get_static_dir_path(operator, date, data_dir)
@@ -48,6 +116,26 @@ def is_json(series: pd.Series) -> bool:
         return False
 
 
+def explode_records(series: pd.Series) -> (np.ndarray, pd.DataFrame):
+    """
+    Flatten a column of nested record lists in bulk.
+
+    All records are chained into one list and normalised with a single json_normalize call, instead of one
+    call per row. The returned lengths are the offsets needed to repeat the parent rows with np.repeat.
+
+    Args:
+        series (pd.Series): Column where each value is a list of dicts (a single dict counts as one record).
+
+    Returns:
+        (np.ndarray, pd.DataFrame): Number of records per row and the flattened records.
+    """
+    values = series.to_numpy()
+    lists = [[v] if isinstance(v, dict) else v if isinstance(v, list) else [] for v in values]
+    lengths = np.fromiter((len(v) for v in lists), dtype=np.int64, count=len(lists))
+    records = list(itertools.chain.from_iterable(lists))
+    return lengths, pd.json_normalize(records)
+
+
 def unpack_jsons(df: pd.DataFrame) -> pd.DataFrame:
     keys_to_sanitise = []
     for k in list(df.keys()):
@@ -56,24 +144,19 @@ def unpack_jsons(df: pd.DataFrame) -> pd.DataFrame:
             keys_to_sanitise.append(k)
 
     if keys_to_sanitise:
-        indexes = []
-        unpacked = {k: [] for k in keys_to_sanitise}
-        for ix in df.index:
-            for k in keys_to_sanitise:
-                this_unpack = pd.json_normalize(df[k][ix])
-                unpacked[k].append(this_unpack)
-                indexes.extend(ix for _ in range(len(this_unpack)))
-
-        df.drop(keys_to_sanitise, axis='columns', inplace=True)
-
+        # Number of output rows contributed by each input row, summed over all unpacked columns
+        repeats = np.zeros(len(df), dtype=np.int64)
         unpacked_series = []
         for k in keys_to_sanitise:
-            this_df = pd.concat(unpacked[k], axis='index').reset_index(drop=True)
+            lengths, this_df = explode_records(df[k])
+            repeats += lengths
             this_df.rename(columns={curr_name: '_'.join((k, curr_name)) for curr_name in this_df.keys()},
                            inplace=True)
             unpacked_series.append(this_df)
 
-        repeated = df.iloc[indexes].reset_index(drop=True)
+        df.drop(keys_to_sanitise, axis='columns', inplace=True)
+
+        repeated = df.iloc[np.repeat(np.arange(len(df)), repeats)].reset_index(drop=True)
         df = pd.concat([repeated] + unpacked_series, axis='columns')
 
     for k in df.keys():
@@ -87,10 +170,58 @@ def read_static_data_to_dataframe(operator: OperatorsWithRT, static_data_type: S
     return pd.read_csv(file_path, sep=",")
 
 
+def gtfs_time_to_seconds(times: pa.ChunkedArray) -> pa.ChunkedArray:
+    """Convert GTFS HH:MM:SS strings to int32 seconds after midnight, keeping nulls."""
+    parts = pc.split_pattern(pc.utf8_trim_whitespace(times), ':')
+    hours = pc.cast(pc.list_element(parts, 0), pa.int32())
+    minutes = pc.cast(pc.list_element(parts, 1), pa.int32())
+    seconds = pc.cast(pc.list_element(parts, 2), pa.int32())
+    total = pc.add(pc.add(pc.multiply(hours, 3600), pc.multiply(minutes, 60)), seconds)
+    return pc.cast(total, pa.int32())
+
+
+def read_typed_static_data_to_dataframe(operator: OperatorsWithRT, static_data_type: StaticDataTypes, date: str,
+                                        data_dir: str) -> pd.DataFrame:
+    """
+    Read a static GTFS table with the pyarrow CSV parser, using the projection and types in STATIC_DATA_SCHEMAS.
+
+    Only the schema columns are parsed, ids are kept as strings (or categoricals) exactly as written in the
+    file, and GTFS times are converted to nullable integer seconds after midnight. Columns missing from the
+    file are returned as nulls. Tables without a schema fall back to read_static_data_to_dataframe.
+
+    Args:
+        operator (OperatorsWithRT): Operator of the static feed.
+        static_data_type (StaticDataTypes): Table to read.
+        date (str): Date of the static feed (YYYY-MM-DD).
+        data_dir (str): Directory the static archive was unzipped to.
+
+    Returns:
+        pd.DataFrame: The projected table.
+    """
+    schema = STATIC_DATA_SCHEMAS.get(static_data_type)
+    if schema is None:
+        return read_static_data_to_dataframe(operator, static_data_type, date, data_dir)
+
+    file_path = get_static_file_path(operator.value, date, static_data_type.value, data_dir=data_dir)
+    time_columns = [k for k, v in schema.items() if v == GTFS_TIME]
+    column_types = {k: pa.string() if k in time_columns else v for k, v in schema.items()}
+    convert_options = pa_csv.ConvertOptions(column_types=column_types, include_columns=list(schema.keys()),
+                                            include_missing_columns=True, strings_can_be_null=True)
+    table = pa_csv.read_csv(file_path, convert_options=convert_options)
+
+    for k in time_columns:
+        table = table.set_column(table.schema.get_field_index(k), k, gtfs_time_to_seconds(table[k]))
+    return table.to_pandas(types_mapper={pa.int8(): pd.Int8Dtype(), pa.int32(): pd.Int32Dtype()}.get)
+
+
 def read_pb_to_dataframe(file_path: str) -> pd.DataFrame:
     with open(file_path, 'rb') as file:
-        proto_message = FeedMessage()
-        proto_message.ParseFromString(file.read())
+        return pb_bytes_to_dataframe(file.read())
+
+
+def pb_bytes_to_dataframe(content: bytes) -> pd.DataFrame:
+    proto_message = FeedMessage()
+    proto_message.ParseFromString(content)
 
     msg_json = json_format.MessageToJson(proto_message)
     msg_dict = json.loads(msg_json)
@@ -101,6 +232,243 @@ def read_pb_to_dataframe(file_path: str) -> pd.DataFrame:
     return df
 
 
+def trip_update_fingerprint(trip_update: TripUpdate) -> bytes:
+    """Digest of a TripUpdate (trip, vehicle and stop time updates) that ignores its timestamp."""
+    # Serialising without the timestamp is far cheaper than hashing the stop time updates one by one
+    if trip_update.HasField('timestamp'):
+        timestamp = trip_update.timestamp
+        trip_update.ClearField('timestamp')
+        content = trip_update.SerializeToString()
+        trip_update.timestamp = timestamp
+    else:
+        content = trip_update.SerializeToString()
+    return hashlib.blake2b(content, digest_size=16).digest()
+
+
+def decode_trip_updates(proto_message: FeedMessage, fingerprints: dict = None) -> dict:
+    """
+    Walk the TripUpdate entities of a FeedMessage directly into column lists, one row per stop time update.
+
+    Produces the same rows and (normalised) columns as read_pb_to_dataframe followed by
+    koda_transform.normalize_keys, without the JSON round trip. Enums are emitted by name and
+    unset optional fields as None, so all-empty columns are dropped by sanitise_array as before.
+
+    When decoding consecutive snapshots, pass the same fingerprints dict to each call to only emit the
+    trips whose content changed since they were last seen. Unchanged trips keep the rows (and timestamp)
+    of the snapshot they were first seen in, so the stored timestamps can be earlier than without fingerprints.
+
+    Args:
+        proto_message (FeedMessage): Parsed GTFS-RT TripUpdates feed message.
+        fingerprints (dict, optional): (trip_id, start_date) to trip_update_fingerprint of the last emitted
+            version, updated in place. Defaults to None, emitting every trip.
+
+    Returns:
+        dict: Column name to list of values.
+    """
+    columns = {k: [] for k in TRIP_UPDATE_STRING_COLUMNS + TRIP_UPDATE_NUMERIC_COLUMNS}
+    # Bind the per-stop lists once, the inner loop runs for every stop time update of the snapshot
+    stop_sequence = columns['stop_sequence']
+    stop_id = columns['stop_id']
+    stop_schedule_relationship = columns['tripUpdate_stopTimeUpdate_scheduleRelationship']
+    arrival_delay = columns['arrival_delay']
+    arrival_time = columns['arrival_time']
+    arrival_uncertainty = columns['arrival_uncertainty']
+    departure_delay = columns['departure_delay']
+    departure_time = columns['departure_time']
+    departure_uncertainty = columns['departure_uncertainty']
+
+    for entity in proto_message.entity:
+        if not entity.HasField('trip_update'):
+            continue
+        trip_update = entity.trip_update
+        stop_time_updates = trip_update.stop_time_update
+        n_updates = len(stop_time_updates)
+        if n_updates == 0:
+            continue
+
+        trip = trip_update.trip
+        if fingerprints is not None:
+            key = (trip.trip_id, trip.start_date) if trip.HasField('trip_id') else entity.id
+            fingerprint = trip_update_fingerprint(trip_update)
+            if fingerprints.get(key) == fingerprint:
+                continue
+            fingerprints[key] = fingerprint
+
+        vehicle = trip_update.vehicle
+        entity_values = {
+            'id': entity.id,
+            'trip_id': trip.trip_id if trip.HasField('trip_id') else None,
+            'route_id': trip.route_id if trip.HasField('route_id') else None,
+            'direction_id': trip.direction_id if trip.HasField('direction_id') else None,
+            'start_time': trip.start_time if trip.HasField('start_time') else None,
+            'start_date': trip.start_date if trip.HasField('start_date') else None,
+            'schedule_relationship': _TRIP_SCHEDULE_RELATIONSHIPS[trip.schedule_relationship]
+            if trip.HasField('schedule_relationship') else None,
+            'timestamp': trip_update.timestamp if trip_update.HasField('timestamp') else None,
+            'tripUpdate_delay': trip_update.delay if trip_update.HasField('delay') else None,
+            'vehicle_id': vehicle.id if vehicle.HasField('id') else None,
+            'tripUpdate_vehicle_label': vehicle.label if vehicle.HasField('label') else None,
+            'tripUpdate_vehicle_licensePlate': vehicle.license_plate if vehicle.HasField('license_plate') else None,
+        }
+        for k, v in entity_values.items():
+            columns[k].extend([v] * n_updates)
+
+        for update in stop_time_updates:
+            stop_sequence.append(update.stop_sequence if update.HasField('stop_sequence') else None)
+            stop_id.append(update.stop_id if update.HasField('stop_id') else None)
+            stop_schedule_relationship.append(_STOP_SCHEDULE_RELATIONSHIPS[update.schedule_relationship]
+                                              if update.HasField('schedule_relationship') else None)
+            if update.HasField('arrival'):
+                arrival = update.arrival
+                arrival_delay.append(arrival.delay if arrival.HasField('delay') else None)
+                arrival_time.append(arrival.time if arrival.HasField('time') else None)
+                arrival_uncertainty.append(arrival.uncertainty if arrival.HasField('uncertainty') else None)
+            else:
+                arrival_delay.append(None)
+                arrival_time.append(None)
+                arrival_uncertainty.append(None)
+            if update.HasField('departure'):
+                departure = update.departure
+                departure_delay.append(departure.delay if departure.HasField('delay') else None)
+                departure_time.append(departure.time if departure.HasField('time') else None)
+                departure_uncertainty.append(departure.uncertainty if departure.HasField('uncertainty') else None)
+            else:
+                departure_delay.append(None)
+                departure_time.append(None)
+                departure_uncertainty.append(None)
+    return columns
+
+
+def trip_update_columns_to_dataframe(columns: dict) -> pd.DataFrame:
+    data = {}
+    for k in TRIP_UPDATE_STRING_COLUMNS:
+        data[k] = np.array(columns[k], dtype=object)
+    for k in TRIP_UPDATE_NUMERIC_COLUMNS:
+        values = np.array(columns[k], dtype=np.float64)
+        # Like json_normalize, only fall back to float when some values are missing
+        if not np.isnan(values).any():
+            values = values.astype(np.int64)
+        data[k] = values
+    return pd.DataFrame(data)
+
+
+def read_trip_updates_pb_to_dataframe(file_path: str, fingerprints: dict = None) -> pd.DataFrame:
+    """Fast path of read_pb_to_dataframe for TripUpdates feeds, see decode_trip_updates."""
+    with open(file_path, 'rb') as file:
+        return trip_updates_pb_bytes_to_dataframe(file.read(), fingerprints)
+
+
+def trip_updates_pb_bytes_to_dataframe(content: bytes, fingerprints: dict = None) -> pd.DataFrame:
+    proto_message = FeedMessage()
+    proto_message.ParseFromString(content)
+    return trip_update_columns_to_dataframe(decode_trip_updates(proto_message, fingerprints))
+
+
+def compact_trip_updates(df: pd.DataFrame) -> pd.DataFrame:
+    """Cast trip updates to the compact schema, columns that already have it are left as they are."""
+    castings = {}
+    for k in df.keys():
+        if k in TRIP_UPDATE_CATEGORY_COLUMNS and not isinstance(df[k].dtype, pd.CategoricalDtype):
+            castings[k] = 'category'
+        elif k in TRIP_UPDATE_INT32_COLUMNS and df[k].dtype != pd.Int32Dtype():
+            castings[k] = pd.Int32Dtype()
+        elif k in TRIP_UPDATE_INT64_COLUMNS and df[k].dtype not in (pd.Int64Dtype(), np.int64):
+            castings[k] = pd.Int64Dtype()
+    return df.astype(castings) if castings else df
+
+
+def concat_trip_updates(frames: list[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Concatenate compact trip update frames, e.g. the hours of a day, into one frame with shared categories.
+
+    pd.concat only keeps categoricals whose categories are identical and falls back to object strings
+    otherwise, so the categories are unified first. Only the (small) categories are merged, the codes of
+    each frame are remapped without materialising the ids.
+    """
+    frames = [compact_trip_updates(df) for df in frames]
+    for k in TRIP_UPDATE_CATEGORY_COLUMNS:
+        columns = [df[k] for df in frames if k in df.keys()]
+        if not columns:
+            continue
+        categories = columns[0].cat.categories
+        for column in columns[1:]:
+            categories = categories.union(column.cat.categories, sort=False)
+        dtype = pd.CategoricalDtype(categories)
+        frames = [df.astype({k: dtype}) if k in df.keys()
+                  else df.assign(**{k: pd.Categorical.from_codes(np.full(len(df), -1), dtype=dtype)})
+                  for df in frames]
+    # Nullable integer columns missing from some frames are filled with NA and keep their type
+    return compact_trip_updates(pd.concat(frames, axis=0))
+
+
+def dataframe_to_arrow_ipc(df: pd.DataFrame) -> bytes:
+    """Serialise a DataFrame as an Arrow IPC stream, much cheaper to send between processes than a pickle."""
+    # Drop the pandas metadata, tables from different workers are concatenated with possibly different columns
+    table = pa.Table.from_pandas(df, preserve_index=False).replace_schema_metadata(None)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def arrow_ipc_to_table(content: bytes) -> pa.Table:
+    """Read an Arrow IPC stream written by dataframe_to_arrow_ipc, the table references the buffer without copying."""
+    return pa.ipc.open_stream(pa.py_buffer(content)).read_all()
+
+
+def list_archive_members(input_path: str) -> list[str]:
+    compression_type = get_compression_type(input_path)
+    if compression_type == "7z":
+        with py7zr.SevenZipFile(input_path, mode="r") as z:
+            return z.getnames()
+    elif compression_type == "zip":
+        with zipfile.ZipFile(input_path, 'r') as zip_ref:
+            return zip_ref.namelist()
+    raise ValueError(f"Unsupported compression type: {compression_type}")
+
+
+def list_archive_member_sizes(input_path: str) -> dict[str, int]:
+    """Uncompressed size in bytes of every file in the archive, by member name."""
+    compression_type = get_compression_type(input_path)
+    if compression_type == "7z":
+        with py7zr.SevenZipFile(input_path, mode="r") as z:
+            return {info.filename: info.uncompressed for info in z.list() if not info.is_directory}
+    elif compression_type == "zip":
+        with zipfile.ZipFile(input_path, 'r') as zip_ref:
+            return {info.filename: info.file_size for info in zip_ref.infolist() if not info.is_dir()}
+    raise ValueError(f"Unsupported compression type: {compression_type}")
+
+
+def iter_archive_members(input_path: str, target_groups: list[list[str]]):
+    """
+    Read groups of archive members into memory without extracting the archive to disk.
+
+    The archive is opened once and one group is decompressed at a time, so peak memory is bounded by the
+    largest group. Note that 7z archives are usually solid: every 7z read decompresses the stream up to the
+    last requested member, so fewer, larger groups mean less repeated decompression.
+
+    Args:
+        input_path (str): Path to a 7z or zip archive.
+        target_groups (list[list[str]]): Groups of member names as returned by list_archive_members.
+
+    Yields:
+        dict: Member name to file content (bytes) for each group, in the order of target_groups.
+    """
+    compression_type = get_compression_type(input_path)
+    if compression_type == "7z":
+        with py7zr.SevenZipFile(input_path, mode="r") as z:
+            for targets in target_groups:
+                contents = z.read(targets) or {}
+                z.reset()
+                yield {name: buffer.getvalue() for name, buffer in contents.items()}
+    elif compression_type == "zip":
+        with zipfile.ZipFile(input_path, 'r') as zip_ref:
+            for targets in target_groups:
+                yield {name: zip_ref.read(name) for name in targets}
+    else:
+        raise ValueError(f"Unsupported compression type: {compression_type}")
+
+
 def unzip_gtfs_archive(input_path: str, data_dir: str, remove_archive_after=False, force=False) -> str:
     print(f"Unzipping {input_path}")
     input_file = os.path.basename(input_path)
@@ -0,0 +1,195 @@
+import os
+import shutil
+import typing
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+import shared.parse as sp
+from shared.constants import OperatorsWithRT
+
+# Realtime trip updates of all sources as one Parquet dataset, partitioned like
+# {RT_STORE_DIR}/operator={operator}/date={YYYY-MM-DD}/hour={HH}/part-*.parquet
+# The date and hour are the UTC date and hour of the update timestamp, like the KoDa snapshot folders.
+RT_STORE_DIR = os.environ.get("RT_STORE_DIR", "./dev_data/rt_store")
+# Whether the pipelines add the trip updates they parse to the store
+WRITE_RT_STORE = os.environ.get("WRITE_RT_STORE", "False").lower() == "true"
+
+PARTITIONING = ds.partitioning(pa.schema([("operator", pa.string()), ("date", pa.string()), ("hour", pa.int8())]),
+                               flavor="hive")
+
+# Every file gets the same schema, columns missing from a day (e.g. all-empty ones dropped by sanitise_array)
+# are stored as nulls so that days can be read together
+_INT32_COLUMNS = ['direction_id', 'tripUpdate_delay', 'stop_sequence', 'arrival_delay', 'arrival_uncertainty',
+                  'departure_delay', 'departure_uncertainty']
+RT_STORE_SCHEMA = pa.schema(
+    [(k, pa.string()) for k in sp.TRIP_UPDATE_STRING_COLUMNS] +
+    [(k, pa.int32() if k in _INT32_COLUMNS else pa.int64()) for k in sp.TRIP_UPDATE_NUMERIC_COLUMNS] +
+    [('route_type', pa.int32())]
+)
+
+# Rows are sorted by route type and timestamp within an hour, so row group statistics let filters on either
+# skip most row groups
+ROW_GROUP_SIZE = 64 * 1024
+COMPACT_MIN_FILES = 2
+
+
+def get_partition_dir_path(operator: str, date: str, hour: int = None, store_dir=RT_STORE_DIR) -> str:
+    path = f"{store_dir}/operator={operator}/date={date}"
+    if hour is None:
+        return path
+    return f"{path}/hour={hour}"
+
+
+def _to_store_table(rt_df: pd.DataFrame, operator: str,
+                    route_types_map_df: pd.DataFrame = None) -> pa.Table:
+    if route_types_map_df is not None and 'route_type' not in rt_df.keys():
+        route_types = route_types_map_df.drop_duplicates('trip_id').set_index('trip_id')['route_type']
+        route_types.index = route_types.index.astype(str)
+        rt_df = rt_df.assign(route_type=rt_df['trip_id'].astype(str).map(route_types))
+
+    columns = {}
+    for field in RT_STORE_SCHEMA:
+        if field.name in rt_df.keys():
+            columns[field.name] = pa.array(rt_df[field.name], from_pandas=True).cast(field.type)
+        else:
+            columns[field.name] = pa.nulls(len(rt_df), field.type)
+    table = pa.table(columns, schema=RT_STORE_SCHEMA)
+
+    # Date and hour both come from the timestamp, so an update near midnight lands in the partition of its own day
+    timestamps = pc.cast(pc.multiply(table['timestamp'], 1000), pa.timestamp('ms', tz='UTC'))
+    table = table.append_column('operator', pa.array([operator] * len(table), pa.string()))
+    table = table.append_column('date', pc.strftime(timestamps, format='%Y-%m-%d'))
+    table = table.append_column('hour', pc.cast(pc.hour(timestamps), pa.int8()))
+    return table.sort_by([('date', 'ascending'), ('hour', 'ascending'), ('route_type', 'ascending'), ('timestamp', 'ascending')])
+
+
+def write_rt_partition(rt_df: pd.DataFrame, operator: OperatorsWithRT, date: str,
+                       route_types_map_df: pd.DataFrame = None, append=False, store_dir=RT_STORE_DIR) -> int:
+    """
+    Write the trip updates of an operator and date to the store.
+
+    Args:
+        rt_df (pd.DataFrame): Trip updates as returned by read_rt_day_to_df.
+        operator (OperatorsWithRT): Operator of the updates.
+        date (str): Date the updates were read for (YYYY-MM-DD), its partition is replaced unless append is set.
+            Each update is stored under the UTC date and hour of its timestamp, so updates from around midnight
+            are added to the partitions of the neighbouring date.
+        route_types_map_df (pd.DataFrame, optional): trip_id to route_type map, stored with each update so that
+            reads can filter on it.
+        append (bool): Add the updates as new files instead of replacing the date, e.g. for live snapshots.
+            Run compact_rt_store to merge the resulting small files.
+        store_dir (str): Root of the store.
+
+    Returns:
+        int: Number of rows written.
+    """
+    if rt_df.empty or 'timestamp' not in rt_df.keys():
+        return 0
+    date_dir_path = get_partition_dir_path(operator.value, date, store_dir=store_dir)
+    if not append and os.path.exists(date_dir_path):
+        shutil.rmtree(date_dir_path)
+
+    table = _to_store_table(rt_df, operator.value, route_types_map_df)
+    ds.write_dataset(table, store_dir, format="parquet", partitioning=PARTITIONING,
+                     basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+                     existing_data_behavior="overwrite_or_ignore",
+                     file_options=ds.ParquetFileFormat().make_write_options(compression="zstd"),
+                     max_rows_per_group=ROW_GROUP_SIZE, min_rows_per_group=min(ROW_GROUP_SIZE, len(table)))
+    return len(table)
+
+
+def rt_store_dataset(store_dir=RT_STORE_DIR) -> ds.Dataset:
+    return ds.dataset(store_dir, format="parquet", partitioning=PARTITIONING, schema=pa.unify_schemas(
+        [RT_STORE_SCHEMA, PARTITIONING.schema]))
+
+
+def read_rt_store(operators: typing.Iterable[OperatorsWithRT] = None, start_date: str = None, end_date: str = None,
+                  columns: list[str] = None, filter: ds.Expression = None, store_dir=RT_STORE_DIR) -> pd.DataFrame:
+    """
+    Read trip updates from the store, only touching the partitions, row groups and columns that are needed.
+
+    Example, delays of all bus trip updates in March:
+        read_rt_store([OperatorsWithRT.X_TRAFIK], "2024-03-01", "2024-03-31",
+                      columns=["trip_id", "stop_id", "arrival_delay", "departure_delay"],
+                      filter=(ds.field("route_type") >= 700) & (ds.field("route_type") < 800))
+
+    Args:
+        operators (typing.Iterable[OperatorsWithRT], optional): Operators to read, all if None.
+        start_date (str, optional): First date to read (YYYY-MM-DD), inclusive.
+        end_date (str, optional): Last date to read (YYYY-MM-DD), inclusive.
+        columns (list[str], optional): Columns to read, all if None. Partition columns can be included.
+        filter (ds.Expression, optional): Additional row filter, pushed down to the row group statistics.
+        store_dir (str): Root of the store.
+
+    Returns:
+        pd.DataFrame: The matching trip updates.
+    """
+    if not os.path.exists(store_dir):
+        return pd.DataFrame(columns=columns)
+
+    expression = None
+    conditions = []
+    if operators is not None:
+        conditions.append(ds.field("operator").isin([operator.value for operator in operators]))
+    # ISO dates compare correctly as strings
+    if start_date is not None:
+        conditions.append(ds.field("date") >= start_date)
+    if end_date is not None:
+        conditions.append(ds.field("date") <= end_date)
+    if filter is not None:
+        conditions.append(filter)
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+
+    return rt_store_dataset(store_dir).to_table(columns=columns, filter=expression).to_pandas()
+
+
+def compact_rt_store(operator: OperatorsWithRT, start_date: str = None, end_date: str = None,
+                     store_dir=RT_STORE_DIR) -> int:
+    """
+    Merge the files of every hour partition that has been appended to more than once into a single file.
+
+    Returns:
+        int: Number of partitions compacted.
+    """
+    operator_dir_path = f"{store_dir}/operator={operator.value}"
+    if not os.path.exists(operator_dir_path):
+        return 0
+
+    compacted = 0
+    for date_dir in sorted(os.listdir(operator_dir_path)):
+        date = date_dir.removeprefix("date=")
+        if (start_date is not None and date < start_date) or (end_date is not None and date > end_date):
+            continue
+        date_dir_path = os.path.join(operator_dir_path, date_dir)
+        for hour_dir in sorted(os.listdir(date_dir_path)):
+            hour_dir_path = os.path.join(date_dir_path, hour_dir)
+            files = sorted(f for f in os.listdir(hour_dir_path) if f.endswith(".parquet"))
+            if len(files) < COMPACT_MIN_FILES:
+                continue
+
+            table = pa.concat_tables([pq.read_table(os.path.join(hour_dir_path, f), schema=RT_STORE_SCHEMA)
+                                      for f in files])
+            table = table.sort_by([('route_type', 'ascending'), ('timestamp', 'ascending')])
+            # Publish the merged file before removing the parts, an interrupted compaction then only leaves
+            # duplicate rows (dropped again by keep_only_latest_stop_updates), never missing ones
+            tmp_path = os.path.join(hour_dir_path, f".compact-{uuid.uuid4().hex}.tmp")
+            pq.write_table(table, tmp_path, compression="zstd", row_group_size=ROW_GROUP_SIZE)
+            os.replace(tmp_path, os.path.join(hour_dir_path, f"part-{uuid.uuid4().hex}-0.parquet"))
+            for f in files:
+                os.remove(os.path.join(hour_dir_path, f))
+            compacted += 1
+    return compacted
+
+
+if __name__ == "__main__":
+    OPERATOR = OperatorsWithRT(os.environ.get("OPERATOR", OperatorsWithRT.X_TRAFIK.value))
+    START_DATE = os.environ.get("START_DATE")
+    END_DATE = os.environ.get("END_DATE")
+    n_compacted = compact_rt_store(OPERATOR, START_DATE, END_DATE)
+    print(f"Compacted {n_compacted} partitions of {OPERATOR.value} in {RT_STORE_DIR}")
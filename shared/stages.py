@@ -0,0 +1,276 @@
+import collections
+import itertools
+import queue
+import threading
+import time
+import typing
+from concurrent.futures import CancelledError, Executor, Future
+
+_DONE = object()
+
+
+class Stage:
+    """
+    One step of run_stages, run by its own worker threads.
+
+    Args:
+        name (str): Name used in the stage statistics.
+        func (typing.Callable): Called with the output of the previous stage (or an input item for the first stage).
+        workers (int): Number of items this stage processes concurrently.
+        queue_size (int): Number of items that may wait for this stage. When the queue is full the previous stage
+            blocks, which is what keeps e.g. downloads from running arbitrarily far ahead of parsing.
+    """
+
+    def __init__(self, name: str, func: typing.Callable, workers=1, queue_size=1):
+        self.name = name
+        self.func = func
+        self.workers = max(workers, 1)
+        self.queue_size = max(queue_size, 1)
+        self.items = 0
+        self.failures = 0
+        self.busy_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _record(self, busy_seconds: float, blocked_seconds: float, failed: bool) -> None:
+        with self._lock:
+            self.items += 1
+            self.failures += int(failed)
+            self.busy_seconds += busy_seconds
+            self.blocked_seconds += blocked_seconds
+
+    def summary(self, elapsed_seconds: float) -> str:
+        """Throughput of the stage over a run that took elapsed_seconds."""
+        per_item = self.busy_seconds / self.items if self.items else 0.0
+        utilisation = self.busy_seconds / (elapsed_seconds * self.workers) if elapsed_seconds > 0 else 0.0
+        items_per_hour = self.items / elapsed_seconds * 3600 if elapsed_seconds > 0 else 0.0
+        return (f"{self.name}: {self.items} items ({self.failures} failed), {items_per_hour:.1f} items/h, "
+                f"{per_item:.1f}s/item, {utilisation:.0%} busy over {self.workers} workers, "
+                f"{self.blocked_seconds:.1f}s blocked by the next stage")
+
+
+class StageFailure:
+    """Passed through the remaining stages in place of the output of a stage that raised, item is the run input."""
+
+    def __init__(self, stage: str, item, error: Exception):
+        self.stage = stage
+        self.item = item
+        self.error = error
+
+    def __repr__(self):
+        return f"StageFailure(stage={self.stage!r}, error={self.error!r})"
+
+
+def _run_worker(stage: Stage, input_queue: queue.Queue, output_queue: queue.Queue, stop: threading.Event,
+                finished: typing.Callable) -> None:
+    while True:
+        entry = input_queue.get()
+        if entry is _DONE:
+            finished()
+            return
+        if stop.is_set():
+            continue
+
+        # Entries carry the input item they started from, so failures can name it
+        item, value = entry
+        start = time.perf_counter()
+        failed = False
+        if isinstance(value, StageFailure):
+            result = value
+        else:
+            try:
+                result = stage.func(value)
+            except Exception as e:
+                failed = True
+                result = StageFailure(stage.name, item, e)
+        busy_seconds = time.perf_counter() - start
+
+        output_queue.put((item, result))
+        stage._record(busy_seconds, time.perf_counter() - start - busy_seconds, failed)
+
+
+def run_stages(items: typing.Iterable, stages: list[Stage]) -> typing.Iterator:
+    """
+    Run items through stages connected by bounded queues, overlapping the stages of different items.
+
+    Each stage gets its own worker threads, so a network-bound stage (download, upload) of one item runs
+    while another item is in a CPU-bound stage. CPU-heavy stages should hand their work to a process pool.
+    Items may complete out of order when a stage has more than one worker.
+
+    Args:
+        items (typing.Iterable): Inputs of the first stage, consumed lazily.
+        stages (list[Stage]): Stages in order.
+
+    Yields:
+        Output of the last stage per item, or a StageFailure for items that failed in some stage.
+
+    Raises:
+        Exception: What iterating items raised, after the items it produced before have been yielded.
+    """
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=stage.queue_size) for stage in stages]
+    output_queue = queue.Queue()
+    next_queues = queues[1:] + [output_queue]
+
+    def make_finished(stage_index: int) -> typing.Callable:
+        remaining = [stages[stage_index].workers]
+        lock = threading.Lock()
+
+        def finished():
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                # Only close the next stage once every worker of this one is done
+                next_workers = stages[stage_index + 1].workers if stage_index + 1 < len(stages) else 1
+                for _ in range(next_workers):
+                    next_queues[stage_index].put(_DONE)
+        return finished
+
+    feed_errors = []
+
+    def feed():
+        try:
+            for item in items:
+                if stop.is_set():
+                    break
+                queues[0].put((item, item))
+        except Exception as e:
+            # Raised by the consumer once the items fed so far have come out of the stages
+            feed_errors.append(e)
+        finally:
+            for _ in range(stages[0].workers):
+                queues[0].put(_DONE)
+
+    # Daemon threads, so an abandoned run never keeps the interpreter alive
+    threads = [threading.Thread(target=feed, daemon=True, name="stage-feed")]
+    for i, stage in enumerate(stages):
+        finished = make_finished(i)
+        for worker in range(stage.workers):
+            threads.append(threading.Thread(target=_run_worker, daemon=True, name=f"stage-{stage.name}-{worker}",
+                                            args=(stage, queues[i], next_queues[i], stop, finished)))
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            entry = output_queue.get()
+            if entry is _DONE:
+                if feed_errors:
+                    raise feed_errors[0]
+                return
+            yield entry[1]
+    finally:
+        stop.set()
+
+
+def interleave(iterables: typing.Iterable[typing.Iterable]) -> typing.Iterator:
+    """
+    Round-robin over several iterables, e.g. the dates of each operator, until all of them are exhausted.
+
+    Fed into run_stages, every stage queue then alternates between the iterables instead of working through all
+    items of the first one before the others start.
+    """
+    iterators = collections.deque(iter(iterable) for iterable in iterables)
+    while iterators:
+        iterator = iterators.popleft()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            continue
+        yield item
+        iterators.append(iterator)
+
+
+class FairExecutor:
+    """
+    Shares an executor between keys (e.g. operators) so that the tasks of one key cannot starve the others.
+
+    Tasks wait here instead of in the executor's own queue, and are handed to it only while fewer than
+    max_in_flight tasks are running. The next task is taken from the key with the fewest running tasks, so a
+    small operator's snapshots start ahead of the backlog of a large one, while a key that is alone can still use
+    every worker.
+
+    Args:
+        executor (Executor): Executor that runs the tasks, e.g. the process pool of a backfill.
+        max_in_flight (int): Tasks handed to the executor at once, usually its number of workers.
+    """
+
+    def __init__(self, executor: Executor, max_in_flight: int):
+        self.executor = executor
+        self.max_in_flight = max(max_in_flight, 1)
+        self._pending = {}
+        self._running = collections.Counter()
+        self._in_flight = 0
+        self._order = itertools.count()
+        self._last_dispatch = {}
+        self._condition = threading.Condition()
+        # Tasks are handed over by one thread, executors may not accept submissions from their own callbacks
+        threading.Thread(target=self._dispatch, daemon=True, name="fair-executor").start()
+
+    def for_key(self, key) -> "KeyExecutor":
+        """Executor submitting tasks on behalf of key, pass it wherever an executor is expected."""
+        return KeyExecutor(self, key)
+
+    def submit(self, key, fn: typing.Callable, *args, **kwargs) -> Future:
+        future = Future()
+        with self._condition:
+            self._pending.setdefault(key, collections.deque()).append((future, fn, args, kwargs))
+            self._condition.notify()
+        return future
+
+    def _next_task(self) -> tuple:
+        # Fewest running tasks first, ties go to the key that waited longest since its last task started
+        key = min(self._pending, key=lambda k: (self._running[k], self._last_dispatch.get(k, -1)))
+        tasks = self._pending[key]
+        task = tasks.popleft()
+        if not tasks:
+            del self._pending[key]
+        self._running[key] += 1
+        self._in_flight += 1
+        self._last_dispatch[key] = next(self._order)
+        return key, task
+
+    def _dispatch(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending or self._in_flight >= self.max_in_flight:
+                    self._condition.wait()
+                key, (future, fn, args, kwargs) = self._next_task()
+            if not future.set_running_or_notify_cancel():
+                self._finished(key)
+                continue
+            try:
+                inner = self.executor.submit(fn, *args, **kwargs)
+            except Exception as e:
+                future.set_exception(e)
+                self._finished(key)
+                continue
+            inner.add_done_callback(lambda f, key=key, future=future: self._complete(key, future, f))
+
+    def _complete(self, key, future: Future, inner: Future) -> None:
+        self._finished(key)
+        if inner.cancelled():
+            # The proxy is already running and can no longer be cancelled itself
+            future.set_exception(CancelledError())
+        elif inner.exception() is not None:
+            future.set_exception(inner.exception())
+        else:
+            future.set_result(inner.result())
+
+    def _finished(self, key) -> None:
+        with self._condition:
+            self._running[key] -= 1
+            self._in_flight -= 1
+            self._condition.notify()
+
+
+class KeyExecutor:
+    """The submit side of a FairExecutor for one key, see FairExecutor.for_key."""
+
+    def __init__(self, fair_executor: FairExecutor, key):
+        self.fair_executor = fair_executor
+        self.key = key
+
+    def submit(self, fn: typing.Callable, *args, **kwargs) -> Future:
+        return self.fair_executor.submit(self.key, fn, *args, **kwargs)
@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+# Intermediate DataFrames are stored in two tiers:
+# - hot: uncompressed Feather, cheap to write and read with memory mapping instead of being decompressed
+# - cold: zstd level 9, small on disk but slow to write and fully decompressed on every read
+# Files are written hot and demote_cold_files recompresses the ones that have not been used for a while.
+HOT = "hot"
+COLD = "cold"
+# Tier new files are written in, "cold" writes everything compressed like before the tiers existed
+STORAGE_TIER = os.environ.get("STORAGE_TIER", HOT)
+# Hot files not read or written for this long are demoted
+COLD_AFTER_SECONDS = int(os.environ.get("COLD_AFTER_HOURS", 6)) * 3600
+DEMOTE_INTERVAL_SECONDS = int(os.environ.get("DEMOTE_INTERVAL_SECONDS", 600))
+
+COLD_COMPRESSION = "zstd"
+COLD_COMPRESSION_LEVEL = 9
+
+# The tier is kept in the schema metadata, files without it predate the tiers and were written compressed
+_TIER_KEY = b"storage_tier"
+
+
+def _get_tmp_path(path: str) -> str:
+    return f"{path}.{uuid.uuid4().hex}.tmp"
+
+
+def _write_table(table: pa.Table, path: str, tier: str) -> None:
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), _TIER_KEY: tier.encode()})
+    if tier == COLD:
+        feather.write_feather(table, path, compression=COLD_COMPRESSION, compression_level=COLD_COMPRESSION_LEVEL)
+    else:
+        feather.write_feather(table, path, compression="uncompressed")
+
+
+def write_feather(df: pd.DataFrame, path: str, tier: str = None) -> None:
+    """Write df to path in the given tier, STORAGE_TIER if None. Drop-in for df.to_feather(path, ...)."""
+    # Write next to the target and rename, so readers (and demotion) never see a partial file
+    tmp_path = _get_tmp_path(path)
+    _write_table(pa.Table.from_pandas(df), tmp_path, tier or STORAGE_TIER)
+    os.replace(tmp_path, path)
+
+
+def read_feather(path: str, columns: list[str] = None) -> pd.DataFrame:
+    """
+    Read a Feather file written by write_feather (or df.to_feather), marking it as recently used.
+
+    The file is memory-mapped, so uncompressed (hot) columns are not copied into memory but paged in from the
+    file as they are used.
+    """
+    table = feather.read_table(path, columns=columns, memory_map=True)
+    # Explicitly, as atime updates are usually disabled or relaxed by the mount options
+    os.utime(path, (time.time(), os.stat(path).st_mtime))
+    return table.to_pandas(split_blocks=True)
+
+
+def get_tier(path: str) -> str:
+    """Tier of a Feather file, only its footer is read."""
+    with pa.memory_map(path) as source:
+        metadata = pa.ipc.open_file(source).schema.metadata or {}
+    return metadata.get(_TIER_KEY, COLD.encode()).decode()
+
+
+def demote_file(path: str) -> bool:
+    """Rewrite a hot file compressed, unless it was changed in the meantime. Returns True if it was demoted."""
+    stat = os.stat(path)
+    tmp_path = _get_tmp_path(path)
+    _write_table(feather.read_table(path, memory_map=True), tmp_path, COLD)
+
+    current = os.stat(path)
+    if (current.st_ino, current.st_mtime_ns) != (stat.st_ino, stat.st_mtime_ns):
+        # Rewritten by a pipeline while compressing, the new contents win
+        os.remove(tmp_path)
+        return False
+    os.replace(tmp_path, path)
+    # Keep the access times, the file stays cold until it is used again
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    return True
+
+
+def demote_cold_files(root_dir: str, cold_after_seconds=COLD_AFTER_SECONDS) -> (int, int):
+    """
+    Recompress the hot Feather files under root_dir that have not been read or written for cold_after_seconds.
+
+    Returns:
+        (int, int): Number of files demoted and the bytes saved.
+    """
+    demoted = 0
+    saved_bytes = 0
+    now = time.time()
+    for root, _, files in os.walk(root_dir):
+        for file in files:
+            if not file.endswith(".feather"):
+                continue
+            path = os.path.join(root, file)
+            try:
+                stat = os.stat(path)
+                if now - max(stat.st_atime, stat.st_mtime) < cold_after_seconds or get_tier(path) != HOT:
+                    continue
+                if demote_file(path):
+                    demoted += 1
+                    saved_bytes += stat.st_size - os.path.getsize(path)
+            except (FileNotFoundError, pa.ArrowInvalid) as e:
+                # Removed by a pipeline in the meantime, or not a Feather V2 file
+                print(f"Skipping demotion of {path}. {e}")
+    return demoted, saved_bytes
+
+
+def start_background_demotion(root_dir: str, cold_after_seconds=COLD_AFTER_SECONDS,
+                              interval_seconds=DEMOTE_INTERVAL_SECONDS) -> threading.Event:
+    """Run demote_cold_files on root_dir every interval_seconds in a daemon thread, until the returned event is set."""
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval_seconds):
+            demoted, saved_bytes = demote_cold_files(root_dir, cold_after_seconds)
+            if demoted:
+                print(f"Demoted {demoted} files in {root_dir}, saved {saved_bytes / 2 ** 20:.1f} MiB")
+
+    threading.Thread(target=run, daemon=True, name="storage-demotion").start()
+    return stop
+
+
+if __name__ == "__main__":
+    DEMOTE_DIR = os.environ.get("DEMOTE_DIR", "./dev_data")
+    n_demoted, n_saved_bytes = demote_cold_files(DEMOTE_DIR)
+    print(f"Demoted {n_demoted} files in {DEMOTE_DIR}, saved {n_saved_bytes / 2 ** 20:.1f} MiB")
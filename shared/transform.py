@@ -1,5 +1,8 @@
 import pandas as pd
+import pyarrow as pa
+from pandas.api.types import is_numeric_dtype
 
+import shared.parse as sp
 from shared.constants import route_types
 
 
@@ -18,16 +21,23 @@ def create_stop_count_df(date: str, stop_times_df: pd.DataFrame, route_types_map
     # Drop rows with missing arrival_time
     stop_times_df = stop_times_df.dropna(subset=['arrival_time'])
 
-    # Ensure trip_ids are integers for both DataFrames and merge them
-    stop_times_df['trip_id'] = stop_times_df['trip_id'].astype(str)
+    # Ensure trip_ids are strings for both DataFrames and merge them (typed reads already have string categories)
+    if not isinstance(stop_times_df['trip_id'].dtype, pd.CategoricalDtype):
+        stop_times_df['trip_id'] = stop_times_df['trip_id'].astype(str)
     route_types_map_df['trip_id'] = route_types_map_df['trip_id'].astype(str)
     stop_times_df = stop_times_df.merge(route_types_map_df, on='trip_id', how='inner')
 
+    # Untyped reads still hold HH:MM:SS strings
+    if not is_numeric_dtype(stop_times_df['arrival_time']):
+        stop_times_df['arrival_time'] = sp.gtfs_time_to_seconds(
+            pa.chunked_array([pa.array(stop_times_df['arrival_time'], type=pa.string())])).to_pandas()
+
     # Remove arrival_times > 24:00:00 (valid in GTFS but not in pandas and not useful for our purposes)
-    stop_times_df = stop_times_df[stop_times_df['arrival_time'] < '24:00:00']
+    stop_times_df = stop_times_df[stop_times_df['arrival_time'] < 24 * 3600]
 
     # Set up arrival_time as our index and main datetime column
-    stop_times_df['arrival_time'] = pd.to_datetime(date + ' ' + stop_times_df['arrival_time'])
+    stop_times_df['arrival_time'] = pd.Timestamp(date) + pd.to_timedelta(
+        stop_times_df['arrival_time'].astype('int64'), unit='s')
     stop_times_df.sort_values(by='arrival_time', inplace=True)
     stop_times_df.set_index('arrival_time', inplace=True)
 
@@ -38,6 +48,66 @@ def create_stop_count_df(date: str, stop_times_df: pd.DataFrame, route_types_map
     return stop_count_df
 
 
+def create_service_stop_count_df(stop_times_df: pd.DataFrame, trips_df: pd.DataFrame,
+                                 route_types_map_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Date independent form of create_stop_count_df: scheduled stops per service_id, route_type and hour of day.
+
+    Computed once per static feed and turned into a date's stop counts with stop_count_df_for_date.
+    """
+    if stop_times_df.empty or trips_df.empty or route_types_map_df.empty:
+        raise ValueError("One or more DataFrames are empty")
+
+    stop_times_df = stop_times_df.dropna(subset=['arrival_time'])
+    if not isinstance(stop_times_df['trip_id'].dtype, pd.CategoricalDtype):
+        stop_times_df['trip_id'] = stop_times_df['trip_id'].astype(str)
+    route_types_map_df['trip_id'] = route_types_map_df['trip_id'].astype(str)
+    stop_times_df = stop_times_df[['trip_id', 'arrival_time']].merge(
+        route_types_map_df[['trip_id', 'route_type']], on='trip_id', how='inner')
+
+    if not is_numeric_dtype(stop_times_df['arrival_time']):
+        stop_times_df['arrival_time'] = sp.gtfs_time_to_seconds(
+            pa.chunked_array([pa.array(stop_times_df['arrival_time'], type=pa.string())])).to_pandas()
+    # Same cut-off as create_stop_count_df
+    stop_times_df = stop_times_df[stop_times_df['arrival_time'] < 24 * 3600]
+    stop_times_df['hour'] = (stop_times_df['arrival_time'] // 3600).astype('int64')
+
+    services_df = trips_df[['trip_id', 'service_id']].drop_duplicates(subset=['trip_id'])
+    services_df['trip_id'] = services_df['trip_id'].astype(str)
+    services_df['service_id'] = services_df['service_id'].astype(str)
+    stop_times_df = stop_times_df.merge(services_df, on='trip_id', how='left')
+    stop_times_df['service_id'] = stop_times_df['service_id'].fillna('')
+
+    service_stop_count_df = stop_times_df.groupby(['service_id', 'route_type', 'hour']).size().reset_index()
+    service_stop_count_df.columns = ['service_id', 'route_type', 'hour', 'stop_count']
+    return service_stop_count_df
+
+
+def stop_count_df_for_date(date: str, service_stop_count_df: pd.DataFrame, service_ids=None) -> pd.DataFrame:
+    """
+    Build the create_stop_count_df output for a date from per-service stop counts.
+
+    Args:
+        date (str): Date to stamp the hourly bins with (YYYY-MM-DD).
+        service_stop_count_df (pd.DataFrame): Output of create_service_stop_count_df.
+        service_ids: Services to count, all services (like create_stop_count_df) if None.
+
+    Returns:
+        pd.DataFrame: DataFrame with 'route_type', 'arrival_time' and 'stop_count' columns.
+    """
+    if service_ids is not None:
+        service_stop_count_df = service_stop_count_df[service_stop_count_df['service_id'].isin(service_ids)]
+    counts_df = service_stop_count_df.groupby(['route_type', 'hour'], as_index=False)['stop_count'].sum()
+    counts_df['arrival_time'] = pd.Timestamp(date) + pd.to_timedelta(counts_df['hour'], unit='h')
+    counts_df.set_index('arrival_time', inplace=True)
+
+    # Resample like create_stop_count_df does, so hours without stops inside a route type's day are 0
+    stop_count_df = counts_df.groupby('route_type')['stop_count'].resample('h').sum().reset_index()
+    stop_count_df.sort_values(by=['route_type', 'arrival_time'], inplace=True)
+    stop_count_df.columns = ['route_type', 'arrival_time', 'stop_count']
+    return stop_count_df
+
+
 def create_route_types_map_df(trips_df: pd.DataFrame, routes_df: pd.DataFrame) -> pd.DataFrame:
     if trips_df.empty or routes_df.empty:
         raise ValueError("One or more DataFrames are empty")
@@ -45,9 +115,11 @@ def create_route_types_map_df(trips_df: pd.DataFrame, routes_df: pd.DataFrame) -
     trips_df['trip_id'] = trips_df['trip_id'].astype(str)
 
     # Drop unnecessary columns
+    # Typed reads are already projected, so some of these may be missing
     map_df = trips_df.drop(columns=['service_id', 'trip_headsign', 'direction_id',
-                                      'shape_id'])
-    routes_df = routes_df.drop(columns=['agency_id', 'route_short_name', 'route_long_name', 'route_desc'])
+                                      'shape_id'], errors='ignore')
+    routes_df = routes_df.drop(columns=['agency_id', 'route_short_name', 'route_long_name', 'route_desc'],
+                               errors='ignore')
 
     # Drop route_type from routes_df if it exists
     if 'route_type' in map_df.keys():
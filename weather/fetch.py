@@ -1,3 +1,5 @@
+import os
+
 import openmeteo_requests
 from openmeteo_sdk.WeatherApiResponse import WeatherApiResponse
 
@@ -6,40 +8,49 @@ om_client = openmeteo_requests.Client()
 ARCHIVE_URL = "https://archive-api.open-meteo.com/v1/archive"
 FORECAST_URL = "https://api.open-meteo.com/v1/forecast"
 
+# Order of the variables in a response, see weather.parse
+HOURLY_VARIABLES = ["temperature_2m", "apparent_temperature", "precipitation", "rain", "snowfall", "snow_depth",
+                    "cloud_cover", "wind_speed_10m", "wind_speed_100m", "wind_gusts_10m"]
+# Locations per request, Open-Meteo answers several coordinates in one call with one response per location
+LOCATIONS_PER_REQUEST = int(os.environ.get("WEATHER_LOCATIONS_PER_REQUEST", 50))
+
+
+def fetch_locations(longitudes, latitudes, url: str, batch_size=LOCATIONS_PER_REQUEST,
+                    **params) -> list[WeatherApiResponse]:
+    """
+    Hourly weather of several locations, batch_size locations per request.
+
+    Args:
+        longitudes: Longitude per location.
+        latitudes: Latitude per location.
+        url (str): ARCHIVE_URL or FORECAST_URL.
+        batch_size (int): Locations per request.
+        **params: Further request parameters, e.g. start_date and end_date.
+
+    Returns:
+        list[WeatherApiResponse]: One response per location, in the order of the locations.
+    """
+    longitudes = [float(longitude) for longitude in longitudes]
+    latitudes = [float(latitude) for latitude in latitudes]
+    batch_size = max(batch_size, 1)
+    responses = []
+    for i in range(0, len(latitudes), batch_size):
+        responses += om_client.weather_api(url, params={
+            "latitude": latitudes[i:i + batch_size],
+            "longitude": longitudes[i:i + batch_size],
+            "hourly": HOURLY_VARIABLES,
+            **params,
+        })
+    return responses
+
 
 def fetch_weather_archive(longitude, latitude, start_date, end_date, url=ARCHIVE_URL) -> WeatherApiResponse:
-    params = {
-        "latitude": latitude,
-        "longitude": longitude,
-        "start_date": start_date,
-        "end_date": end_date,
-        "hourly": ["temperature_2m", "apparent_temperature", "precipitation", "rain", "snowfall", "snow_depth",
-                   "cloud_cover", "wind_speed_10m", "wind_speed_100m", "wind_gusts_10m"]
-    }
-    responses = om_client.weather_api(url, params=params)
-    # NOTE: There are only ever more than one response if we send multiple latitude/longitude pairs
-    return responses[0]
+    return fetch_locations([longitude], [latitude], url, start_date=start_date, end_date=end_date)[0]
 
 
 def fetch_recent_weather(longitude, latitude, start_date, end_date, url=FORECAST_URL) -> WeatherApiResponse:
-    params = {
-        "latitude": latitude,
-        "longitude": longitude,
-        "start_date": start_date,
-        "end_date": end_date,
-        "hourly": ["temperature_2m", "apparent_temperature", "precipitation", "rain", "snowfall", "snow_depth",
-                   "cloud_cover", "wind_speed_10m", "wind_speed_100m", "wind_gusts_10m"]
-    }
-    responses = om_client.weather_api(url, params=params)
-    return responses[0]
+    return fetch_locations([longitude], [latitude], url, start_date=start_date, end_date=end_date)[0]
 
 
 def fetch_forecast_weather(longitude, latitude, url=FORECAST_URL) -> WeatherApiResponse:
-    params = {
-        "latitude": latitude,
-        "longitude": longitude,
-        "hourly": ["temperature_2m", "apparent_temperature", "precipitation", "rain", "snowfall", "snow_depth",
-                   "cloud_cover", "wind_speed_10m", "wind_speed_100m", "wind_gusts_10m"]
-    }
-    responses = om_client.weather_api(url, params=params)
-    return responses[0]
\ No newline at end of file
+    return fetch_locations([longitude], [latitude], url)[0]
@@ -0,0 +1,58 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Weather is fetched for the cells of a regular latitude/longitude grid that contain stops instead of for every
+# stop. The default matches the 0.25 degree ERA5 grid behind the archive API, finer cells only repeat its values.
+GRID_DEGREES = float(os.environ.get("WEATHER_GRID_DEGREES", 0.25))
+
+# Cell indices are packed into one integer key, longitudes are offset so that the key stays unique
+_LONGITUDE_OFFSET = 1 << 20
+
+
+def cell_indices(latitudes: np.ndarray, longitudes: np.ndarray, degrees=GRID_DEGREES) -> (np.ndarray, np.ndarray):
+    """Row and column of the grid cell every coordinate falls in, cells are centered on multiples of degrees."""
+    rows = np.rint(np.asarray(latitudes, dtype=np.float64) / degrees).astype(np.int64)
+    columns = np.rint(np.asarray(longitudes, dtype=np.float64) / degrees).astype(np.int64)
+    return rows, columns
+
+
+def _cell_keys(rows: np.ndarray, columns: np.ndarray) -> np.ndarray:
+    return rows * (2 * _LONGITUDE_OFFSET) + (columns + _LONGITUDE_OFFSET)
+
+
+def build_grid(stop_location_map_df: pd.DataFrame, degrees=GRID_DEGREES) -> (pd.DataFrame, pd.DataFrame):
+    """
+    Grid cells covering the stops of an operator and the cell of every stop.
+
+    Args:
+        stop_location_map_df (pd.DataFrame): stop_id, stop_lat and stop_lon per stop, see
+            shared.transform.create_stop_location_map_df.
+        degrees (float): Width and height of a cell.
+
+    Returns:
+        (pd.DataFrame, pd.DataFrame): Cells (cell, grid_latitude, grid_longitude, stop_count), ordered by latitude
+            and longitude, and stops (stop_id, cell, grid_latitude, grid_longitude).
+    """
+    stops = stop_location_map_df.dropna(subset=['stop_lat', 'stop_lon'])
+    rows, columns = cell_indices(stops['stop_lat'].to_numpy(), stops['stop_lon'].to_numpy(), degrees)
+    keys, stop_cells, stop_counts = np.unique(_cell_keys(rows, columns), return_inverse=True, return_counts=True)
+    cell_rows = keys // (2 * _LONGITUDE_OFFSET)
+    cell_columns = keys % (2 * _LONGITUDE_OFFSET) - _LONGITUDE_OFFSET
+
+    cells_df = pd.DataFrame({
+        'cell': np.arange(len(keys)),
+        # Rounded, so the same cell has the same coordinates in every run and can be used as a key
+        'grid_latitude': np.round(cell_rows * degrees, 6),
+        'grid_longitude': np.round(cell_columns * degrees, 6),
+        'stop_count': stop_counts,
+    })
+    stop_cells_df = pd.DataFrame({
+        'stop_id': stops['stop_id'].to_numpy(),
+        'cell': stop_cells,
+        'grid_latitude': cells_df['grid_latitude'].to_numpy()[stop_cells],
+        'grid_longitude': cells_df['grid_longitude'].to_numpy()[stop_cells],
+    })
+    return cells_df, stop_cells_df
+
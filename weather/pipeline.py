@@ -1,13 +1,15 @@
 import pandas as pd
 
 import weather.fetch as wf
+import weather.grid as wg
 import weather.parse as wp
+import weather.store as ws
 from shared.constants import GAEVLE_LONGITUDE, GAEVLE_LATITUDE
 
 
 def get_recent_weather(start_date: str, end_date: str) -> pd.DataFrame:
-    response = wf.fetch_recent_weather(GAEVLE_LONGITUDE, GAEVLE_LATITUDE, start_date, end_date)
-    df = wp.parse_weather_response(response)
+    # Only the hours the local weather store does not hold yet are fetched
+    df = ws.get_weather(GAEVLE_LONGITUDE, GAEVLE_LATITUDE, start_date, end_date, source=ws.RECENT)
     df['hour'] = df['date'].dt.hour
     return df
 
@@ -20,7 +22,47 @@ def get_forecast_weather() -> pd.DataFrame:
 
 
 def get_historical_weather(start_date: str, end_date: str) -> pd.DataFrame:
-    response = wf.fetch_weather_archive(GAEVLE_LONGITUDE, GAEVLE_LATITUDE, start_date, end_date)
-    df = wp.parse_weather_response(response)
+    df = ws.get_weather(GAEVLE_LONGITUDE, GAEVLE_LATITUDE, start_date, end_date, source=ws.ARCHIVE)
     df['hour'] = df['date'].dt.hour
-    return df
\ No newline at end of file
+    return df
+
+
+def _get_regional_weather(stop_location_map_df: pd.DataFrame, degrees: float, source: str = None,
+                          **params) -> (pd.DataFrame, pd.DataFrame):
+    cells_df, stop_cells_df = wg.build_grid(stop_location_map_df, degrees)
+    if source is None:
+        responses = wf.fetch_locations(cells_df['grid_longitude'], cells_df['grid_latitude'], wf.FORECAST_URL)
+        df = wp.parse_weather_responses(responses)
+    else:
+        df = ws.get_weather_locations(cells_df['grid_longitude'], cells_df['grid_latitude'], source=source,
+                                      **params)
+    # Responses are in the order of the cells, so the location is the cell
+    df = df.rename(columns={'location': 'cell'})
+    df.insert(1, 'grid_latitude', cells_df['grid_latitude'].to_numpy()[df['cell'].to_numpy()])
+    df.insert(2, 'grid_longitude', cells_df['grid_longitude'].to_numpy()[df['cell'].to_numpy()])
+    df['hour'] = df['date'].dt.hour
+    return df, stop_cells_df
+
+
+def get_regional_recent_weather(stop_location_map_df: pd.DataFrame, start_date: str, end_date: str,
+                                degrees=wg.GRID_DEGREES) -> (pd.DataFrame, pd.DataFrame):
+    """
+    Recent weather per grid cell of an operator's stops, see weather.grid.build_grid.
+
+    Returns:
+        (pd.DataFrame, pd.DataFrame): Hourly weather per cell (cell, grid_latitude, grid_longitude, date, ...)
+            and the cell of every stop, to join the weather to stop level data on the cell.
+    """
+    return _get_regional_weather(stop_location_map_df, degrees, ws.RECENT, start_date=start_date, end_date=end_date)
+
+
+def get_regional_forecast_weather(stop_location_map_df: pd.DataFrame,
+                                  degrees=wg.GRID_DEGREES) -> (pd.DataFrame, pd.DataFrame):
+    """Forecast weather per grid cell of an operator's stops, see get_regional_recent_weather."""
+    return _get_regional_weather(stop_location_map_df, degrees)
+
+
+def get_regional_historical_weather(stop_location_map_df: pd.DataFrame, start_date: str, end_date: str,
+                                    degrees=wg.GRID_DEGREES) -> (pd.DataFrame, pd.DataFrame):
+    """Historical weather per grid cell of an operator's stops, see get_regional_recent_weather."""
+    return _get_regional_weather(stop_location_map_df, degrees, ws.ARCHIVE, start_date=start_date, end_date=end_date)
@@ -0,0 +1,226 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import shared.storage as ss
+import weather.fetch as wf
+import weather.parse as wp
+
+# Local weather archive. Every fetch is appended as a new part file to the month partitions it covers, and a
+# coverage index per location records the hours held, so only the hours missing from it are ever downloaded.
+#
+#   {WEATHER_STORE_DIR}/{source}/{location}/coverage.json        [[first_hour, end_hour), ...] in hours since epoch
+#   {WEATHER_STORE_DIR}/{source}/{location}/{YYYY-MM}/{ns}.feather
+WEATHER_STORE_DIR = os.environ.get("WEATHER_STORE_DIR", "./dev_data/openmeteo_data/weather_store")
+
+# Sources are kept apart, the forecast API's view of past hours is not the reanalysis of the archive API
+ARCHIVE = "archive"
+RECENT = "recent"
+_URLS = {ARCHIVE: wf.ARCHIVE_URL, RECENT: wf.FORECAST_URL}
+
+_HOUR = 3600
+_lock = threading.Lock()
+
+
+def get_location_key(longitude: float, latitude: float) -> str:
+    return f"{float(latitude):.4f}_{float(longitude):.4f}"
+
+
+def get_location_dir_path(source: str, longitude: float, latitude: float, store_dir=WEATHER_STORE_DIR) -> str:
+    return f"{store_dir}/{source}/{get_location_key(longitude, latitude)}"
+
+
+def get_coverage_path(source: str, longitude: float, latitude: float, store_dir=WEATHER_STORE_DIR) -> str:
+    return f"{get_location_dir_path(source, longitude, latitude, store_dir)}/coverage.json"
+
+
+def read_coverage(source: str, longitude: float, latitude: float, store_dir=WEATHER_STORE_DIR) -> list[list[int]]:
+    """Sorted, disjoint [first_hour, end_hour) ranges held for a location, in hours since the epoch."""
+    path = get_coverage_path(source, longitude, latitude, store_dir)
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _write_coverage(ranges: list[list[int]], source: str, longitude: float, latitude: float, store_dir: str):
+    path = get_coverage_path(source, longitude, latitude, store_dir)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(ranges, f)
+    os.replace(tmp_path, path)
+
+
+def merge_ranges(ranges: list) -> list[list[int]]:
+    """Union of [start, end) ranges as sorted, disjoint ranges, touching ranges are joined."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        elif end > start:
+            merged.append([start, end])
+    return merged
+
+
+def missing_ranges(coverage: list[list[int]], start: int, end: int) -> list[list[int]]:
+    """The parts of [start, end) not covered by coverage."""
+    missing = []
+    for covered_start, covered_end in coverage:
+        if covered_end <= start:
+            continue
+        if covered_start >= end:
+            break
+        if covered_start > start:
+            missing.append([start, covered_start])
+        start = max(start, covered_end)
+    if start < end:
+        missing.append([start, end])
+    return missing
+
+
+def _hours(dates: pd.Series) -> np.ndarray:
+    # Independent of the time unit the dates were read back with
+    hours = (pd.to_datetime(dates, utc=True) - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(hours=1)
+    return hours.to_numpy(np.int64)
+
+
+def _date_range_hours(start_date: str, end_date: str) -> (int, int):
+    # Open-Meteo dates are inclusive and hours are in UTC
+    start = int(pd.Timestamp(start_date, tz='UTC').timestamp()) // _HOUR
+    end = int((pd.Timestamp(end_date, tz='UTC') + pd.Timedelta(days=1)).timestamp()) // _HOUR
+    return start, end
+
+
+def append_weather(df: pd.DataFrame, source: str, longitude: float, latitude: float, store_dir=WEATHER_STORE_DIR,
+                   until: pd.Timestamp = None) -> None:
+    """
+    Append the hourly weather of a location to the store and add its hours to the coverage index.
+
+    Args:
+        df (pd.DataFrame): Hourly weather with a UTC date column, see weather.parse.parse_weather_response.
+        source (str): ARCHIVE or RECENT.
+        longitude (float): Longitude of the location.
+        latitude (float): Latitude of the location.
+        store_dir (str): Store root.
+        until (pd.Timestamp, optional): Hours from here on are stored but not marked as covered, e.g. the
+            forecast part of a response, so that they are fetched again once they are in the past.
+    """
+    if df.empty:
+        return
+    location_dir = get_location_dir_path(source, longitude, latitude, store_dir)
+    hours = np.sort(_hours(df['date']))
+    months = df['date'].dt.strftime('%Y-%m')
+    with _lock:
+        # Parts first, a crash before the index is written only means the hours are fetched again
+        part_name = f"{time.time_ns()}.feather"
+        for month, month_df in df.groupby(months, sort=False):
+            os.makedirs(f"{location_dir}/{month}", exist_ok=True)
+            ss.write_feather(month_df.reset_index(drop=True), f"{location_dir}/{month}/{part_name}")
+
+        if until is not None:
+            hours = hours[hours < int(until.timestamp()) // _HOUR]
+        # Only the hours actually returned are covered, hours the source has no values for yet stay missing
+        runs = np.flatnonzero(np.diff(hours) != 1) + 1
+        new_ranges = [[int(run[0]), int(run[-1]) + 1] for run in np.split(hours, runs) if len(run) > 0]
+        coverage = read_coverage(source, longitude, latitude, store_dir)
+        _write_coverage(merge_ranges(coverage + new_ranges), source, longitude, latitude, store_dir)
+
+
+def read_weather(source: str, longitude: float, latitude: float, start_date: str, end_date: str,
+                 store_dir=WEATHER_STORE_DIR) -> pd.DataFrame:
+    """
+    Stored hourly weather of a location between two dates (inclusive).
+
+    Only the month partitions of the range are read, when an hour was stored more than once the latest part wins.
+    """
+    location_dir = get_location_dir_path(source, longitude, latitude, store_dir)
+    start, end = _date_range_hours(start_date, end_date)
+    months = pd.period_range(pd.Timestamp(start_date), pd.Timestamp(end_date), freq='M').strftime('%Y-%m')
+    parts = []
+    for month in months:
+        month_dir = f"{location_dir}/{month}"
+        if not os.path.isdir(month_dir):
+            continue
+        # Part names are write times, so later parts come last
+        for name in sorted(os.listdir(month_dir)):
+            if name.endswith(".feather"):
+                parts.append(ss.read_feather(f"{month_dir}/{name}"))
+    if not parts:
+        return pd.DataFrame(columns=['date'] + wf.HOURLY_VARIABLES)
+
+    df = pd.concat(parts, ignore_index=True)
+    hours = _hours(df['date'])
+    df = df[(hours >= start) & (hours < end)]
+    df = df.drop_duplicates(subset='date', keep='last').sort_values('date', kind='stable')
+    return df.reset_index(drop=True)
+
+
+def get_weather_locations(longitudes, latitudes, start_date: str, end_date: str, source=ARCHIVE,
+                          store_dir=WEATHER_STORE_DIR) -> pd.DataFrame:
+    """
+    Hourly weather of several locations between two dates (inclusive), fetching only what the store is missing.
+
+    The missing hours of every location are widened to whole days, as Open-Meteo takes dates. Locations missing
+    the same days are fetched together in batched multi-location requests.
+
+    Returns:
+        pd.DataFrame: Hourly weather with a location column holding the position of the location in the input.
+    """
+    longitudes = [float(longitude) for longitude in longitudes]
+    latitudes = [float(latitude) for latitude in latitudes]
+    start, end = _date_range_hours(start_date, end_date)
+
+    gaps = {}
+    for location, (longitude, latitude) in enumerate(zip(longitudes, latitudes)):
+        coverage = read_coverage(source, longitude, latitude, store_dir)
+        for gap_start, gap_end in missing_ranges(coverage, start, end):
+            first_day = pd.Timestamp(gap_start * _HOUR, unit='s').strftime('%Y-%m-%d')
+            last_day = pd.Timestamp((gap_end - 1) * _HOUR, unit='s').strftime('%Y-%m-%d')
+            gaps.setdefault((first_day, last_day), []).append(location)
+
+    now = pd.Timestamp.now(tz='UTC')
+    for (first_day, last_day), locations in gaps.items():
+        print(f"Fetching {source} weather for {len(locations)} locations from {first_day} to {last_day}")
+        responses = wf.fetch_locations([longitudes[i] for i in locations], [latitudes[i] for i in locations],
+                                       _URLS[source], start_date=first_day, end_date=last_day)
+        fetched = wp.parse_weather_responses(responses)
+        for position, location_df in fetched.groupby('location', sort=False):
+            location = locations[position]
+            append_weather(location_df.drop(columns='location'), source, longitudes[location], latitudes[location],
+                           store_dir, until=now)
+
+    frames = []
+    for location, (longitude, latitude) in enumerate(zip(longitudes, latitudes)):
+        df = read_weather(source, longitude, latitude, start_date, end_date, store_dir)
+        df.insert(0, 'location', location)
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True)
+
+
+def get_weather(longitude: float, latitude: float, start_date: str, end_date: str, source=ARCHIVE,
+                store_dir=WEATHER_STORE_DIR) -> pd.DataFrame:
+    """get_weather_locations for one location."""
+    df = get_weather_locations([longitude], [latitude], start_date, end_date, source, store_dir)
+    return df.drop(columns='location')
+
+
+def import_weather(df: pd.DataFrame, longitude: float, latitude: float, source=ARCHIVE,
+                   store_dir=WEATHER_STORE_DIR) -> None:
+    """Add weather fetched elsewhere (e.g. the former weather.db.pickle) to the store."""
+    df = df.reset_index() if 'date' not in df.columns else df
+    columns = ['date'] + [column for column in wf.HOURLY_VARIABLES if column in df.columns]
+    append_weather(df[columns].dropna(), source, longitude, latitude, store_dir)
+
+
+if __name__ == "__main__":
+    # Import the pickle the notebooks used to keep, e.g. PICKLE_PATH=./dev_data/openmeteo_data/weather.db.pickle
+    from shared.constants import GAEVLE_LONGITUDE, GAEVLE_LATITUDE
+
+    pickle_path = os.environ.get("PICKLE_PATH", "./dev_data/openmeteo_data/weather.db.pickle")
+    legacy_df = pd.read_pickle(pickle_path)
+    import_weather(legacy_df, GAEVLE_LONGITUDE, GAEVLE_LATITUDE)
+    print(f"Imported {len(legacy_df)} hours from {pickle_path} to {WEATHER_STORE_DIR}")